@@ -0,0 +1,144 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+num_chromatin_states = 100
+# Coordinates absent from the segmentation are assigned U96
+missing_state = 95
+# Upper bound on the size of each int64 temporary of SegmentationIndex.get_states,
+# whose windows are looked up in sub-blocks of at most this many coordinates
+index_block_bytes = 32 << 20
+
+all_chroms = [f'chr{i}' for i in range(1, 23)] + ['chrX', 'chrY']
+
+
+def get_segmentation_filename(chrom):
+    return f'{chrom}_segmentation.bed'
+
+
+def get_cache_filename(segmentation_filename):
+    # e.g. chr1_segmentation.bed -> chr1_segmentation.npz
+    return os.path.splitext(segmentation_filename)[0] + '.npz'
+
+
+def parse_segmentation(segmentation_filename):
+    """
+    :param segmentation_filename: a file whose lines are of the form chromosome start end_exclusive state
+    separated by tabs or white spaces and sorted by start, e.g. chr19 0 60000 U96
+    :return: (starts, ends, states) where states are the 0-based state indices, i.e. U1 is 0
+    """
+    starts = []
+    ends = []
+    states = []
+    with open(segmentation_filename, 'r') as file:
+        for line in file:
+            tokens = line.split()
+            if not tokens:
+                continue
+            starts.append(int(tokens[1]))
+            ends.append(int(tokens[2]))
+            states.append(int(tokens[3][1:]) - 1)
+
+    starts = np.array(starts, dtype='int64')
+    ends = np.array(ends, dtype='int64')
+    if np.any(np.diff(starts) <= 0) or np.any(ends[:-1] > starts[1:]):
+        raise ValueError(f'The intervals in {segmentation_filename} have to be sorted and non-overlapping')
+    return starts, ends, np.array(states, dtype='uint8')
+
+
+def load_segmentation(segmentation_filename, use_cache=True):
+    """
+    Parses the segmentation file, caching the parsed arrays next to it in a .npz file
+    that is reused as long as it is newer than the segmentation file.
+
+    :return: (starts, ends, states), see parse_segmentation
+    """
+    cache_filename = get_cache_filename(segmentation_filename)
+    if use_cache and os.path.isfile(cache_filename) and \
+            os.path.getmtime(cache_filename) >= os.path.getmtime(segmentation_filename):
+        with np.load(cache_filename) as cache:
+            return cache['starts'], cache['ends'], cache['states']
+
+    starts, ends, states = parse_segmentation(segmentation_filename)
+    if use_cache:
+        np.savez(cache_filename, starts=starts, ends=ends, states=states)
+    return starts, ends, states
+
+
+class SegmentationIndex:
+    """
+    Interval index over the chr*_segmentation.bed files, loading each chromosome on first use.
+    """
+    def __init__(self, use_cache=True, get_filename=get_segmentation_filename):
+        self.use_cache = use_cache
+        self.get_filename = get_filename
+        self.intervals = {}
+
+    def get_intervals(self, chrom):
+        if chrom not in self.intervals:
+            self.intervals[chrom] = load_segmentation(self.get_filename(chrom), self.use_cache)
+        return self.intervals[chrom]
+
+    def get_states(self, chrom, window_starts, num_basepairs):
+        """
+        :param window_starts: the first coordinate of each window
+        :return: (states, num_missing) where states is a len(window_starts) x num_basepairs uint8 matrix
+        of the 0-based state of every coordinate, missing_state for the coordinates absent from the segmentation,
+        and num_missing is the number of such coordinates
+        """
+        window_starts = np.asarray(window_starts, dtype='int64')
+        states = np.empty((len(window_starts), num_basepairs), dtype='uint8')
+        num_missing = 0
+        # The int64 temporaries are num_basepairs times larger than window_starts, so they are bounded per sub-block
+        block_size = max(1, index_block_bytes // (8 * max(num_basepairs, 1)))
+        for first_window in range(0, len(window_starts), block_size):
+            stop_window = first_window + block_size
+            states[first_window:stop_window], block_num_missing = self.get_block_states(
+                chrom, window_starts[first_window:stop_window], num_basepairs)
+            num_missing += block_num_missing
+        return states, num_missing
+
+    def get_block_states(self, chrom, window_starts, num_basepairs):
+        """
+        Same as get_states, with int64 temporaries of len(window_starts) x num_basepairs
+        """
+        starts, ends, interval_states = self.get_intervals(chrom)
+        coordinates = window_starts[:, None] + np.arange(num_basepairs)
+
+        # the last interval starting at or before each coordinate
+        interval_indices = np.searchsorted(starts, coordinates, side='right') - 1
+        clipped_indices = np.maximum(interval_indices, 0)
+        is_present = (interval_indices >= 0) & (coordinates < ends[clipped_indices]) if len(starts) else \
+            np.zeros(coordinates.shape, dtype=bool)
+
+        states = np.full(coordinates.shape, missing_state, dtype='uint8')
+        states[is_present] = interval_states[clipped_indices[is_present]]
+        return states, int(coordinates.size - np.count_nonzero(is_present))
+
+    def get_window_states(self, chroms, window_starts, num_basepairs):
+        """
+        Same as get_states for windows on different chromosomes, grouping the windows by chromosome.
+        """
+        chroms = np.asarray(chroms)
+        window_starts = np.asarray(window_starts, dtype='int64')
+        states = np.empty((len(window_starts), num_basepairs), dtype='uint8')
+        num_missing = 0
+        for chrom in np.unique(chroms):
+            is_chrom = chroms == chrom
+            states[is_chrom], chrom_num_missing = self.get_states(chrom, window_starts[is_chrom], num_basepairs)
+            num_missing += chrom_num_missing
+        return states, num_missing
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('chroms', nargs='*', default=all_chroms,
+                        help='the chromosomes whose chr*_segmentation.bed files are parsed into the .npz caches')
+    args = parser.parse_args()
+    for chrom in args.chroms:
+        stamp = time.time()
+        filename = get_segmentation_filename(chrom)
+        num_intervals = len(load_segmentation(filename)[0])
+        print(f'=> cached {num_intervals} intervals of {filename} in {time.time() - stamp:.4f}s')
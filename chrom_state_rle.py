@@ -0,0 +1,133 @@
+import numpy as np
+
+from chrom_state_index import num_chromatin_states
+from hdf5_writer import create_feature_dataset, default_compression, get_filter_kwargs
+from reverse_complement import to_indices
+
+# The windows are stored in a CSR layout under a group:
+#   run_states: uint8 state of every run, the runs of window i being run_states[offsets[i]:offsets[i + 1]]
+#   run_lengths: uint16 number of base pairs of every run, summing to num_basepairs for every window
+#   offsets: int64 array of line_count + 1 run offsets
+# Most windows only span one to three segments, so a window takes a few bytes instead of
+# num_basepairs x num_chromatin_states bytes once one-hot encoded.
+rle_format = 'rle'
+run_chunk_size = 1 << 16
+
+
+def encode_runs(states):
+    """
+    :param states: num_windows x num_basepairs matrix of states
+    :return: (run_states, run_lengths, runs_per_window) for the windows concatenated in order
+    """
+    num_windows, num_basepairs = states.shape
+    is_run_start = np.ones(states.shape, dtype=bool)
+    is_run_start[:, 1:] = states[:, 1:] != states[:, :-1]
+    # Every window starts a run, so the runs never span two windows
+    run_starts = np.flatnonzero(is_run_start)
+    run_lengths = np.diff(np.append(run_starts, num_windows * num_basepairs))
+    return states.ravel()[run_starts].astype('uint8'), run_lengths.astype('uint16'), is_run_start.sum(axis=1)
+
+
+def decode_runs(run_states, run_lengths, num_basepairs):
+    """
+    :return: the num_windows x num_basepairs matrix of states of the runs returned by encode_runs
+    """
+    return np.repeat(run_states, run_lengths).reshape(-1, num_basepairs)
+
+
+def create_rle_group(hdf5_file, name, num_windows, num_basepairs, compression=default_compression,
+                     compression_level=None):
+    """
+    :return: a group holding the runs of num_windows windows, see RunLengthStateWriter
+    """
+    group = hdf5_file.create_group(name)
+    group.attrs['format'] = rle_format
+    group.attrs['num_basepairs'] = num_basepairs
+    group.attrs['num_states'] = num_chromatin_states
+    for run_name, dtype in (('run_states', 'uint8'), ('run_lengths', 'uint16')):
+        group.create_dataset(run_name, (0,), maxshape=(None,), dtype=dtype, chunks=(run_chunk_size,),
+                             **get_filter_kwargs(compression, compression_level))
+    offsets = create_feature_dataset(group, 'offsets', (num_windows + 1,), dtype='int64',
+                                     compression=compression, compression_level=compression_level)
+    offsets[0] = 0
+    return group
+
+
+class RunLengthStateWriter:
+    """
+    Appends blocks of consecutive windows to a group created by create_rle_group.
+    """
+    def __init__(self, group):
+        self.group = group
+        self.run_states = group['run_states']
+        self.run_lengths = group['run_lengths']
+        self.offsets = group['offsets']
+        self.num_windows = 0
+        self.num_runs = 0
+
+    def write(self, states):
+        """
+        :param states: num_windows x num_basepairs matrix of the states of the next windows
+        """
+        run_states, run_lengths, runs_per_window = encode_runs(states)
+        num_runs = self.num_runs + len(run_states)
+        self.run_states.resize((num_runs,))
+        self.run_lengths.resize((num_runs,))
+        self.run_states[self.num_runs:] = run_states
+        self.run_lengths[self.num_runs:] = run_lengths
+        self.offsets[self.num_windows + 1:self.num_windows + 1 + len(states)] = \
+            self.num_runs + np.cumsum(runs_per_window)
+        self.num_windows += len(states)
+        self.num_runs = num_runs
+
+
+class RunLengthStateView:
+    """
+    Read-only view of a group created by create_rle_group, expanding the runs of the requested windows on demand.
+    It serves the same samples as the dense datasets, i.e. num_basepairs states per window, or
+    num_basepairs x num_chromatin_states one-hot encodings with onehot=True.
+
+    Indexing with an int returns a single sample, indexing with a slice or a sequence of indices returns a batch.
+    """
+    def __init__(self, group, onehot=False):
+        self.group = group
+        self.onehot = onehot
+        self.num_basepairs = int(group.attrs['num_basepairs'])
+        self.num_states = int(group.attrs['num_states'])
+        self.run_states = group['run_states']
+        self.run_lengths = group['run_lengths']
+        # A single int64 per window, small enough to keep in memory
+        self.offsets = group['offsets'][:]
+        self.num_windows = len(self.offsets) - 1
+        sample_shape = (self.num_basepairs, self.num_states) if onehot else (self.num_basepairs,)
+        self.shape = (self.num_windows,) + sample_shape
+        self.dtype = np.dtype('uint8')
+        self.onehot_table = np.eye(self.num_states, dtype='uint8')
+
+    def __len__(self):
+        return self.num_windows
+
+    def get_states(self, indices):
+        """
+        :param indices: an int64 array of window indices
+        :return: the len(indices) x num_basepairs matrix of states of the windows
+        """
+        unique_indices, inverse = np.unique(indices, return_inverse=True)
+        states = np.empty((len(unique_indices), self.num_basepairs), dtype='uint8')
+        # Every run of consecutive windows is a single read of its runs
+        window_run_starts = np.flatnonzero(np.diff(unique_indices) != 1) + 1
+        for positions in np.split(np.arange(len(unique_indices)), window_run_starts):
+            if not len(positions):
+                continue
+            first_index, last_index = unique_indices[positions[0]], unique_indices[positions[-1]]
+            run_start, run_stop = self.offsets[first_index], self.offsets[last_index + 1]
+            states[positions] = decode_runs(self.run_states[run_start:run_stop],
+                                            self.run_lengths[run_start:run_stop], self.num_basepairs)
+        return states[inverse]
+
+    def __getitem__(self, item):
+        indices, is_single = to_indices(item, len(self))
+        samples = self.get_states(indices)
+        if self.onehot:
+            samples = self.onehot_table[samples]
+        return samples[0] if is_single else samples
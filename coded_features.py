@@ -0,0 +1,92 @@
+import numpy as np
+
+from hdf5_writer import create_feature_dataset
+from reverse_complement import ReverseComplementView, has_derived_revcomp, mark_derived_revcomp, read_rows, \
+    to_indices
+from window_encoding import code_table, decode_codes, get_num_packed_bytes, pack_codes, reverse_complement_codes, \
+    unpack_codes
+
+# onehot: seq_len x num_species x 5 uint8 per sample, with the reverse complement samples stored in the second half
+# code: seq_len x num_species nucleotide codes per sample, see window_encoding.nucleotide_codes
+# packed: the same codes packed into window_encoding.bits_per_code bits each
+# The code and packed datasets only store the forward strand, the reverse complement is derived when reading.
+feature_encodings = ('onehot', 'code', 'packed')
+
+
+def create_coded_dataset(group, name, num_samples, sample_shape, encoding, **compression_options):
+    """
+    :param sample_shape: the shape of the letters of a sample, e.g. (seq_len, num_species)
+    :param encoding: 'code' or 'packed'
+    :return: a dataset holding num_samples samples, tagged with its encoding and sample shape
+    """
+    if encoding == 'code':
+        shape = (num_samples,) + tuple(sample_shape)
+    elif encoding == 'packed':
+        shape = (num_samples, get_num_packed_bytes(int(np.prod(sample_shape))))
+    else:
+        raise ValueError(f'Unknown encoding {encoding}, expected code or packed')
+
+    dataset = create_feature_dataset(group, name, shape, **compression_options)
+    dataset.attrs['encoding'] = encoding
+    dataset.attrs['sample_shape'] = sample_shape
+    # The reverse complement is derived from the codes by CodedFeatureView
+    mark_derived_revcomp(dataset)
+    return dataset
+
+
+def encode_letters(letters, encoding):
+    """
+    :param letters: uint8 array of ASCII letters
+    :return: the sample to write to a dataset created by create_coded_dataset
+    """
+    codes = code_table[letters]
+    return pack_codes(codes) if encoding == 'packed' else codes
+
+
+class CodedFeatureView:
+    """
+    Read-only view of a dataset created by create_coded_dataset that serves the same samples as
+    the onehot encoding, i.e. 2 * num_samples samples of shape sample_shape + (5,)
+    where sample i + num_samples is the reverse complement of sample i.
+
+    Indexing with an int returns a single sample, indexing with a slice or a sequence of indices returns a batch.
+    """
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.encoding = dataset.attrs['encoding']
+        self.sample_shape = tuple(int(length) for length in dataset.attrs['sample_shape'])
+        self.num_samples = dataset.shape[0]
+        self.shape = (2 * self.num_samples,) + self.sample_shape + (5,)
+
+    def __len__(self):
+        return 2 * self.num_samples
+
+    def get_codes(self, indices):
+        """
+        :param indices: an int64 array of indices in [0, 2 * num_samples)
+        :return: the nucleotide codes of the samples, of shape (len(indices),) + sample_shape
+        """
+        stored = read_rows(self.dataset, indices % self.num_samples)
+        codes = unpack_codes(stored, self.sample_shape) if self.encoding == 'packed' else stored
+
+        is_revcomp = indices >= self.num_samples
+        codes[is_revcomp] = reverse_complement_codes(codes[is_revcomp], axis=1)
+        return codes
+
+    def __getitem__(self, item):
+        indices, is_single = to_indices(item, len(self))
+        samples = decode_codes(self.get_codes(indices))
+        return samples[0] if is_single else samples
+
+
+def open_feature_view(dataset):
+    """
+    :return: a CodedFeatureView if the dataset was written with the code or packed encoding,
+    a ReverseComplementView if the dataset only stores the forward strand, otherwise the dataset itself.
+    Either view serves 2N samples where sample i + N is the reverse complement of sample i.
+    """
+    if dataset.attrs.get('encoding', 'onehot') in ('code', 'packed'):
+        return CodedFeatureView(dataset)
+    if has_derived_revcomp(dataset):
+        return ReverseComplementView(dataset)
+    return dataset
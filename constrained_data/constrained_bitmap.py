@@ -0,0 +1,175 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+all_chroms = [f'chr{i}' for i in range(1, 23)] + ['chrX', 'chrY']
+# Upper bound on the size of each int64 temporary of ConstrainedBitmaps.get_states,
+# whose windows are looked up in sub-blocks of at most this many coordinates
+lookup_block_bytes = 32 << 20
+
+
+def get_text_filename(chrom, dirname='.'):
+    return os.path.join(dirname, f'{chrom}_phast_cons.txt')
+
+
+def get_bitmap_filename(chrom, dirname='.'):
+    return os.path.join(dirname, f'{chrom}_phast_cons.npy')
+
+
+def get_interval_from_line(line):
+    """
+    :param line: a line of phastConsElements100way.txt such as
+    585 chr1 11991 11995 lod=12 240
+    :return: chrom, start, end_exclusive
+    """
+    tokens = line.split()
+    return tokens[1], int(tokens[2]), int(tokens[3])
+
+
+def build_bitmap(starts, ends):
+    """
+    :return: the packed bitmap (np.packbits, big bit order) whose bit i is set
+    if and only if the coordinate i lies in one of the intervals [start, end_exclusive)
+    """
+    starts = np.asarray(starts, dtype='int64')
+    ends = np.asarray(ends, dtype='int64')
+    is_nonempty = starts < ends
+    order = np.argsort(starts[is_nonempty], kind='stable')
+    starts = starts[is_nonempty][order]
+    ends = np.maximum.accumulate(ends[is_nonempty][order]) if len(order) else ends[:0]
+    # Merges the overlapping and adjacent intervals, an interval starting a new merged interval
+    # if it starts after the furthest end of the intervals before it
+    is_merged_start = np.ones(len(starts), dtype=bool)
+    is_merged_start[1:] = starts[1:] > ends[:-1]
+    merged_starts = starts[is_merged_start]
+    merged_ends = ends[np.append(np.flatnonzero(is_merged_start)[1:] - 1, len(ends) - 1)] if len(ends) else ends
+
+    length = int(merged_ends[-1]) if len(merged_ends) else 0
+    # +1 at every start and -1 at every end of the disjoint merged intervals, the running sum being 1
+    # for the coordinates they cover and 0 elsewhere
+    boundaries = np.zeros(length + 1, dtype='int8')
+    boundaries[merged_starts] = 1
+    boundaries[merged_ends] = -1
+    return np.packbits(np.cumsum(boundaries[:-1], dtype='int8') > 0)
+
+
+class IntervalCollector:
+    """
+    Gathers the constrained element intervals of every chromosome while the lines are read,
+    then saves one bitmap per chromosome.
+    """
+    def __init__(self, chroms=all_chroms):
+        self.intervals = {chrom: ([], []) for chrom in chroms}
+
+    def add_line(self, line):
+        """
+        :return: False if the chromosome of the line is not one of the collected chromosomes
+        """
+        chrom, start, end_exclusive = get_interval_from_line(line)
+        if chrom not in self.intervals:
+            return False
+        starts, ends = self.intervals[chrom]
+        starts.append(start)
+        ends.append(end_exclusive)
+        return True
+
+    def save_bitmaps(self, dirname='.'):
+        for chrom, (starts, ends) in self.intervals.items():
+            np.save(get_bitmap_filename(chrom, dirname), build_bitmap(starts, ends))
+            print(f'-> {get_bitmap_filename(chrom, dirname)}: {len(starts)} constrained elements')
+
+
+def build_bitmap_file(chrom, dirname='.'):
+    """
+    Builds the bitmap of the chromosome from its chr*_phast_cons.txt file written by split_into_chroms.py
+    """
+    collector = IntervalCollector(chroms=[chrom])
+    with open(get_text_filename(chrom, dirname), 'r') as file:
+        for line in file:
+            collector.add_line(line)
+    collector.save_bitmaps(dirname)
+
+
+def is_bitmap_outdated(chrom, dirname='.'):
+    bitmap_filename = get_bitmap_filename(chrom, dirname)
+    text_filename = get_text_filename(chrom, dirname)
+    if not os.path.isfile(bitmap_filename):
+        return True
+    return os.path.isfile(text_filename) and os.path.getmtime(bitmap_filename) < os.path.getmtime(text_filename)
+
+
+class ConstrainedBitmaps:
+    """
+    Memory maps the bitmap of each chromosome on first use,
+    building it from the chr*_phast_cons.txt file if it is missing or older than the text file.
+
+    :param dirname: the directory of the chr*_phast_cons.txt and chr*_phast_cons.npy files
+    """
+    def __init__(self, dirname='.'):
+        self.dirname = dirname
+        self.bitmaps = {}
+
+    def get_bitmap(self, chrom):
+        if chrom not in self.bitmaps:
+            if is_bitmap_outdated(chrom, self.dirname):
+                build_bitmap_file(chrom, self.dirname)
+            self.bitmaps[chrom] = np.load(get_bitmap_filename(chrom, self.dirname), mmap_mode='r')
+        return self.bitmaps[chrom]
+
+    def get_states(self, chrom, window_starts, num_basepairs):
+        """
+        :param window_starts: the first coordinate of each window
+        :return: len(window_starts) x num_basepairs uint8 matrix, 1 for the coordinates in a constrained element
+        and 0 for the others, including those out of the chromosome
+        """
+        window_starts = np.asarray(window_starts, dtype='int64')
+        states = np.empty((len(window_starts), num_basepairs), dtype='uint8')
+        # The int64 temporaries are num_basepairs times larger than window_starts, so they are bounded per sub-block
+        block_size = max(1, lookup_block_bytes // (8 * max(num_basepairs, 1)))
+        for first_window in range(0, len(window_starts), block_size):
+            stop_window = first_window + block_size
+            states[first_window:stop_window] = self.get_block_states(chrom, window_starts[first_window:stop_window],
+                                                                     num_basepairs)
+        return states
+
+    def get_block_states(self, chrom, window_starts, num_basepairs):
+        """
+        Same as get_states, with int64 temporaries of len(window_starts) x num_basepairs
+        """
+        bitmap = self.get_bitmap(chrom)
+        coordinates = window_starts[:, None] + np.arange(num_basepairs)
+        byte_indices = coordinates >> 3
+        is_in_range = (coordinates >= 0) & (byte_indices < len(bitmap))
+        states = np.zeros(coordinates.shape, dtype='uint8')
+        # Only the pages of the memory map holding the windows are read
+        bytes_in_range = bitmap[byte_indices[is_in_range]]
+        states[is_in_range] = (bytes_in_range >> (7 - (coordinates[is_in_range] & 7))) & 1
+        return states
+
+    def get_window_states(self, chroms, window_starts, num_basepairs):
+        """
+        Same as get_states for windows on different chromosomes, grouping the windows by chromosome.
+        """
+        chroms = np.asarray(chroms)
+        window_starts = np.asarray(window_starts, dtype='int64')
+        states = np.empty((len(window_starts), num_basepairs), dtype='uint8')
+        for chrom in np.unique(chroms):
+            is_chrom = chroms == chrom
+            states[is_chrom] = self.get_states(chrom, window_starts[is_chrom], num_basepairs)
+        return states
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the bitmaps from the chr*_phast_cons.txt files, '
+                                                 'use python3 -m constrained_data.split_into_chroms --bitmap '
+                                                 'to build them from phastConsElements100way.txt directly')
+    parser.add_argument('chroms', nargs='*', default=all_chroms)
+    parser.add_argument('--phast-cons-dir', default='constrained_data',
+                        help='the directory of the chr*_phast_cons.txt and chr*_phast_cons.npy files')
+    args = parser.parse_args()
+    for chrom in args.chroms:
+        stamp = time.time()
+        build_bitmap_file(chrom, args.phast_cons_dir)
+        print(f'=> {chrom} done in {time.time() - stamp:.4f}s')
@@ -1,45 +1,52 @@
-def create_chrom_state_files():
-    file_dict = {}
-    # chromosome 1 to 22
-    for i in range(1, 23):
-        filename = f'chr{i}_phast_cons.txt'
-        file_dict[f'chr{i}'] = open(filename, 'w')
-    file_dict['chrX'] = open('chrX_phast_cons.txt', 'w')
-    file_dict['chrY'] = open('chrY_phast_cons.txt', 'w')
-    return file_dict
+import argparse
+import os
+import time
 
+from constrained_data.constrained_bitmap import IntervalCollector, all_chroms
+from constrained_data.table_splitter import (add_split_arguments, get_split_options, iterate_line_blocks,
+                                             print_progress, split_table)
 
-if __name__ == '__main__':
-    chrom_file_dict = create_chrom_state_files()
-    
-    linecount = 0
-    print('=> Getting total line count...')
-    with open('phastConsElements100way.txt', 'r') as file:
-        for _ in file:
-            linecount += 1
+
+def collect_bitmaps(filename, buffer_bytes, phast_cons_dir='constrained_data'):
+    """
+    Builds the bitmaps of all_chroms in a single pass over the table, skipping the other chromosomes,
+    and saves them to phast_cons_dir
+    """
+    interval_collector = IntervalCollector()
+    file_size = os.stat(filename).st_size
+    num_skipped = 0
+    stamp = time.time()
+    for lines, bytes_read in iterate_line_blocks(filename, buffer_bytes):
+        for line in lines:
+            if line.strip() and not interval_collector.add_line(line.decode()):
+                num_skipped += 1
+        print_progress(bytes_read, file_size, stamp, f'#skipped: {num_skipped}')
     
-    print('=> Splitting into chromosomes...')
-    error_set = set()
-    error_count = 0
-    with open('phastConsElements100way.txt', 'r') as file:
-        for index, line in enumerate(file):
-            tokens = line.split()
-            chrom = tokens[1]
-            
-            try:
-                chrom_file_dict[chrom].write(line)
-            except KeyError as error:
-                error_count += 1
-                if error not in error_set:
-                    error_set.add(error)
-                continue
-            
-            index += 1
-            if index % 1000 == 0:
-                print(f'[{index}/{linecount}] = {index/linecount:.2%} {chrom} #key_errors: {error_count}', end='\r')
+    print('\n=> Saving the bitmaps...')
+    interval_collector.save_bitmaps(phast_cons_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Splits phastConsElements100way.txt into chromosomes, '
+                                                 'run from the repository root with '
+                                                 'python3 -m constrained_data.split_into_chroms')
+    parser.add_argument('--filename', default=os.path.join('constrained_data', 'phastConsElements100way.txt'))
+    parser.add_argument('--phast-cons-dir', default='constrained_data',
+                        help='the directory of the chr*_phast_cons.txt or chr*_phast_cons.npy outputs')
+    parser.add_argument('--bitmap', action='store_true',
+                        help='write the chr*_phast_cons.npy bitmaps read by generate_constrained_element_data.py '
+                             'instead of the chr*_phast_cons.txt files, see constrained_bitmap.py')
+    # each line is of the form
+    # 585 chr1 11991 11995 lod=12 240
+    add_split_arguments(parser, output_format='{chrom}_phast_cons.txt', chrom_column=1, start_column=2,
+                        end_column=3)
+    args = parser.parse_args()
     
-    print('\n=> Closing chrom files...')
-    for file in chrom_file_dict.values():
-        file.close()
+    if args.bitmap:
+        collect_bitmaps(args.filename, args.buffer_bytes, args.phast_cons_dir)
+    else:
+        split_options = get_split_options(args)
+        split_options['output_format'] = os.path.join(args.phast_cons_dir, args.output_format)
+        split_table(args.filename, chroms=all_chroms, **split_options)
     
     print('=> Done')
@@ -0,0 +1,200 @@
+import argparse
+import os
+import time
+
+default_buffer_bytes = 16 << 20
+
+
+def iterate_line_blocks(filename, buffer_bytes=default_buffer_bytes):
+    """
+    Reads the file in blocks of about buffer_bytes.
+
+    :return: a generator of (lines, bytes_read) where lines is a list of complete lines as bytes
+    and bytes_read is the number of bytes read so far, for reporting progress without counting the lines first
+    """
+    bytes_read = 0
+    with open(filename, 'rb') as file:
+        while True:
+            lines = file.readlines(buffer_bytes)
+            if not lines:
+                return
+            bytes_read += sum(len(line) for line in lines)
+            yield lines, bytes_read
+
+
+def print_progress(bytes_read, file_size, stamp, message=''):
+    print(f'[{bytes_read}/{file_size}] = {bytes_read/max(file_size, 1):.2%} in {time.time() - stamp:.4f}s {message}',
+          end='\r')
+
+
+class ChromOutput:
+    """
+    The lines of one chromosome, buffered in memory and appended to its file once the buffer is full.
+    Also tracks whether the lines arrived sorted by start so that sorting can be skipped.
+    """
+    def __init__(self, filename, buffer_bytes):
+        self.filename = filename
+        self.buffer_bytes = buffer_bytes
+        self.file = open(filename, 'wb')
+        self.lines = []
+        self.num_buffered_bytes = 0
+        self.num_lines = 0
+        self.last_start = None
+        self.is_sorted = True
+
+    def add(self, line, start):
+        if self.last_start is not None and start < self.last_start:
+            self.is_sorted = False
+        self.last_start = start
+        self.lines.append(line)
+        self.num_buffered_bytes += len(line)
+        self.num_lines += 1
+        if self.num_buffered_bytes >= self.buffer_bytes:
+            self.flush()
+
+    def flush(self):
+        self.file.writelines(self.lines)
+        self.lines = []
+        self.num_buffered_bytes = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def get_interval(tokens, start_column, end_column):
+    return int(tokens[start_column]), int(tokens[end_column])
+
+
+def sort_file(filename, start_column, end_column, delimiter=None):
+    """
+    Sorts the lines of the file by (start, end_exclusive), keeping the lines with the same interval in file order.
+    """
+    with open(filename, 'rb') as file:
+        lines = file.readlines()
+    lines.sort(key=lambda line: get_interval(line.split(delimiter), start_column, end_column))
+    with open(filename, 'wb') as file:
+        file.writelines(lines)
+
+
+def validate_file(filename, start_column, end_column, delimiter=None):
+    """
+    Checks the invariants the binary searches rely on.
+
+    :return: (num_overlaps, num_empty) the number of lines overlapping the previous line
+    and the number of lines whose end_exclusive is not greater than their start
+    :raise ValueError: if the lines are not sorted by start
+    """
+    num_overlaps = num_empty = 0
+    previous_start = previous_end = None
+    with open(filename, 'rb') as file:
+        for line_index, line in enumerate(file):
+            start, end_exclusive = get_interval(line.split(delimiter), start_column, end_column)
+            if previous_start is not None:
+                if start < previous_start:
+                    raise ValueError(f'Line {line_index} of {filename} starts at {start} before the previous line '
+                                     f'starting at {previous_start}')
+                if start < previous_end:
+                    num_overlaps += 1
+            if end_exclusive <= start:
+                num_empty += 1
+            previous_start, previous_end = start, end_exclusive
+    return num_overlaps, num_empty
+
+
+def split_table(filename, output_format, chrom_column, start_column, end_column, chroms=None, delimiter=None,
+                sort=True, validate=True, buffer_bytes=default_buffer_bytes):
+    """
+    Splits a genome-wide table into one file per chromosome in a single pass over the table.
+
+    :param output_format: the output filename with a {chrom} field, e.g. '{chrom}_phast_cons.txt'
+    :param chrom_column: 0-based column of the chromosome, e.g. 1 for phastConsElements100way.txt
+    :param start_column: 0-based column of the start coordinate
+    :param end_column: 0-based column of the exclusive end coordinate
+    :param chroms: the chromosomes to write, the lines of the other chromosomes being counted and skipped,
+    None to write every chromosome of the table
+    :param delimiter: the column separator, None for any white space
+    :param sort: whether to sort the chromosomes whose lines are not sorted by start
+    :param validate: whether to check every output is sorted and count the overlapping and empty intervals
+    :param buffer_bytes: size of the blocks read from the table and of the buffer of each output
+    :return: a dict from each written chromosome to its number of lines, and a dict from each skipped
+    chromosome to its number of lines
+    """
+    if isinstance(delimiter, str):
+        delimiter = delimiter.encode()
+    file_size = os.stat(filename).st_size
+    outputs = {}
+    skipped_counts = {}
+    kept_chroms = None if chroms is None else set(chroms)
+    # Every kept chromosome gets a file, even when the table has none of its lines
+    for chrom in chroms or []:
+        outputs[chrom] = ChromOutput(output_format.format(chrom=chrom), buffer_bytes)
+
+    stamp = time.time()
+    print(f'=> Splitting {filename} into chromosomes...')
+    try:
+        for lines, bytes_read in iterate_line_blocks(filename, buffer_bytes):
+            for line in lines:
+                if not line.strip():
+                    continue
+                tokens = line.split(delimiter)
+                chrom = tokens[chrom_column].decode()
+                if kept_chroms is not None and chrom not in kept_chroms:
+                    skipped_counts[chrom] = skipped_counts.get(chrom, 0) + 1
+                    continue
+                if chrom not in outputs:
+                    outputs[chrom] = ChromOutput(output_format.format(chrom=chrom), buffer_bytes)
+                if not line.endswith(b'\n'):
+                    line += b'\n'
+                outputs[chrom].add(line, int(tokens[start_column]))
+            print_progress(bytes_read, file_size, stamp, f'#chroms: {len(outputs)} #skipped: '
+                                                         f'{sum(skipped_counts.values())}')
+    finally:
+        for output in outputs.values():
+            output.close()
+    print()
+
+    for output in outputs.values():
+        if sort and not output.is_sorted:
+            print(f'-> Sorting {output.filename}')
+            sort_file(output.filename, start_column, end_column, delimiter)
+        if validate:
+            num_overlaps, num_empty = validate_file(output.filename, start_column, end_column, delimiter)
+            if num_overlaps or num_empty:
+                print(f'-> {output.filename}: {num_overlaps} overlapping and {num_empty} empty intervals')
+
+    for chrom, count in sorted(skipped_counts.items()):
+        print(f'-> Skipped {count} lines of {chrom}')
+    print(f'=> Done in {time.time() - stamp:.4f}s')
+    return {chrom: output.num_lines for chrom, output in outputs.items()}, skipped_counts
+
+
+def add_split_arguments(parser, output_format, chrom_column, start_column, end_column):
+    """
+    Adds the options of split_table, the other arguments being the defaults of the table
+    """
+    parser.add_argument('--output-format', default=output_format,
+                        help='output filename with a {chrom} field')
+    parser.add_argument('--chrom-column', type=int, default=chrom_column, help='0-based chromosome column')
+    parser.add_argument('--start-column', type=int, default=start_column, help='0-based start column')
+    parser.add_argument('--end-column', type=int, default=end_column, help='0-based exclusive end column')
+    parser.add_argument('--delimiter', default=None, help='column separator, defaults to any white space')
+    parser.add_argument('--no-sort', action='store_true', help='keep the unsorted chromosomes as they are')
+    parser.add_argument('--no-validate', action='store_true', help='skip checking the sorted outputs')
+    parser.add_argument('--buffer-bytes', type=int, default=default_buffer_bytes)
+
+
+def get_split_options(args):
+    return dict(output_format=args.output_format, chrom_column=args.chrom_column, start_column=args.start_column,
+                end_column=args.end_column, delimiter=args.delimiter, sort=not args.no_sort,
+                validate=not args.no_validate, buffer_bytes=args.buffer_bytes)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Splits a genome-wide table such as a bed file into chromosomes')
+    parser.add_argument('filename')
+    parser.add_argument('--chroms', nargs='*', default=None,
+                        help='the chromosomes to keep, defaults to every chromosome of the table')
+    add_split_arguments(parser, output_format='{chrom}.txt', chrom_column=0, start_column=1, end_column=2)
+    args = parser.parse_args()
+    split_table(args.filename, chroms=args.chroms, **get_split_options(args))
@@ -0,0 +1,156 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+coord_filenames = ['train_coord', 'valid_coord', 'test_coord']
+
+
+def get_partition_filename(coord_filename):
+    # e.g. train_coord -> train_coord.npz
+    return coord_filename + '.npz'
+
+
+def get_source_stat(coord_filename):
+    # The size and the modification time in nanoseconds of the coordinate file, as stored in its index
+    stat = os.stat(coord_filename)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype='int64')
+
+
+class CoordPartition:
+    """
+    The lines of a coordinate file such as train_coord held as numpy arrays, see load_coord_partition:
+        chrom_names: the chromosomes in order of first appearance
+        chrom_ids: int32 index in chrom_names of the chromosome of every line
+        starts, stops: int64 coordinates of every line
+        rows: int64 row of every line in the file it was split from, e.g. coord for step1_split.py,
+        and the index of the line itself if the file was not written by step1_split.py
+    The lines of every chromosome are also grouped in file order, which is the order of the rows of
+    the data/{chrom}_{purpose} and chr*_{purpose}.*.hdf5 files of the chromosome.
+    """
+    def __init__(self, chrom_names, chrom_ids, starts, stops, rows):
+        self.chrom_names = list(chrom_names)
+        self.chrom_ids = chrom_ids
+        self.starts = starts
+        self.stops = stops
+        self.rows = rows
+        # The lines of chrom_names[i] are chrom_lines[chrom_offsets[i]:chrom_offsets[i + 1]]
+        self.chrom_lines = np.argsort(chrom_ids, kind='stable')
+        self.chrom_offsets = np.concatenate(([0], np.cumsum(np.bincount(chrom_ids,
+                                                                         minlength=len(self.chrom_names)))))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def get_chrom_lines(self, chrom):
+        """
+        :return: the int64 array of the indices of the lines of the chromosome in file order, empty if it has none
+        """
+        if chrom not in self.chrom_names:
+            return np.empty(0, dtype='int64')
+        chrom_id = self.chrom_names.index(chrom)
+        return self.chrom_lines[self.chrom_offsets[chrom_id]:self.chrom_offsets[chrom_id + 1]]
+
+    def get_chrom_starts(self, chrom):
+        return self.starts[self.get_chrom_lines(chrom)]
+
+    def get_line_chroms(self, first_line, stop_line):
+        return [self.chrom_names[chrom_id] for chrom_id in self.chrom_ids[first_line:stop_line]]
+
+    def iterate_blocks(self, block_size):
+        """
+        :return: a generator of (first_line_index, chroms, starts, stops) for blocks of block_size lines
+        """
+        for first_line in range(0, len(self), block_size):
+            stop_line = min(first_line + block_size, len(self))
+            yield first_line, self.get_line_chroms(first_line, stop_line), self.starts[first_line:stop_line], \
+                self.stops[first_line:stop_line]
+
+    def save(self, partition_filename, coord_filename):
+        """
+        :param coord_filename: the coordinate file the partition was read from, whose size and modification time
+        are saved along so that the index is only reused for this very file, see load_coord_partition
+        """
+        # Saved under a temporary name first so that an interrupted run never leaves a truncated index
+        temporary_filename = partition_filename + '.tmp.npz'
+        np.savez(temporary_filename, chrom_names=np.array(self.chrom_names), chrom_ids=self.chrom_ids,
+                 starts=self.starts, stops=self.stops, rows=self.rows, source_stat=get_source_stat(coord_filename))
+        os.replace(temporary_filename, partition_filename)
+
+
+class PartitionBuilder:
+    """
+    Gathers the lines of a coordinate file as they are written or read, see CoordPartition.
+    """
+    def __init__(self):
+        self.chrom_indices = {}
+        self.chrom_ids = []
+        self.starts = []
+        self.stops = []
+        self.rows = []
+
+    def add(self, chrom, start, stop, row):
+        if chrom not in self.chrom_indices:
+            self.chrom_indices[chrom] = len(self.chrom_indices)
+        self.chrom_ids.append(self.chrom_indices[chrom])
+        self.starts.append(start)
+        self.stops.append(stop)
+        self.rows.append(row)
+
+    def add_line(self, line, row):
+        tokens = line.split()
+        if not tokens:
+            return
+        self.add(tokens[0], int(tokens[1]), int(tokens[2]), row)
+
+    def build(self):
+        return CoordPartition(list(self.chrom_indices), np.array(self.chrom_ids, dtype='int32'),
+                              np.array(self.starts, dtype='int64'), np.array(self.stops, dtype='int64'),
+                              np.array(self.rows, dtype='int64'))
+
+
+def parse_coordinates(coord_filename):
+    """
+    :param coord_filename: a file whose lines start with chromosome start end_exclusive
+    """
+    builder = PartitionBuilder()
+    with open(coord_filename, 'r') as coord_file:
+        for line_index, line in enumerate(coord_file):
+            builder.add_line(line, line_index)
+    return builder.build()
+
+
+def load_coord_partition(coord_filename, use_cache=True, save_cache=False):
+    """
+    Reads the partition from the .npz index next to the coordinate file if it was saved for the same size and
+    modification time of the file, and parses the coordinate file otherwise.
+    step1_split.py and this script write the indices, the later stages only read them.
+
+    :param use_cache: False to always parse the coordinate file
+    :param save_cache: True to save the parsed partition as the index of the coordinate file
+    :return: a CoordPartition
+    """
+    partition_filename = get_partition_filename(coord_filename)
+    if use_cache and os.path.isfile(partition_filename):
+        with np.load(partition_filename) as partition:
+            if 'source_stat' in partition and \
+                    np.array_equal(partition['source_stat'], get_source_stat(coord_filename)):
+                return CoordPartition(partition['chrom_names'].tolist(), partition['chrom_ids'], partition['starts'],
+                                      partition['stops'], partition['rows'])
+
+    partition = parse_coordinates(coord_filename)
+    if save_cache:
+        partition.save(partition_filename, coord_filename)
+    return partition
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the partition index of the coordinate files')
+    parser.add_argument('coord_filenames', nargs='*', default=coord_filenames)
+    args = parser.parse_args()
+    for coord_filename in args.coord_filenames:
+        stamp = time.time()
+        partition = load_coord_partition(coord_filename, use_cache=False, save_cache=True)
+        print(f'=> {coord_filename}: {len(partition)} lines on {len(partition.chrom_names)} chromosomes '
+              f'in {time.time() - stamp:.4f}s')
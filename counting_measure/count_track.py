@@ -0,0 +1,78 @@
+import argparse
+import os
+
+import numpy as np
+
+from maf_store import MafStore, build_count_track, build_maf_store, get_store_dirname, has_maf_store
+
+all_chroms = [f'chr{i}' for i in range(1, 23)] + ['chrX', 'chrY']
+
+
+def get_alignment_filename(chrom, maf_dir='.'):
+    return os.path.join(maf_dir, f'{chrom}_maf_sequence.csv')
+
+
+def open_count_track(alignment_filename):
+    """
+    :return: the MafStore of the alignment file, first converting the file with maf_store.build_maf_store
+    and counting the letters with maf_store.build_count_track if needed
+    """
+    if not has_maf_store(alignment_filename):
+        build_maf_store(alignment_filename)
+    store = MafStore(get_store_dirname(alignment_filename))
+    if not store.has_count_track():
+        store.close()
+        build_count_track(get_store_dirname(alignment_filename))
+        store = MafStore(get_store_dirname(alignment_filename))
+    return store
+
+
+class CountTracks:
+    """
+    Opens the count track of each chromosome on first use, see open_count_track.
+    """
+    def __init__(self, maf_dir='.'):
+        self.maf_dir = maf_dir
+        self.stores = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for store in self.stores.values():
+            store.close()
+        self.stores = {}
+
+    def get_store(self, chrom):
+        if chrom not in self.stores:
+            self.stores[chrom] = open_count_track(get_alignment_filename(chrom, self.maf_dir))
+        return self.stores[chrom]
+
+    def get_window_counts(self, chroms, window_starts, num_basepairs):
+        """
+        :return: (counts, num_missing) where counts is a len(window_starts) x num_basepairs x 5 uint8 array
+        of the A G C T X counts of the non-human species, all zeros for the coordinates absent from the alignment,
+        and num_missing is the number of such coordinates
+        """
+        chroms = np.asarray(chroms)
+        window_starts = np.asarray(window_starts, dtype='int64')
+        counts = np.empty((len(window_starts), num_basepairs, 5), dtype='uint8')
+        num_missing = 0
+        for chrom in np.unique(chroms):
+            is_chrom = chroms == chrom
+            counts[is_chrom], found = self.get_store(chrom).get_count_windows(window_starts[is_chrom], num_basepairs)
+            num_missing += int(found.size - np.count_nonzero(found))
+        return counts, num_missing
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the count tracks of the chr*_maf_sequence.csv files')
+    parser.add_argument('chroms', nargs='*', default=all_chroms)
+    parser.add_argument('--maf-dir', default='.')
+    args = parser.parse_args()
+    for chrom in args.chroms:
+        open_count_track(get_alignment_filename(chrom, args.maf_dir)).close()
+    print('=> Done')
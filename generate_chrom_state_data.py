@@ -1,123 +1,52 @@
 import argparse
-import numpy as np
 import time
 import h5py
-import os
-from bed_binary_search import search, get_start_end_location_from_line, scan_through_line_for_number
+from chrom_state_index import SegmentationIndex
+from coord_partition import load_coord_partition
+from hdf5_writer import add_compression_arguments, create_feature_dataset, get_block_size, get_compression_options
 
-num_chromatin_states = 100
+flanking_number = 400
+num_basepairs = 1000
 
 
-def open_chrom_state_files():
-    file_dict = {}
-    # chromosome 1 to 22
-    for i in range(1, 23):
-        filename = f'chr{i}_segmentation.bed'
-        file_dict[f'chr{i}'] = open(filename, 'r'), os.stat(filename).st_size
-    file_dict['chrX'] = open('chrX_segmentation.bed', 'r'), os.stat('chrX_segmentation.bed').st_size
-    file_dict['chrY'] = open('chrY_segmentation.bed', 'r'), os.stat('chrY_segmentation.bed').st_size
+def generate(coord_filename, compression_options=None, use_cache=True):
+    """
+    :param use_cache: whether to cache the parsed chr*_segmentation.bed files in .npz files, see chrom_state_index
+    """
+    segmentation_index = SegmentationIndex(use_cache=use_cache)
     
-    return file_dict
-
-
-def close_file_dict(file_dict):
-    for file, _ in file_dict.values():
-        file.close()
-
-
-def get_chrom_state_mapping():
-    mapping = {}
-    for i in range(num_chromatin_states):
-        mapping[f'U{i+1}'] = i
-    return mapping
-
-
-def get_line_count(filename):
-    count = 0
-    with open(filename, 'r') as file:
-        for _ in file:
-            count += 1
-    return count
-
-
-def generate(coord_filename):
-    chrom_state_file_dict = open_chrom_state_files()
-    flanking_number = 400
-    chrom_state_mapping = get_chrom_state_mapping()
-    states_list = []
-    num_basepairs = 1000
-    
-    line_count = get_line_count(coord_filename)
+    partition = load_coord_partition(coord_filename)
+    line_count = len(partition)
     
     stamp = time.time()
     num_missing_states = 0
-    serializing_index = 0
     
-    with open(coord_filename, 'r') as coord_file, h5py.File('chrom_states.hdf5', 'w') as hdf5_file:
+    with h5py.File('chrom_states.hdf5', 'w') as hdf5_file:
         feature_group = hdf5_file.create_group('state')
         # uint8 is enough because there are only 100 states
-        feature_data = feature_group.create_dataset('data', (line_count, num_basepairs), dtype='uint8')
+        feature_data = create_feature_dataset(feature_group, 'data', (line_count, num_basepairs),
+                                              **(compression_options or {}))
         
-        for line_index, line in enumerate(coord_file):
-            tokens = line.split()
-            chrom, start, end_exclusive = tokens[0], int(tokens[1]), int(tokens[2])
-            real_start = start - flanking_number
-            real_end_exclusive = end_exclusive + flanking_number
+        for first_line_index, chroms, starts, _ in partition.iterate_blocks(get_block_size(feature_data)):
             # assert num_basepairs == real_end_exclusive - real_start
-            states = np.zeros(num_basepairs, dtype=np.int8)
-            collected_basepair_count = 0
-            coord_to_search = real_start
-            start_byteoffset_hint = None
-            file, file_bytesize = chrom_state_file_dict[chrom]
-            while collected_basepair_count < num_basepairs:
-                if start_byteoffset_hint:
-                    result = scan_through_line_for_number(file, start_byteoffset_hint, coord_to_search)
-                else:
-                    result = search(file, coord_to_search, file_bytesize)
-                
-                if not result:
-                    line = f'{chrom} {coord_to_search} {coord_to_search + 1} U96'
-                    num_missing_states += 1
-                else:
-                    line, start_byteoffset_hint = result
-                
-                start, end_exclusive = get_start_end_location_from_line(line)
-                state_value = chrom_state_mapping[line.strip().split()[-1]]
-                
-                repetitions = min(end_exclusive, real_end_exclusive) - coord_to_search
-                states[collected_basepair_count:collected_basepair_count + repetitions] = state_value
-                collected_basepair_count += repetitions
-                coord_to_search += repetitions
-            
-            states_list.append(states)
+            states, block_num_missing = segmentation_index.get_window_states(chroms, starts - flanking_number,
+                                                                             num_basepairs)
+            feature_data[first_line_index:first_line_index + len(states)] = states
+            num_missing_states += block_num_missing
             
-            if line_index % 100 == 1:
-                for vector in states_list:
-                    feature_data[serializing_index] = vector
-                    serializing_index += 1
-                
-                states_list = []
-                print(f'{line_index}/{line_count} = {line_index/line_count:.2%} in {time.time() - stamp:.4f}s'
-                      f' current serializing index: {serializing_index}',
-                      end='\r')
-        
-        # Serialze the remaining data
-        if states_list:
-            for vector in states_list:
-                feature_data[serializing_index] = vector
-                serializing_index += 1
-    
-            print(f'{serializing_index}/{line_count} = {serializing_index/line_count:.2%} in {time.time() - stamp:.4f}s'
-                  f' current serializing index: {serializing_index}',
+            num_written = first_line_index + len(states)
+            print(f'{num_written}/{line_count} = {num_written/line_count:.2%} in {time.time() - stamp:.4f}s'
+                  f' samples written: {num_written}',
                   end='\r')
          
     print(f'\n-> Number of missing states: {num_missing_states}')
-    
-    close_file_dict(chrom_state_file_dict)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('coord_filename')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='parse the chr*_segmentation.bed files without reading or writing their .npz caches')
+    add_compression_arguments(parser)
     args = parser.parse_args()
-    generate(args.coord_filename)
+    generate(args.coord_filename, compression_options=get_compression_options(args), use_cache=not args.no_cache)
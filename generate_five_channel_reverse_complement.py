@@ -1,32 +1,12 @@
-import numpy as np
 import h5py
 import argparse
 import time
 
+from hdf5_writer import add_compression_arguments, create_feature_dataset, get_compression_options
+from reverse_complement import complement_channel_permutation, write_reverse_complement
 
-def generate_five_channel_reverse_complement(chr, purpose):
-    complement_map = {
-        'a': 't',
-        't': 'a',
-        'c': 'g',
-        'g': 'c',
-        'A': 'T',
-        'T': 'A',
-        'C': 'G',
-        'G': 'C',
-        'N': 'N',
-        'n': 'n',
-        'X': 'X',
-        'x': 'x'
-    }
-    
-    a_array = np.array([1, 0, 0, 0, 0], dtype='uint8')
-    g_array = np.array([0, 1, 0, 0, 0], dtype='uint8')
-    c_array = np.array([0, 0, 1, 0, 0], dtype='uint8')
-    t_array = np.array([0, 0, 0, 1, 0], dtype='uint8')
-    x_array = np.array([0, 0, 0, 0, 1], dtype='uint8')
-    zero_array = np.array([0, 0, 0, 0, 0], dtype='uint8')
-    
+
+def generate_five_channel_reverse_complement(chr, purpose, compression_options=None):
     hdf5_filename = '{}_{}.five_channel.mix.hdf5'.format(chr, purpose)
     feature_key = 'feature/data'
     label_key = 'label/data'
@@ -38,53 +18,25 @@ def generate_five_channel_reverse_complement(chr, purpose):
     
     print('opening {} and creating {}'.format(hdf5_filename, rev_comp_filename))
     
-    with h5py.File(hdf5_filename, 'r') as hdf5_file, h5py.File(rev_comp_filename) as revcomp_file:
+    with h5py.File(hdf5_filename, 'r') as hdf5_file, h5py.File(rev_comp_filename, 'w') as revcomp_file:
         original_feature = hdf5_file[feature_key]
         print('feature has shape: ', original_feature.shape)
         num_samples = original_feature.shape[0]
         
         feature_group = revcomp_file.create_group('feature')
         # new_feature is the reverse complement data
-        new_feature = feature_group.create_dataset('data', (num_samples, number_of_speices, 1000, number_of_channels), dtype='uint8')
+        new_feature = create_feature_dataset(feature_group, 'data',
+                                             (num_samples, number_of_speices, 1000, number_of_channels),
+                                             **(compression_options or {}))
         
         print('=> copying the features')
         stamp = time.time()
-        
-        for sample_index in range(num_samples):
-            sample = original_feature[sample_index]
-            # sample should be of size number_of_speices x 1000 x number_of_channels
-            revcomp_matrix = np.zeros_like(sample, dtype='uint8')
-            
-            for species_index in range(number_of_speices):
-                species_row = revcomp_matrix[species_index]
-                
-                for nucleotide_index in range(1000):
-                    original_encoding = sample[species_index][nucleotide_index]
-                    
-                    if np.array_equal(original_encoding, a_array):
-                        species_row[999 - nucleotide_index] = t_array
-                    
-                    elif np.array_equal(original_encoding, g_array):
-                        species_row[999 - nucleotide_index] = c_array
-                    
-                    elif np.array_equal(original_encoding, c_array):
-                        species_row[999 - nucleotide_index] = g_array
-                    
-                    elif np.array_equal(original_encoding, t_array):
-                        species_row[999 - nucleotide_index] = a_array
-                        
-                    elif np.array_equal(original_encoding, x_array):
-                        species_row[999 - nucleotide_index] = x_array
-                    
-                    else:
-                        # all zeros
-                        species_row[999 - nucleotide_index] = zero_array
-            
-            new_feature[sample_index] = revcomp_matrix
-            
-            if sample_index % 1000 == 1:
-                print('{}/{} {:5f} done in {:2f}s'
-                      .format(sample_index, num_samples, sample_index / num_samples, time.time() - stamp))
+
+        # each sample is of size number_of_speices x 1000 x number_of_channels with the A G C T X channels,
+        # anything other than a one-hot encoding is written as all zeros
+        write_reverse_complement(original_feature, new_feature, complement_channel_permutation, axis=2,
+                                 only_one_hot=True)
+        print('=> copied the features in {:2f}s'.format(time.time() - stamp))
         
         print('=> copying the labels')
         label_group = revcomp_file.create_group('label')
@@ -97,5 +49,6 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('chr')
     parser.add_argument('purpose')
+    add_compression_arguments(parser)
     args = parser.parse_args()
-    generate_five_channel_reverse_complement(args.chr, args.purpose)
\ No newline at end of file
+    generate_five_channel_reverse_complement(args.chr, args.purpose, compression_options=get_compression_options(args))
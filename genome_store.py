@@ -0,0 +1,175 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+try:
+    import twobitreader
+except ImportError:
+    twobitreader = None
+
+padding_letter = 'N'
+# Number of letters compared at once when looking for the runs of a letter
+run_chunk_size = 1 << 24
+
+
+def get_cache_dirname(twobit_filename):
+    # e.g. hg19.2bit -> hg19.genome
+    return os.path.splitext(twobit_filename)[0] + '.genome'
+
+
+def get_chrom_filename(cache_dirname, chrom):
+    return os.path.join(cache_dirname, f'{chrom}.npy')
+
+
+class GenomeStore:
+    """
+    Serves the letters of a 2bit genome file such as hg19.2bit from one uint8 array of ASCII letters per chromosome.
+    Each chromosome is decoded with twobitreader the first time it is requested and saved as
+    <cache_dirname>/<chrom>.npy, later runs memory map the saved arrays without reading the 2bit file.
+    The letters are the same as those of twobitreader, i.e. the soft-masked regions are lowercase.
+    """
+    def __init__(self, twobit_filename='hg19.2bit', cache_dirname=None):
+        # Absolute paths so that the chromosomes can still be loaded after a change of the working directory
+        self.twobit_filename = os.path.abspath(twobit_filename)
+        self.cache_dirname = os.path.abspath(get_cache_dirname(twobit_filename) if cache_dirname is None
+                                             else cache_dirname)
+        self.twobit_file = None
+        self.chroms = {}
+        self.letter_runs = {}
+
+    def decode_chrom(self, chrom):
+        if twobitreader is None:
+            raise ImportError(f'Decoding {chrom} from {self.twobit_filename} requires the twobitreader package')
+        if self.twobit_file is None:
+            self.twobit_file = twobitreader.TwoBitFile(self.twobit_filename)
+
+        stamp = time.time()
+        sequence = self.twobit_file[chrom]
+        letters = np.frombuffer(sequence.get_slice(0, len(sequence)).encode('ascii'), dtype='uint8')
+
+        os.makedirs(self.cache_dirname, exist_ok=True)
+        chrom_filename = get_chrom_filename(self.cache_dirname, chrom)
+        # Saved under a temporary name first so that an interrupted run never leaves a truncated cache
+        temporary_filename = chrom_filename + '.tmp.npy'
+        np.save(temporary_filename, letters)
+        os.replace(temporary_filename, chrom_filename)
+        print(f'=> Decoded {len(letters)} letters of {chrom} into {chrom_filename} in {time.time() - stamp:.4f}s')
+
+    def get_chrom(self, chrom):
+        """
+        :return: the memory-mapped uint8 array of the ASCII letters of the chromosome
+        """
+        if chrom not in self.chroms:
+            chrom_filename = get_chrom_filename(self.cache_dirname, chrom)
+            if not os.path.isfile(chrom_filename):
+                self.decode_chrom(chrom)
+            self.chroms[chrom] = np.load(chrom_filename, mmap_mode='r')
+        return self.chroms[chrom]
+
+    def get_chrom_size(self, chrom):
+        return len(self.get_chrom(chrom))
+
+    def get_sequence(self, chrom, start, stop):
+        """
+        :return: the letters of [start, stop) as a str, truncated to the part within the chromosome
+        """
+        letters = self.get_chrom(chrom)
+        return letters[max(start, 0):max(stop, 0)].tobytes().decode('ascii')
+
+    def get_letter_runs(self, chrom, letter=padding_letter):
+        """
+        :return: (run_starts, run_stops) the int64 arrays of the [start, stop) intervals of the maximal runs of
+        the letter in the chromosome, sorted by start, e.g. the N gaps of the assembly
+        """
+        if (chrom, letter) not in self.letter_runs:
+            letters = self.get_chrom(chrom)
+            code = ord(letter)
+            boundaries = []
+            previous_is_letter = False
+            # In chunks so that only a chunk worth of booleans is held at once
+            for chunk_start in range(0, len(letters), run_chunk_size):
+                is_letter = letters[chunk_start:chunk_start + run_chunk_size] == code
+                is_boundary = is_letter != np.concatenate(([previous_is_letter], is_letter[:-1]))
+                boundaries.append(np.flatnonzero(is_boundary) + chunk_start)
+                previous_is_letter = bool(is_letter[-1])
+            if previous_is_letter:
+                boundaries.append([len(letters)])
+            boundaries = np.concatenate(boundaries).astype('int64') if boundaries else np.empty(0, dtype='int64')
+            self.letter_runs[chrom, letter] = boundaries[0::2], boundaries[1::2]
+        return self.letter_runs[chrom, letter]
+
+    def contains_letter(self, chrom, starts, stops, letter=padding_letter):
+        """
+        :return: the boolean array marking the windows [start, stop) holding the letter,
+        with a binary search of the runs of the letter instead of a scan of every window
+        """
+        run_starts, run_stops = self.get_letter_runs(chrom, letter)
+        starts = np.asarray(starts, dtype='int64')
+        stops = np.asarray(stops, dtype='int64')
+        if not len(run_starts):
+            return np.zeros(len(starts), dtype=bool)
+        # The first run ending after the start of each window is the only one that can overlap it
+        run_indices = np.searchsorted(run_stops, starts, side='right')
+        clipped_indices = np.minimum(run_indices, len(run_starts) - 1)
+        return (run_indices < len(run_starts)) & (run_starts[clipped_indices] < stops) & (starts < stops)
+
+    def get_windows(self, chrom, window_starts, window_length):
+        """
+        :param window_starts: the first coordinate of each window
+        :return: (windows, num_padded) where windows is a len(window_starts) x window_length uint8 matrix of
+        ASCII letters, the coordinates out of the chromosome being padded with padding_letter,
+        and num_padded counts the padded coordinates of each window
+        """
+        letters = self.get_chrom(chrom)
+        coordinates = np.asarray(window_starts, dtype='int64')[:, None] + np.arange(window_length)
+        is_in_range = (coordinates >= 0) & (coordinates < len(letters))
+        windows = np.full(coordinates.shape, ord(padding_letter), dtype='uint8')
+        # Only the pages of the memory map holding the windows are read
+        windows[is_in_range] = letters[coordinates[is_in_range]]
+        return windows, window_length - is_in_range.sum(axis=1)
+
+    def get_window_batch(self, chroms, window_starts, window_length):
+        """
+        Same as get_windows for windows on different chromosomes, grouping the windows by chromosome.
+        """
+        chroms = np.asarray(chroms)
+        window_starts = np.asarray(window_starts, dtype='int64')
+        windows = np.empty((len(window_starts), window_length), dtype='uint8')
+        num_padded = np.empty(len(window_starts), dtype='int64')
+        for chrom in np.unique(chroms):
+            is_chrom = chroms == chrom
+            windows[is_chrom], num_padded[is_chrom] = self.get_windows(chrom, window_starts[is_chrom], window_length)
+        return windows, num_padded
+
+    def get_window_list(self, chroms, window_starts, window_stops):
+        """
+        Same as get_window_batch for windows [start, stop) of different lengths, the windows of each length
+        are extracted together.
+        :return: (windows, num_padded) where windows is the list of the uint8 windows in the given order
+        """
+        window_starts = np.asarray(window_starts, dtype='int64')
+        window_lengths = np.asarray(window_stops, dtype='int64') - window_starts
+        if np.any(window_lengths < 0):
+            raise ValueError('Every window has to stop after its start')
+        chroms = np.asarray(chroms)
+        windows = [None] * len(window_starts)
+        num_padded = np.empty(len(window_starts), dtype='int64')
+        for window_length in np.unique(window_lengths):
+            indices = np.flatnonzero(window_lengths == window_length)
+            length_windows, num_padded[indices] = self.get_window_batch(chroms[indices], window_starts[indices],
+                                                                        int(window_length))
+            for index, window in zip(indices, length_windows):
+                windows[index] = window
+        return windows, num_padded
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Decodes the chromosomes of a 2bit file into the cached arrays')
+    parser.add_argument('chroms', nargs='+')
+    parser.add_argument('--twobit-filename', default='hg19.2bit')
+    args = parser.parse_args()
+    genome_store = GenomeStore(args.twobit_filename)
+    for chrom in args.chroms:
+        print(f'-> {chrom}: {genome_store.get_chrom_size(chrom)} letters')
@@ -1,7 +1,7 @@
 import argparse
 import os
 import numpy as np
-import twobitreader
+from genome_store import GenomeStore
 from collections import defaultdict
 
 sizes = {
@@ -32,119 +32,101 @@ sizes = {
 }
 
 
-def get_line_count(filename):
-    count = 0
-    with open(filename, 'r') as file:
-        for _ in file:
-            count += 1
-    return count
+def get_random_state(seed):
+    """
+    :return: a numpy RandomState seeded with seed, or the global numpy random state if seed is None
+    """
+    return np.random if seed is None else np.random.RandomState(seed)
 
 
-def convert_coord_to_seq_letters(narrow_filename, genome_dict, max_samples=None, max_seq_len=4090):
-    line_count = get_line_count(filename=narrow_filename)
-    coord_dict = defaultdict(list)
-    seq_tuple_list = []
-    
-    num_valid_samples = 0
-    
-    used_sample_indices = set()
-    
+def convert_coord_to_seq_letters(narrow_filename, genome_store, max_samples=None, max_seq_len=4090,
+                                 random_state=np.random):
+    """
+    Reads the coordinates of the narrowPeak or coordinate file in a single pass, skipping the lines whose
+    sequence is not fully within the chromosome or is longer than max_seq_len,
+    then samples max_samples of the valid lines uniformly without replacement
+    and only reads the sequences of the sampled lines.
+    :param max_samples: the number of valid lines to sample, None or 0 to keep all of them
+    :param random_state: the numpy RandomState of the sampling, see get_random_state
+    :return: (seq_tuple_list, coord_dict) where seq_tuple_list is the list of (seq, chrom, start, stop) of the
+    kept lines in file order and coord_dict maps every chromosome to the list of (start, stop) of its kept lines
+    """
+    valid_coord_list = []
+    line_count = 0
     with open(narrow_filename, 'r') as narrow_file:
-        if max_samples and max_samples < line_count:
-            initial_sample_size = max_samples
+        for line_count, line in enumerate(narrow_file, start=1):
+            tokens = line.strip().split()
+            chrom, start, stop = tokens[0], int(tokens[1]), int(tokens[2])
             
-            while num_valid_samples < max_samples and initial_sample_size < line_count:
-                sampled_line_indices = set(np.random.choice(line_count, initial_sample_size, replace=False))
-                sampled_line_indices.difference_update(used_sample_indices)
-                used_sample_indices.union(sampled_line_indices)
-                
-                for line_index, line in enumerate(narrow_file):
-                    if line_index not in sampled_line_indices:
-                        continue
-                    tokens = line.strip().split()
-                    chrom, start, stop = tokens[0], int(tokens[1]), int(tokens[2])
-                    
-                    dna_sequence = genome_dict[chrom].get_slice(start, stop)
-                    
-                    if len(dna_sequence) != stop - start:
-                        print(f'The DNA sequence is not {stop - start} bp in length. Will skip.'
-                              f'chrom: {chrom} start: {start} stop: {stop}')
-                        continue
-                    
-                    if stop - start > max_seq_len:
-                        print(f'Sequence length {stop - start} is longer than max_seq_len {max_seq_len}. Skipping.')
-                        continue
-                    
-                    seq_tuple_list.append((dna_sequence, chrom, start, stop))
-                    coord_dict[chrom].append((start, stop))
-                    num_valid_samples += 1
-                    if num_valid_samples >= max_samples:
-                        print(f'-> Reached {max_samples} samples')
-                        break
-                    
-                    if line_index % 1000 == 0:
-                        print(f'=> {line_index}/{line_count} = {line_index / line_count:.2%}', end='\r')
-
-                initial_sample_size = min(initial_sample_size * 2, line_count)
-        else:
-            for line_index, line in enumerate(narrow_file):
-                tokens = line.strip().split()
-                chrom, start, stop = tokens[0], int(tokens[1]), int(tokens[2])
-                
-                dna_sequence = genome_dict[chrom].get_slice(start, stop)
-                
-                if len(dna_sequence) != stop - start:
-                    print(f'The DNA sequence is not {stop - start} bp in length. Will skip.'
-                          f'chrom: {chrom} start: {start} stop: {stop}')
-                    continue
-                
-                if stop - start > max_seq_len:
-                    print(f'Sequence length {stop - start} is longer than max_seq_len {max_seq_len}. Skipping.')
-                    continue
-                
-                seq_tuple_list.append((dna_sequence, chrom, start, stop))
-                coord_dict[chrom].append((start, stop))
-                num_valid_samples += 1
-                
-                if line_index % 1000 == 0:
-                    print(f'=> {line_index}/{line_count} = {line_index / line_count:.2%}', end='\r')
+            # The length of genome_store.get_sequence(chrom, start, stop) without reading the letters
+            chrom_size = genome_store.get_chrom_size(chrom)
+            sequence_length = max(min(max(stop, 0), chrom_size) - min(max(start, 0), chrom_size), 0)
+            if sequence_length != stop - start:
+                print(f'The DNA sequence is not {stop - start} bp in length. Will skip.'
+                      f'chrom: {chrom} start: {start} stop: {stop}')
+                continue
             
-            print(f'\n=> Processed {line_count} lines from {narrow_filename}. '
-                  f'\n->Collected {num_valid_samples} valid sequences.')
+            if stop - start > max_seq_len:
+                print(f'Sequence length {stop - start} is longer than max_seq_len {max_seq_len}. Skipping.')
+                continue
+            
+            valid_coord_list.append((chrom, start, stop))
+            
+            if line_count % 1000 == 0:
+                print(f'=> Read {line_count} lines', end='\r')
+    
+    print(f'\n=> Processed {line_count} lines from {narrow_filename}. '
+          f'\n->Collected {len(valid_coord_list)} valid sequences.')
+    
+    if max_samples and max_samples < len(valid_coord_list):
+        sampled_indices = np.sort(random_state.choice(len(valid_coord_list), max_samples, replace=False))
+        valid_coord_list = [valid_coord_list[i] for i in sampled_indices]
+        print(f'-> Sampled {max_samples} of the valid sequences')
+    
+    coord_dict = defaultdict(list)
+    seq_tuple_list = []
+    for chrom, start, stop in valid_coord_list:
+        seq_tuple_list.append((genome_store.get_sequence(chrom, start, stop), chrom, start, stop))
+        coord_dict[chrom].append((start, stop))
     
     return seq_tuple_list, coord_dict
 
 
-def take_random_split(datapoints, second_segment_ratio):
+def take_random_split(datapoints, second_segment_ratio, random_state=np.random):
     num_datapoints = len(datapoints)
-    second_segment_indices = np.random.choice(num_datapoints, int(num_datapoints * second_segment_ratio), replace=False)
+    second_segment_indices = random_state.choice(num_datapoints, int(num_datapoints * second_segment_ratio),
+                                                 replace=False)
     first_segment = [datapoints[i] for i in range(num_datapoints) if i not in second_segment_indices]
     second_segment = [datapoints[i] for i in second_segment_indices]
     return first_segment, second_segment
 
 
-def narrowpeak_to_fa(narrowpeak_filename, output_prefix):
+def narrowpeak_to_fa(narrowpeak_filename, output_prefix, genome_store=None, seed=None):
     """
     Given a narrowpeak file containing the positive sequence coordinates,
     generate both positive and negative training sequences and store them into .fa.ir files
     for further processing by species_letters_from_coord.py
     :param narrowpeak_filename: narrowpeak file containing the positive sequence coordinates
     :param output_prefix: a dirctory named output_prefix will be created with everything generated saved under
+    :param genome_store: a genome_store.GenomeStore, defaults to that of hg19.2bit in the working directory
+    :param seed: the seed of every random draw, so that the same seed writes the same files,
+    None to draw from the global numpy random state
     """
     
     max_train_samples = 20000
     max_test_samples = 20000
     
     test_ratio = 0.3
-    genome_dict = twobitreader.TwoBitFile('hg19.2bit')
+    random_state = get_random_state(seed)
+    if genome_store is None:
+        genome_store = GenomeStore('hg19.2bit')
     
     print(f'=> Creating directory {output_prefix}')
     os.makedirs(output_prefix, exist_ok=False)
     
-    positive_seq_tuple_list, positive_coord_dict = convert_coord_to_seq_letters(
-        narrowpeak_filename,
-        genome_dict,
-        max_samples=max_train_samples if get_line_count(narrowpeak_filename) > max_train_samples else None)
+    positive_seq_tuple_list, positive_coord_dict = convert_coord_to_seq_letters(narrowpeak_filename, genome_store,
+                                                                                max_samples=max_train_samples,
+                                                                                random_state=random_state)
     
     original_dir = os.getcwd()
     print(f'=> Changing the working directory to {output_prefix}')
@@ -155,7 +137,8 @@ def narrowpeak_to_fa(narrowpeak_filename, output_prefix):
         for _, chrom, start, stop in positive_seq_tuple_list:
             pos_coord_file.write(f'{chrom} {start} {stop}\n')
     
-    positive_train_tuple_list, positive_test_tuple_list = take_random_split(positive_seq_tuple_list, test_ratio)
+    positive_train_tuple_list, positive_test_tuple_list = take_random_split(positive_seq_tuple_list, test_ratio,
+                                                                            random_state)
     
     print(f'positive_train_list length: {len(positive_train_tuple_list)}\n'
           f'positive_test_list length: {len(positive_test_tuple_list)}')
@@ -173,7 +156,7 @@ def narrowpeak_to_fa(narrowpeak_filename, output_prefix):
     
     print('\n=> Generating negative sequences')
     negative_coord_dict = generate_negative_sequence_coord(positive_coord_dict, sizes, len(positive_seq_tuple_list),
-                                                           genome_dict)
+                                                           genome_store, random_state)
     
     negative_coord_filename = f'{output_prefix}.neg.coord'
     with open(negative_coord_filename, 'w') as neg_coord_file:
@@ -182,12 +165,10 @@ def narrowpeak_to_fa(narrowpeak_filename, output_prefix):
                 # Writing chromosome name, start coordiante, stop coordinate
                 neg_coord_file.write(f'{chrom} {start_coord} {start_coord + length}\n')
     
-    neg_seq_tuple_list, _ = convert_coord_to_seq_letters(
-        negative_coord_filename,
-        genome_dict,
-        max_samples=max_test_samples if get_line_count(negative_coord_filename) > max_test_samples else None)
+    neg_seq_tuple_list, _ = convert_coord_to_seq_letters(negative_coord_filename, genome_store,
+                                                         max_samples=max_test_samples, random_state=random_state)
     
-    neg_train_tuple_list, neg_test_tuple_list = take_random_split(neg_seq_tuple_list, test_ratio)
+    neg_train_tuple_list, neg_test_tuple_list = take_random_split(neg_seq_tuple_list, test_ratio, random_state)
     print(f'negative_train_list length: {len(neg_train_tuple_list)}\n'
           f'negative_test_list length: {len(neg_test_tuple_list)}')
     
@@ -220,13 +201,15 @@ def write_seq_intermediate_rep_and_coord_file(seq_tuple_list, seq_ir_filename, c
             coord_file.write(f'{chrom} {start} {stop}\n')
 
 
-def generate_negative_sequence_coord(positive_coord_dict, chrom_sizes, num_samples_required, genome_dict):
+def generate_negative_sequence_coord(positive_coord_dict, chrom_sizes, num_samples_required, genome_store,
+                                     random_state=np.random):
     """
     :param positive_coord_dict: mapping chromosome name to a list of tuple of (start, end) of positive sequences, so that
     we do not sample from those coordiantes.
     :param chrom_sizes: mapping chromosome name to their sizes
     :param num_samples_required: total number of negative samples required.
-    :param genome_dict: use twobitreader on hg19.2bit
+    :param genome_store: a genome_store.GenomeStore of hg19.2bit
+    :param random_state: the numpy RandomState of the sampling, see get_random_state
     """
     total_num_coordinates = sum(chrom_sizes.values())
     print(f'-> Total number of coordinates: {total_num_coordinates}')
@@ -240,67 +223,61 @@ def generate_negative_sequence_coord(positive_coord_dict, chrom_sizes, num_sampl
     # The negative samples will have length equal to at most max_len so that adding the actual
     # length of the negative samples to the start coordinate of the sample will never overlap
     # any of the positive sequences.
+    seq_lengths = np.array(seq_lengths, dtype='int64')
     for chrom, positive_seq_start_stop_list in positive_coord_dict.items():
-        forbidden_coord_list = []
-        for start, stop in positive_seq_start_stop_list:
-            forbidden_coord_list.append((start - max_len, stop))
-        forbidden_coord_list.sort(key=lambda start_stop_tuple: start_stop_tuple[0])
+        positive_starts, positive_stops = np.array(positive_seq_start_stop_list, dtype='int64').reshape(-1, 2).T
+        forbidden_order = np.argsort(positive_starts, kind='stable')
+        forbidden_starts = positive_starts[forbidden_order] - max_len
+        forbidden_stops = positive_stops[forbidden_order]
+        assert np.all(forbidden_starts < forbidden_stops)
         
         upper_bound = chrom_sizes[chrom]
         print(f'-> Chromosome {chrom} has max coordinate: {upper_bound}')
         
-        for start, stop in forbidden_coord_list:
-            assert start < stop
-            upper_bound -= stop - start
+        upper_bound -= int(np.sum(forbidden_stops - forbidden_starts))
         print(f'-> Upper bound changed to: {upper_bound} in the mapping range')
         
+        num_samples = int(num_samples_required * chrom_sizes[chrom] / total_num_coordinates)
+        if num_samples == 0:
+            print(f'-> No negative sequence needed for {chrom}\n')
+            sample_coord[chrom] = []
+            continue
+        
         multiplier = 1
         while True:
             multiplier *= 2
             
             print(f'=> Sampling with multiplier {multiplier}')
-            num_samples = int(num_samples_required * chrom_sizes[chrom] / total_num_coordinates)
-            
             num_samples_to_start_with = num_samples * multiplier
             if num_samples_to_start_with > upper_bound * 2:
                 raise ValueError('not enough number of indices after filtering out indices that are close together')
             
             # sample with multiplier times the target number and get rid of indices that are too close together
             # Then resample one more time to make the length become num_samples
-            sampled_indices = list(np.random.choice(upper_bound, num_samples_to_start_with, replace=False))
-            length_sampling_indices = np.random.choice(len(seq_lengths), len(sampled_indices), replace=True)
-            start_length_tuple_list = list(zip(sampled_indices, [seq_lengths[i] for i in length_sampling_indices]))
+            sampled_indices = random_state.choice(upper_bound, num_samples_to_start_with, replace=False)
+            length_sampling_indices = random_state.choice(len(seq_lengths), len(sampled_indices), replace=True)
+            sampled_lengths = seq_lengths[length_sampling_indices]
             
             print('=> Filtering coordinates that are too close')
-            filter_close_coordinates(start_length_tuple_list, max_len)
+            sample_order = np.argsort(sampled_indices, kind='stable')
+            sample_order = sample_order[filter_close_coordinates(sampled_indices[sample_order], max_len)]
+            sample_starts = sampled_indices[sample_order]
+            sample_lengths = sampled_lengths[sample_order]
             
             print('=> Mapping sampled numbers back to the real coordinates')
-            for index in range(len(start_length_tuple_list)):
-                start, length = start_length_tuple_list[index]
-                for forbidden_start, forbidden_stop in forbidden_coord_list:
-                    if start >= forbidden_start:
-                        start += forbidden_stop - forbidden_start
-                        start_length_tuple_list[index] = (start, length)
-                    else:
-                        break
+            sample_starts = map_to_real_coordinates(sample_starts, forbidden_starts, forbidden_stops)
             
             # Remove samples containing N
-            current_index = len(start_length_tuple_list) - 1
-            chrom_reader = genome_dict[chrom]
-            num_uncertain_samples = 0
-            while current_index >= 0:
-                start, length = start_length_tuple_list[current_index]
-                if 'N' in chrom_reader.get_slice(start, start + length):
-                    start_length_tuple_list.pop(current_index)
-                    num_uncertain_samples += 1
-                current_index -= 1
+            has_n = genome_store.contains_letter(chrom, sample_starts, sample_starts + sample_lengths)
+            sample_starts = sample_starts[~has_n]
+            sample_lengths = sample_lengths[~has_n]
+            print(f'-> Removed {np.count_nonzero(has_n)} potential sequences containing N')
             
-            print(f'-> Removed {num_uncertain_samples} potential sequences containing N')
-            
-            if len(start_length_tuple_list) > num_samples:
+            if len(sample_starts) > num_samples:
                 break
         
-        start_length_tuple_list = downsample(start_length_tuple_list, num_samples)
+        start_length_tuple_list = list(zip(sample_starts.tolist(), sample_lengths.tolist()))
+        start_length_tuple_list = downsample(start_length_tuple_list, num_samples, random_state)
         sample_coord[chrom] = start_length_tuple_list
         
         print('=> Mapping complete\n')
@@ -308,43 +285,68 @@ def generate_negative_sequence_coord(positive_coord_dict, chrom_sizes, num_sampl
     return sample_coord
 
 
-def filter_close_coordinates(start_length_tuple_list, min_distance):
+def map_to_real_coordinates(sampled_starts, forbidden_starts, forbidden_stops):
     """
-    Filters the sample_indices in place. The first pivot will be the last element of the list. At each iteration,
-    if the value of the element to the left of the pivot is less than min_distance from the pivot value,
-    it will be removed. Otherwise, the pivot moves to the left by one.
-    The returned list will be sorted in increasing order and contain elements that are at least
-    min_distance away from each other.
-    :param sample_indices: the list of coordinates to be filtered in place.
-    :param min_distance: the minimum distance between any two elements in the sample_indices.
-    :return: a list containing a subset of the sample_indices, sorted in increasing order and containing
-    elements which are at least min_distance away from each other.
+    Maps numbers sampled from the chromosome with the forbidden intervals cut out back to the chromosome coordinates.
+    Going through the forbidden intervals in increasing order of their starts, a start at or past an interval start
+    is shifted by the interval length, so the number of shifts of a start is the number of leading intervals
+    whose start minus the total length of the intervals before it is at most the start.
+    :param sampled_starts: the int64 array of the sampled numbers
+    :param forbidden_starts: the int64 array of the forbidden interval starts, sorted in increasing order
+    :param forbidden_stops: the int64 array of the forbidden interval stops
+    :return: the int64 array of the coordinates of the sampled numbers
     """
-    start_length_tuple_list.sort(key=lambda pair: pair[0])
-    current_value, current_length = start_length_tuple_list[-1]
-    current_index = len(start_length_tuple_list) - 2
-    
-    while current_index >= 0:
-        if current_value - start_length_tuple_list[current_index][0] < min_distance:
-            start_length_tuple_list.pop(current_index)
-            current_index -= 1
-        else:
-            current_value, current_length = start_length_tuple_list[current_index]
-            current_index -= 1
+    # cumulative_gaps[i] is the total length of the first i forbidden intervals
+    cumulative_gaps = np.concatenate(([0], np.cumsum(forbidden_stops - forbidden_starts)))
+    # The running maximum keeps the thresholds sorted when the forbidden intervals overlap,
+    # an interval being reached only once all the intervals before it are
+    thresholds = np.maximum.accumulate(forbidden_starts - cumulative_gaps[:-1])
+    num_shifts = np.searchsorted(thresholds, sampled_starts, side='right')
+    return sampled_starts + cumulative_gaps[num_shifts]
+
+
+def filter_close_coordinates(sorted_starts, min_distance):
+    """
+    The first pivot will be the last element of the array. Going to the left, an element less than
+    min_distance from the pivot value is dropped, otherwise it is kept and becomes the pivot.
+    :param sorted_starts: the array of coordinates sorted in increasing order
+    :param min_distance: the minimum distance between any two kept elements
+    :return: the int64 array of the indices of the kept elements in increasing order, the kept elements
+    being at least min_distance away from each other
+    """
+    if not len(sorted_starts):
+        return np.empty(0, dtype='int64')
+    # The element becoming the pivot after an element is the last one at least min_distance before it
+    next_pivot_indices = np.searchsorted(sorted_starts, sorted_starts - min_distance, side='right') - 1
+    kept_indices = []
+    pivot_index = len(sorted_starts) - 1
+    while pivot_index >= 0:
+        kept_indices.append(pivot_index)
+        pivot_index = next_pivot_indices[pivot_index]
+    return np.array(kept_indices[::-1], dtype='int64')
 
 
-def downsample(samples, target_count):
+def downsample(samples, target_count, random_state=np.random):
     if len(samples) < target_count:
         raise ValueError(
             f'The number of elements in the samples {len(samples)} is less than the target_count {target_count}')
-    target_indices = np.random.choice(len(samples), target_count, replace=False)
+    target_indices = random_state.choice(len(samples), target_count, replace=False)
     return [samples[i] for i in target_indices]
 
 
 if __name__ == '__main__':
-    arg_parser = argparse.ArgumentParser()
+    arg_parser = argparse.ArgumentParser(description='Writes the positive and negative sequences of a narrowPeak '
+                                                     'file, run from the repository root with '
+                                                     'python3 -m gkm_datagen.narrowpeak_to_fa')
     arg_parser.add_argument('filename')
     arg_parser.add_argument('output_prefix')
+    arg_parser.add_argument('--work-dir', default='.', help='the directory the output_prefix directory is created in')
+    arg_parser.add_argument('--twobit', default='hg19.2bit')
+    arg_parser.add_argument('--seed', type=int, default=None,
+                            help='the seed of the sampling and of the train/test splits, for reproducible files')
     args = arg_parser.parse_args()
+    narrowpeak_filename = os.path.abspath(args.filename)
+    genome_store = GenomeStore(args.twobit)
+    os.chdir(args.work_dir)
     # example output_prefix uw_gm12878_ctcf
-    narrowpeak_to_fa(args.filename, args.output_prefix)
+    narrowpeak_to_fa(narrowpeak_filename, args.output_prefix, genome_store=genome_store, seed=args.seed)
@@ -13,11 +13,13 @@ echo "output_dirname: ${output_dirname}"
 . /u/local/Modules/default/init/modules.sh
 module load python/3.6.1
 
+# The scripts are modules of the gkm_datagen package, run from the repository root
+narrow_path=$(readlink -f "$1")
+cd ..
 echo "=> Running narrowpeak_to_fa.py"
-python3 narrowpeak_to_fa.py $1 $2 || exit 1
+python3 -m gkm_datagen.narrowpeak_to_fa "${narrow_path}" $2 --work-dir gkm_datagen --twobit gkm_datagen/hg19.2bit || exit 1
 
 
-cd ..
 echo "=> Running species_letters_from_coord train pos"
 python3 -m gkm_datagen.species_letters_from_coord gkm_datagen/$2/$2.train.pos.coord gkm_datagen/$2 || exit 1
 echo "=> Running species_letters_from_coord for train neg"
@@ -0,0 +1,304 @@
+import argparse
+import os
+import queue
+import shutil
+import sys
+import time
+import traceback
+from collections import defaultdict
+from contextlib import redirect_stdout
+from multiprocessing import Pool
+
+from genome_store import GenomeStore
+from gkm_datagen.narrowpeak_to_fa import narrowpeak_to_fa
+from gkm_datagen.species_letters_from_coord import get_species_letters_from_coord, open_alignment_files
+from gkm_datagen.transport_files import transport_files
+
+# The coordinate files written by narrowpeak_to_fa, each extended by species_letters_from_coord
+coord_names = ['train.pos', 'train.neg', 'test.pos', 'test.neg']
+stages = ['fasta'] + [f'species.{coord_name}' for coord_name in coord_names] + ['transport']
+# Created in the target directory of every job for the gkmtrain and gkmpredict outputs, see task.sh
+target_subdirnames = ['species_model', 'species_predict', 'species_roc']
+
+# The genome and the alignments of a worker process, opened by init_worker.
+# The stores are memory-mapped read-only, so the workers share their pages through the page cache.
+worker_stores = {}
+
+
+def init_worker(twobit_filename, maf_dir):
+    worker_stores['twobit_filename'] = twobit_filename
+    worker_stores['maf_dir'] = maf_dir
+
+
+def get_worker_genome_store():
+    if 'genome_store' not in worker_stores:
+        worker_stores['genome_store'] = GenomeStore(worker_stores['twobit_filename'])
+    return worker_stores['genome_store']
+
+
+def get_worker_alignments():
+    if 'alignments' not in worker_stores:
+        worker_stores['alignments'], _ = open_alignment_files(worker_stores['maf_dir'])
+    return worker_stores['alignments']
+
+
+class Job:
+    """
+    The processing of one narrowPeak file, as one line of the job list file: narrowpeak_filename output_prefix
+    """
+    def __init__(self, narrowpeak_filename, output_prefix, work_dirname, target_dirname, state_dirname, seed=None):
+        self.narrowpeak_filename = narrowpeak_filename
+        self.output_prefix = output_prefix
+        self.work_dirname = work_dirname
+        self.target_dirname = target_dirname
+        self.state_dirname = state_dirname
+        # The seed of narrowpeak_to_fa, None for the global numpy random state
+        self.seed = seed
+
+    @property
+    def source_dirname(self):
+        return os.path.join(self.work_dirname, self.output_prefix)
+
+    @property
+    def job_target_dirname(self):
+        return os.path.join(self.target_dirname, self.output_prefix)
+
+    def get_coord_filename(self, coord_name):
+        return os.path.join(self.source_dirname, f'{self.output_prefix}.{coord_name}.coord')
+
+
+class WorkUnit:
+    def __init__(self, job, stage, dependencies):
+        self.job = job
+        self.stage = stage
+        self.dependencies = dependencies
+        self.attempts = 0
+
+    @property
+    def done_filename(self):
+        return os.path.join(self.job.state_dirname, f'{self.job.output_prefix}.{self.stage}.done')
+
+    @property
+    def log_filename(self):
+        return os.path.join(self.job.state_dirname, f'{self.job.output_prefix}.{self.stage}.log')
+
+    def is_done(self):
+        # The marker is only written once the stage is complete
+        return os.path.isfile(self.done_filename)
+
+    def __str__(self):
+        return '{} {}'.format(self.job.output_prefix, self.stage)
+
+
+def run_fasta_stage(job):
+    # narrowpeak_to_fa creates the output_prefix directory under the working directory
+    shutil.rmtree(job.source_dirname, ignore_errors=True)
+    os.chdir(job.work_dirname)
+    narrowpeak_to_fa(job.narrowpeak_filename, job.output_prefix, genome_store=get_worker_genome_store(),
+                     seed=job.seed)
+
+
+def run_species_stage(job, coord_name):
+    coord_filename = job.get_coord_filename(coord_name)
+    shutil.rmtree(f'{coord_filename}.mult_species', ignore_errors=True)
+    get_species_letters_from_coord(coord_filename, job.source_dirname, ignore_noninformative=False,
+                                   alignment_dict=get_worker_alignments())
+
+
+def run_transport_stage(job):
+    shutil.rmtree(job.job_target_dirname, ignore_errors=True)
+    for subdirname in target_subdirnames:
+        os.makedirs(os.path.join(job.job_target_dirname, subdirname))
+    # A single process, the stage already runs in a worker of the pool of run_jobs
+    transport_files(job.source_dirname, job.job_target_dirname, num_processes=1)
+    with open(os.path.join(job.job_target_dirname, 'jobarray.sh'), 'w') as jobarray_file:
+        jobarray_file.write(f'#!/bin/bash\n../task.sh ${{SGE_TASK_ID}} {job.output_prefix}\n')
+
+
+def run_work_unit(unit, root_dirname):
+    """
+    Runs a single stage of a job, writing its done marker on success.
+    The output of the stage is redirected to its log file in the state directory.
+
+    :return: (pid, elapsed seconds)
+    """
+    stamp = time.time()
+    # The stages change the working directory, and a failed stage may not have changed it back
+    os.chdir(root_dirname)
+    with open(unit.log_filename, 'w') as log_file, redirect_stdout(log_file):
+        if unit.stage == 'fasta':
+            run_fasta_stage(unit.job)
+        elif unit.stage == 'transport':
+            run_transport_stage(unit.job)
+        else:
+            run_species_stage(unit.job, unit.stage[len('species.'):])
+    os.chdir(root_dirname)
+
+    open(unit.done_filename, 'w').close()
+    return os.getpid(), time.time() - stamp
+
+
+def read_jobs(job_list_filename, narrow_dirname, work_dirname, target_dirname, state_dirname, seed=None):
+    """
+    :param job_list_filename: a file whose lines are of the form narrowpeak_filename output_prefix
+    """
+    jobs = []
+    with open(job_list_filename, 'r') as job_list_file:
+        for line in job_list_file:
+            tokens = line.split()
+            if not tokens:
+                continue
+            jobs.append(Job(os.path.abspath(os.path.join(narrow_dirname, tokens[0])), tokens[1], work_dirname,
+                            target_dirname, state_dirname, seed))
+    return jobs
+
+
+def create_work_units(jobs):
+    """
+    :return: the units of every job, each unit listed after its dependencies
+    """
+    units = []
+    for job in jobs:
+        fasta_unit = WorkUnit(job, 'fasta', [])
+        species_units = [WorkUnit(job, stage, [fasta_unit]) for stage in stages[1:-1]]
+        units += [fasta_unit] + species_units + [WorkUnit(job, 'transport', species_units)]
+    return units
+
+
+def print_throughput(stage_stats, worker_stats, num_jobs, elapsed_time):
+    print('=> Time per stage:')
+    for stage in stages:
+        if stage in stage_stats:
+            num_units, busy_time = stage_stats[stage]
+            print('-> {}: {} units in {:.2f}s, averaging {:.2f}s per unit'
+                  .format(stage, num_units, busy_time, busy_time / num_units))
+    print('=> Throughput per worker:')
+    for pid, (num_units, busy_time) in sorted(worker_stats.items()):
+        print('-> worker {}: {} units in {:.2f}s'.format(pid, num_units, busy_time))
+    print('=> Total: {} jobs in {:.2f}s = {:.2f} jobs/h'
+          .format(num_jobs, elapsed_time, num_jobs * 3600 / elapsed_time if elapsed_time else 0.))
+
+
+def run_jobs(job_list_filename, narrow_dirname, target_dirname, work_dirname='gkm_datagen',
+             twobit_filename=os.path.join('gkm_datagen', 'hg19.2bit'), maf_dir='.', state_dirname=None,
+             num_workers=None, max_retries=1, seed=None):
+    """
+    Runs narrowpeak_to_fa, species_letters_from_coord for the four coordinate files and transport_files
+    for every job of the job list on a process pool, a stage being submitted as soon as its dependencies complete,
+    so that the stages of different jobs run concurrently.
+
+    Every stage writes its log and, once complete, a done marker to the state directory.
+    Rerunning the same command resumes: the completed stages are skipped, and the partial outputs of
+    the others are removed before they are run again.
+
+    :param target_dirname: the directory receiving the output_prefix directory of every job, see transport_files
+    :param work_dirname: the directory where the output_prefix directory of every job is generated
+    :param maf_dir: the directory of the chr*_maf_sequence.csv files, converting them with maf_store.py
+    lets all the workers share the memory-mapped stores
+    :param state_dirname: defaults to work_dirname/job_state
+    :param num_workers: defaults to the number of cores
+    :param max_retries: the number of times a failed stage is resubmitted
+    :param seed: the seed narrowpeak_to_fa samples and splits the sequences of every job with,
+    None for the global numpy random state
+    :return: True if every job has completed
+    """
+    root_dirname = os.getcwd()
+    work_dirname = os.path.abspath(work_dirname)
+    target_dirname = os.path.abspath(target_dirname)
+    state_dirname = os.path.abspath(os.path.join(work_dirname, 'job_state') if state_dirname is None
+                                    else state_dirname)
+    os.makedirs(state_dirname, exist_ok=True)
+
+    jobs = read_jobs(job_list_filename, narrow_dirname, work_dirname, target_dirname, state_dirname, seed)
+    units = create_work_units(jobs)
+    for unit in units:
+        if unit.is_done() and not all(dependency.is_done() for dependency in unit.dependencies):
+            # Its inputs are about to be generated again
+            os.remove(unit.done_filename)
+    num_done = sum(unit.is_done() for unit in units)
+    print('=> {} jobs, resuming from {} of their {} completed stages'.format(len(jobs), num_done, len(units)))
+
+    # pid -> [num_units, busy_time]
+    worker_stats = defaultdict(lambda: [0, 0.])
+    # stage -> [num_units, busy_time]
+    stage_stats = defaultdict(lambda: [0, 0.])
+    failed_units = []
+    finished_units = queue.Queue()
+    stamp = time.time()
+
+    with Pool(num_workers, initializer=init_worker,
+              initargs=(os.path.abspath(twobit_filename), os.path.abspath(maf_dir))) as pool:
+        # The units submitted by this run, so that a unit whose dependencies complete close together
+        # is only submitted once, its dependencies' done markers being written before their results are handled
+        submitted_units = set()
+
+        def submit(unit):
+            submitted_units.add(unit)
+            unit.attempts += 1
+            pool.apply_async(run_work_unit, (unit, root_dirname),
+                             callback=lambda result: finished_units.put((unit, result, None)),
+                             error_callback=lambda error: finished_units.put((unit, None, error)))
+
+        num_running = 0
+        for unit in units:
+            if not unit.is_done() and all(dependency.is_done() for dependency in unit.dependencies):
+                submit(unit)
+                num_running += 1
+
+        while num_running:
+            unit, result, error = finished_units.get()
+            num_running -= 1
+            if error is not None:
+                print('=> {} failed on attempt {}, see {}:\n{}'.format(
+                    unit, unit.attempts, unit.log_filename,
+                    ''.join(traceback.format_exception(type(error), error, error.__traceback__))))
+                if unit.attempts <= max_retries:
+                    submit(unit)
+                    num_running += 1
+                else:
+                    failed_units.append(unit)
+                continue
+
+            pid, elapsed_time = result
+            worker_stats[pid][0] += 1
+            worker_stats[pid][1] += elapsed_time
+            stage_stats[unit.stage][0] += 1
+            stage_stats[unit.stage][1] += elapsed_time
+            print('-> {} done in {:.2f}s by worker {}'.format(unit, elapsed_time, pid))
+
+            for dependent in units:
+                if unit in dependent.dependencies and dependent not in submitted_units and \
+                        not dependent.is_done() and all(dependency.is_done() for dependency in dependent.dependencies):
+                    submit(dependent)
+                    num_running += 1
+
+    # Only the jobs completed by this run count towards the throughput
+    print_throughput(stage_stats, worker_stats, stage_stats.get('transport', [0])[0], time.time() - stamp)
+
+    for unit in failed_units:
+        print('=> Gave up on {} after {} attempts, see {}'.format(unit, unit.attempts, unit.log_filename))
+    return all(unit.is_done() for unit in units)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs the gkm data generation of every narrowPeak file of the '
+                                                 'job list on the local cores, run from the repository root with '
+                                                 'python3 -m gkm_datagen.run_jobs')
+    parser.add_argument('job_list_filename', help='lines of the form narrowpeak_filename output_prefix')
+    parser.add_argument('narrow_dirname', help='the directory of the narrowPeak files')
+    parser.add_argument('target_dirname', help='e.g. the lsgkm tests directory')
+    parser.add_argument('--work-dir', default='gkm_datagen')
+    parser.add_argument('--twobit', default=os.path.join('gkm_datagen', 'hg19.2bit'))
+    parser.add_argument('--maf-dir', default='.', help='directory of chr*_maf_sequence.csv')
+    parser.add_argument('--state-dir', default=None, help='defaults to <work-dir>/job_state')
+    parser.add_argument('--num-workers', type=int, default=None, help='defaults to the number of cores')
+    parser.add_argument('--max-retries', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=None, help='the seed of narrowpeak_to_fa, for reproducible jobs')
+    args = parser.parse_args()
+
+    success = run_jobs(args.job_list_filename, args.narrow_dirname, args.target_dirname,
+                       work_dirname=args.work_dir, twobit_filename=args.twobit, maf_dir=args.maf_dir,
+                       state_dirname=args.state_dir, num_workers=args.num_workers, max_retries=args.max_retries,
+                       seed=args.seed)
+    if not success:
+        sys.exit(1)
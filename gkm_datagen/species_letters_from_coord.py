@@ -1,156 +1,167 @@
 import argparse
-from collections import defaultdict
 import os
 import time
 
-from binary_search import search, scan_through_line_for_number
+import numpy as np
 
+from maf_reader import open_alignment
+from util.file import get_line_count
 
-def get_line_count(filename):
-    count = 0
-    with open(filename, 'r') as file:
-        for _ in file:
-            count += 1
-    return count
+# Number of coordinate lines whose windows are buffered before being written to the species files
+default_batch_size = 1000
+uninformative_letters = np.frombuffer(b'XN', dtype='uint8')
 
 
-def distribute_tokens_to_species_sequence(tokens, species_sequence):
-    for species_index, letter in enumerate(tokens):
-        species_sequence[species_index] += letter
+def get_alignment_filename(chrom, maf_dir='.'):
+    return os.path.join(maf_dir, f'{chrom}_maf_sequence.csv')
 
 
-def get_alignment_filename(chrom):
-    return f'{chrom}_maf_sequence.csv'
-
-
-def open_alignment_files():
-    def convert_number_to_chrom_str(number):
-        return 'chr' + str(number)
-    
-    filenames = [(get_alignment_filename(chrom), chrom) for chrom in
-                 list(map(convert_number_to_chrom_str, range(1, 23))) + ['chrX', 'chrY']]
-    print(f'-> alignment filenames: {filenames!r}')
-    file_dict = {}
+def open_alignment_files(maf_dir='.'):
+    """
+    :param maf_dir: the directory of the chr*_maf_sequence.csv files
+    :return: (alignment_dict, species_header) where alignment_dict maps every chromosome to its alignment,
+    see maf_reader.open_alignment
+    """
+    chroms = [f'chr{number}' for number in range(1, 23)] + ['chrX', 'chrY']
+    print(f'-> alignment filenames: {[get_alignment_filename(chrom, maf_dir) for chrom in chroms]!r}')
+    alignment_dict = {}
     species_header = None
-    for filename, chrom in filenames:
-        file = open(filename, 'r')
-        header = file.readline().strip().split(',')
-        del header[0]
-        assert len(header) == 100
-        file_dict[chrom] = file
-        
-        species_header = header
-    
-    return file_dict, species_header
+    for chrom in chroms:
+        alignment = open_alignment(get_alignment_filename(chrom, maf_dir))
+        assert alignment.num_species == 100
+        alignment_dict[chrom] = alignment
+        species_header = alignment.species
+
+    return alignment_dict, species_header
 
 
-def close_alignment_files(file_dict):
-    for file in file_dict.values():
-        file.close()
+def close_alignment_files(alignment_dict):
+    for alignment in alignment_dict.values():
+        alignment.close()
 
 
-def is_informative_sequence(seq):
-    for letter in seq:
-        if letter != 'X' and letter != 'N':
-            return True
-    return False
+def get_species_sequences(alignment, start_coord, stop_coord):
+    """
+    :return: (species_sequences, is_informative, num_missing) where species_sequences is the
+    num_species x (stop_coord - start_coord) uint8 matrix of the ASCII letters of every species,
+    the coordinates absent from the alignment being N for every species,
+    is_informative marks the species having a letter other than X and N,
+    and num_missing is the number of coordinates absent from the alignment
+    """
+    window, found = alignment.get_window(start_coord, stop_coord, fill='N')
+    species_sequences = np.ascontiguousarray(window.T)
+    is_informative = np.any(~np.isin(species_sequences, uninformative_letters), axis=1)
+    return species_sequences, is_informative, int(len(found) - np.count_nonzero(found))
 
 
 def generate_informative_species_filename(species_index, species_code):
     return f'{species_index}_{species_code}.informative'
 
 
-def get_species_letters_from_coord(coord_filename, target_dirname, ignore_noninformative):
+class SpeciesFileWriter:
+    """
+    Buffers the sequences of every species and the indices of the lines where it is informative,
+    writing them to the species files once batch_size lines are buffered.
+    """
+    def __init__(self, dir_name, header, batch_size=default_batch_size):
+        self.batch_size = batch_size
+        self.species_files = []
+        self.informative_seq_files = []
+        for index, species_code in enumerate(header):
+            species_filename = f'{index}_{species_code}.fa.ir'
+            print('=> Creating {} under {}'.format(species_filename, dir_name))
+            self.species_files.append(open(os.path.join(dir_name, species_filename), 'wb'))
+
+            informative_seq_filename = generate_informative_species_filename(index, species_code)
+            self.informative_seq_files.append(open(os.path.join(dir_name, informative_seq_filename), 'wb'))
+        self.species_chunks = [[] for _ in header]
+        self.informative_chunks = [[] for _ in header]
+        self.num_buffered_lines = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, line_index, chrom, start_coord, stop_coord, species_sequences, is_informative,
+            ignore_noninformative):
+        """
+        :param species_sequences: the num_species x window length matrix of letters, see get_species_sequences
+        """
+        fasta_header = f'>{chrom} {start_coord} {stop_coord}\n'.encode('ascii')
+        informative_line = f'{line_index}\n'.encode('ascii')
+        for species_index, (sequence, informative) in enumerate(zip(species_sequences, is_informative)):
+            if informative:
+                self.informative_chunks[species_index].append(informative_line)
+            if informative or not ignore_noninformative:
+                self.species_chunks[species_index] += (fasta_header, sequence.tobytes(), b'\n')
+        self.num_buffered_lines += 1
+        if self.num_buffered_lines >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for file, chunks in zip(self.species_files + self.informative_seq_files,
+                                self.species_chunks + self.informative_chunks):
+            file.write(b''.join(chunks))
+            chunks.clear()
+        self.num_buffered_lines = 0
+
+    def close(self):
+        self.flush()
+        for file in self.species_files + self.informative_seq_files:
+            print(f'=> Closing {file.name}')
+            file.close()
+
+
+def get_species_letters_from_coord(coord_filename, target_dirname, ignore_noninformative,
+                                   batch_size=default_batch_size, alignment_dict=None):
+    """
+    :param alignment_dict: the alignments returned by open_alignment_files, to share them between calls,
+    by default the alignments are opened and closed by the call
+    """
     checkpoint_time_str = time.strftime('%a %b %d %Y %H:%M:%S UTC%z', time.localtime(time.time()))
     print('Current time: {}'.format(checkpoint_time_str))
     print(f'-> ignore noninformative: {ignore_noninformative}')
-    
-    species_file_dict = {}
-    informative_seq_file_dict = {}
-    
+
     total_line_count = get_line_count(coord_filename)
     print(f'=> coordinate_filename: {coord_filename}\n'
           f'-> {coord_filename} has {total_line_count} lines')
-    
-    alignment_file_dict, header = open_alignment_files()
-    
-    with open(coord_filename, 'r') as coord_file:
-        dir_name = os.path.join(target_dirname, f'{os.path.basename(os.path.normpath(coord_filename))}.mult_species')
-        os.makedirs(dir_name, exist_ok=False)
-        
-        for index, species_code in enumerate(header):
-            species_filename = f'{index}_{species_code}.fa.ir'
-            print('=> Creating {} under {}'.format(species_filename, dir_name))
-            species_file_dict[index] = open(os.path.join(dir_name, species_filename), 'w')
-            
-            informative_seq_filename = generate_informative_species_filename(index, species_code)
-            informative_seq_file_dict[index] = open(os.path.join(dir_name, informative_seq_filename), 'w')
-        
-        processed_line_count = 0
-        start_time = time.time()
-        number_of_n_substituted = 0
-        
+
+    owns_alignments = alignment_dict is None
+    if owns_alignments:
+        alignment_dict, header = open_alignment_files()
+    else:
+        header = next(iter(alignment_dict.values())).species
+
+    dir_name = os.path.join(target_dirname, f'{os.path.basename(os.path.normpath(coord_filename))}.mult_species')
+    os.makedirs(dir_name, exist_ok=False)
+
+    processed_line_count = 0
+    start_time = time.time()
+    number_of_n_substituted = 0
+
+    with open(coord_filename, 'r') as coord_file, SpeciesFileWriter(dir_name, header, batch_size) as writer:
         for line_index, line in enumerate(coord_file):
             processed_line_count += 1
             tokens = line.strip().split()
             chrom, start_coord, stop_coord = tokens[0], int(tokens[1]), int(tokens[2])
-            alignment_file = alignment_file_dict[chrom]
-            
-            species_sequence = defaultdict(str)
-
-            file_byte_size = os.stat(get_alignment_filename(chrom)).st_size
-            start_line_hint = None
-            for letter_index, coordinate in enumerate(range(start_coord, stop_coord)):
-                if not start_line_hint:
-                    result = search(alignment_file, coordinate, file_byte_size)
-                else:
-                    result = scan_through_line_for_number(alignment_file=alignment_file,
-                                                          start_line_hint=start_line_hint, number=coordinate)
-                
-                if result:
-                    start_line_hint = result[1]
-                    tokens = result[0].strip().split(',')
-                    del tokens[0]
-                    assert len(tokens) == 100
-                    
-                    distribute_tokens_to_species_sequence(tokens, species_sequence)
-                
-                else:
-                    number_of_n_substituted += 1
-                    tokens = ['N'] * (stop_coord - start_coord)
-                    distribute_tokens_to_species_sequence(tokens, species_sequence)
-            
-            if ignore_noninformative:
-                for species_index in range(len(header)):
-                    seq = species_sequence[species_index]
-                    if is_informative_sequence(seq):
-                        species_file_dict[species_index].write(f'>{chrom} {start_coord} {stop_coord}\n'
-                                                               f'{seq}\n')
-                        informative_seq_file_dict[species_index].write(f'{line_index}\n')
-            else:
-                for species_index in range(len(header)):
-                    seq = species_sequence[species_index]
-                    species_file_dict[species_index].write(f'>{chrom} {start_coord} {stop_coord}\n'
-                                                           f'{seq}\n')
-                    if is_informative_sequence(seq):
-                        informative_seq_file_dict[species_index].write(f'{line_index}\n')
-            
+
+            species_sequences, is_informative, num_missing = get_species_sequences(alignment_dict[chrom],
+                                                                                   start_coord, stop_coord)
+            number_of_n_substituted += num_missing
+            writer.add(line_index, chrom, start_coord, stop_coord, species_sequences, is_informative,
+                       ignore_noninformative)
+
             if processed_line_count % 1000 == 0:
                 elapsed_time = time.time() - start_time
                 time_per_line = elapsed_time / processed_line_count
                 print(f'Processed [{processed_line_count}/{total_line_count}] lines in {elapsed_time:5f}s, '
                       f'averaging: {time_per_line:5f}s per line, {processed_line_count / total_line_count:3f} done.')
-    
-    for filename, species_file in species_file_dict.items():
-        print(f'=> Closing {filename}')
-        species_file.close()
-    
-    for filename, file in informative_seq_file_dict.items():
-        print(f'=> Closing {filename}')
-        file.close()
-    
-    close_alignment_files(alignment_file_dict)
-    
+
+    if owns_alignments:
+        close_alignment_files(alignment_dict)
+
     print(f'-> #N substituted: {number_of_n_substituted}\n'
           f'=> Done!')
 
@@ -160,5 +171,8 @@ if __name__ == '__main__':
     parser.add_argument('coord_file')
     parser.add_argument('target_dirname')
     parser.add_argument('--ignore-noninformative', action='store_true')
+    parser.add_argument('--batch-size', type=int, default=default_batch_size,
+                        help='number of coordinate lines buffered before writing the species files')
     args = parser.parse_args()
-    get_species_letters_from_coord(args.coord_file, args.target_dirname, args.ignore_noninformative)
+    get_species_letters_from_coord(args.coord_file, args.target_dirname, args.ignore_noninformative,
+                                   args.batch_size)
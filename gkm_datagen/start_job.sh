@@ -3,6 +3,16 @@
 . /u/local/Modules/default/init/modules.sh
 module load python/3.6.1
 
-# python3 submit_massive_jobs.py dnase.np narrowfiles/dnase_narrowpeak/ $((${SGE_TASK_ID} - 1))
+# Runs every job of the list on the cores of this node, rerun the same command to resume.
+# Submit it as a single task, e.g. qsub -cwd -V -pe shared 16 start_job.sh, and not as an array with -t:
+# every task would run the whole job list against the same job_state directory.
+if [ -n "${SGE_TASK_ID}" ] && [ "${SGE_TASK_ID}" != "undefined" ]; then
+  echo "start_job.sh runs the whole job list, submit it without -t" >&2
+  exit 1
+fi
 
-python3 submit_massive_jobs.py histone.np narrowfiles/histone_narrowpeak/ $((${SGE_TASK_ID} - 1))
+cd ..
+
+# python3 -m gkm_datagen.run_jobs gkm_datagen/dnase.np gkm_datagen/narrowfiles/dnase_narrowpeak/ /u/home/a/aaronzho/project-ernst/lsgkm/tests
+
+python3 -m gkm_datagen.run_jobs gkm_datagen/histone.np gkm_datagen/narrowfiles/histone_narrowpeak/ /u/home/a/aaronzho/project-ernst/lsgkm/tests
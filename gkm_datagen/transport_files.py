@@ -1,6 +1,7 @@
-import shutil
 import os
 import argparse
+from multiprocessing import Pool
+
 import numpy as np
 
 
@@ -13,51 +14,96 @@ def get_line_count(filename):
     return count
 
 
-def map_line_to_coord_triple(line):
-    tokens = line.strip().split()
-    # In the fasta files > precedes the label line
-    if tokens[0][0] == '>':
-        return tokens[0][1:], int(tokens[1]), int(tokens[2])
-    else:
-        return tokens[0], int(tokens[1]), int(tokens[2])
+def get_coord_key(tokens):
+    # The chrom start stop of a coordinate line or of a >chrom start stop header, as one bytes string
+    return b' '.join(tokens[:3])
+
 
+def read_coord_keys(coord_filename):
+    """
+    :return: the bytes array of the chrom start stop of every line of the coordinate file
+    """
+    with open(coord_filename, 'rb') as coord_file:
+        return np.array([get_coord_key(line.split()) for line in coord_file.read().splitlines()], dtype='S')
+
+
+def get_duplicate_mask(coord_keys, is_kept):
+    """
+    :return: the boolean mask of the coordinate lines whose chrom start stop is that of a kept line,
+    so that the records of duplicated coordinates are kept or dropped together
+    """
+    _, key_indices = np.unique(coord_keys, return_inverse=True)
+    is_key_kept = np.bincount(key_indices, weights=is_kept) > 0
+    return is_key_kept[key_indices]
+
+
+def read_species_file(filepath):
+    """
+    :param filepath: a .fa.ir file written by species_letters_from_coord.py
+    :return: (headers, sequences) the lists of the >chrom start stop lines without the newline
+    and of the sequence lines following them
+    """
+    with open(filepath, 'rb') as species_file:
+        lines = species_file.read().splitlines()
+    return lines[0::2], lines[1::2]
+
+
+def read_informative_rows(filepath):
+    """
+    :return: the int64 array of the coordinate line indices listed in the .informative file
+    """
+    with open(filepath, 'rb') as informative_file:
+        return np.array(informative_file.read().split(), dtype='int64')
 
-def convert_to_final_rep_and_downsample(downsample_coord_filename, in_filename, out_filename,
-                                        species_informative_filepath=None, species_informative_output_filepath=None):
-    coord_set = set()
-    with open(downsample_coord_filename, 'r') as coord_file:
-        for line in coord_file:
-            chrom, start, stop = map_line_to_coord_triple(line)
-            coord_set.add((chrom, start, stop))
+
+def filter_species_file(source_filepath, target_filepath, is_kept, coord_keys, source_informative_filepath=None,
+                        target_informative_filepath=None):
+    """
+    Writes the records of the .fa.ir file on the kept coordinate lines to target_filepath in the final
+    >chrom:start-stop representation, reading and writing each file at once.
+    If given, the .informative file is filtered as well, keeping the indices of the kept lines as they are,
+    i.e. the line indices in the source coordinate file.
+    :param is_kept: the boolean mask of the coordinate lines to keep, see generate_downsample_mask,
+    the records of a chrom start stop being kept if any of its lines is
+    :param coord_keys: the chrom start stop of every coordinate line, see read_coord_keys,
+    checked against the headers of the records
+    :return: (source_filepath, number of kept records)
+    """
+    headers, sequences = read_species_file(source_filepath)
+    informative_rows = None
+    if source_informative_filepath:
+        informative_rows = read_informative_rows(source_informative_filepath)
     
-    if species_informative_filepath:
-        assert species_informative_output_filepath
-        with open(in_filename, 'r') as infile, open(out_filename, 'w') as outfile, \
-                open(species_informative_filepath, 'r') as informative_source, \
-                open(species_informative_output_filepath, 'w') as informative_output:
-            
-            for line, informative_line_index in zip(infile, informative_source):
-                triple = map_line_to_coord_triple(line)
-                if triple in coord_set:
-                    chrom, start, stop = triple
-                    outfile.write(f'>{chrom}:{start}-{stop}\n')
-                    outfile.write(infile.readline())
-                    informative_output.write(informative_line_index)
-                else:
-                    # Discard the current line and the next line
-                    # Do not have to read another line from the informative source file as each informative line takes only one line
-                    infile.readline()
+    # The file holds either a record for every coordinate line or, with --ignore-noninformative,
+    # only the records of the informative lines
+    if len(headers) == len(is_kept):
+        record_rows = np.arange(len(headers))
+    elif informative_rows is not None and len(informative_rows) == len(headers):
+        record_rows = informative_rows
     else:
-        with open(in_filename, 'r') as infile, open(out_filename, 'w') as outfile:
-            for line in infile:
-                triple = map_line_to_coord_triple(line)
-                if triple in coord_set:
-                    chrom, start, stop = triple
-                    outfile.write(f'>{chrom}:{start}-{stop}\n')
-                    outfile.write(infile.readline())
-                else:
-                    # Discard the current line and the next line
-                    infile.readline()
+        raise ValueError(f'{source_filepath} has {len(headers)} records for {len(is_kept)} coordinate lines')
+    header_keys = np.array([get_coord_key(header[1:].split()) for header in headers], dtype='S')
+    if not np.array_equal(header_keys, coord_keys[record_rows]):
+        mismatch = np.flatnonzero(header_keys != coord_keys[record_rows])[0]
+        raise ValueError(f'Record {mismatch} of {source_filepath} is on {header_keys[mismatch].decode()} but its '
+                         f'coordinate line {record_rows[mismatch]} is {coord_keys[record_rows[mismatch]].decode()}')
+    
+    is_kept = get_duplicate_mask(coord_keys, is_kept)
+    kept_records = np.flatnonzero(is_kept[record_rows])
+    with open(target_filepath, 'wb') as target_file:
+        target_file.write(b''.join(b'>%s:%s-%s\n%s\n' % (*headers[i][1:].split(), sequences[i])
+                                   for i in kept_records))
+    
+    if target_informative_filepath:
+        kept_informative_rows = informative_rows[is_kept[informative_rows]]
+        with open(target_informative_filepath, 'wb') as target_informative_file:
+            target_informative_file.write(b''.join(b'%d\n' % row for row in kept_informative_rows.tolist()))
+    
+    return source_filepath, len(kept_records)
+
+
+def run_filter_task(task):
+    return filter_species_file(*task)
 
 
 def create_target_filename(filename, purpose, label):
@@ -70,34 +116,64 @@ def get_filename_with_downsample_suffix(filename, downsample_ratio):
     return f'{filename}.at1.00'
 
 
-def generate_downsample_coord(coord_filename, out_ratio):
+def generate_downsample_mask(line_count, out_ratio):
+    """
+    :return: the boolean mask of the int(line_count * out_ratio) coordinate lines sampled without replacement
+    """
+    is_kept = np.zeros(line_count, dtype=bool)
+    is_kept[np.random.choice(line_count, int(line_count * out_ratio), replace=False)] = True
+    return is_kept
+
+
+def write_downsample_coord(coord_filename, is_kept, downsample_coord_filepath):
     print(f'=> Downdsampling coordinates from {coord_filename}')
-    downsample_coord_filename = get_filename_with_downsample_suffix(coord_filename, out_ratio)
-    line_count = get_line_count(coord_filename)
-    out_indices = np.random.choice(line_count, int(line_count * out_ratio), replace=False)
-    with open(coord_filename, 'r') as file, open(downsample_coord_filename, 'w') as outfile:
-        for line_index, line in enumerate(file):
-            if line_index in out_indices:
-                outfile.write(line)
-    
-    print(f'-> Downsampled coordinates saved to {downsample_coord_filename}')
-    
-    return downsample_coord_filename
+    with open(coord_filename, 'rb') as coord_file:
+        lines = coord_file.read().splitlines(keepends=True)
+    with open(downsample_coord_filepath, 'wb') as outfile:
+        outfile.write(b''.join(lines[line_index] for line_index in np.flatnonzero(is_kept)))
+    print(f'-> Downsampled coordinates saved to {downsample_coord_filepath}')
 
 
-def determine_downsample_ratio(coord_filename):
+def determine_downsample_ratio(num_samples):
     max_samples = 15000
-    num_samples = get_line_count(coord_filename)
     if num_samples <= max_samples:
         return 1.
     else:
         return max_samples / num_samples
 
 
-def transport_files(source_dirname, target_dirname):
+def get_filter_tasks(source_sub_dirname, target_sub_dirname, purpose, label, is_kept, coord_keys):
+    """
+    :return: the list of the filter_species_file arguments of every species of the source subdirectory
+    """
+    tasks = []
+    for filename in sorted(os.listdir(source_sub_dirname)):
+        if not filename.endswith('.fa.ir'):
+            continue
+        species_name = filename[:-len('.fa.ir')]
+        source_filepath = os.path.join(source_sub_dirname, filename)
+        target_filepath = os.path.join(target_sub_dirname, create_target_filename(species_name, purpose, label))
+        
+        species_informative_filename = species_name + '.informative'
+        species_informative_filepath = os.path.join(source_sub_dirname, species_informative_filename)
+        if os.path.isfile(species_informative_filepath):
+            tasks.append((source_filepath, target_filepath, is_kept, coord_keys, species_informative_filepath,
+                          os.path.join(target_sub_dirname, species_informative_filename)))
+        else:
+            print(f'-> Did not find the corresponding species informative line index file '
+                  f'{species_informative_filepath}')
+            tasks.append((source_filepath, target_filepath, is_kept, coord_keys))
+    return tasks
+
+
+def transport_files(source_dirname, target_dirname, num_processes=1):
     """
+    Downsamples the coordinates of every purpose and label and writes the kept records of the species files
+    directly to the target subdirectories, filtering the species files on num_processes processes.
     :param source_dirname: can be a relative path or an absolute path
     :param target_dirname: an absolute path
+    :param num_processes: the number of processes filtering the species files, 1 to filter them in this process,
+    which run_jobs relies on since its stages already run in the workers of a process pool
     """
     purpose_list = ['train', 'test']
     label_list = ['pos', 'neg']
@@ -107,66 +183,38 @@ def transport_files(source_dirname, target_dirname):
     os.chdir(source_dirname)
     src_dir_basename = os.path.basename(os.path.normpath(source_dirname))
     
-    for purpose in purpose_list:
-        for label in label_list:
-            source_sub_dirname = f'{src_dir_basename}.{purpose}.{label}.coord.mult_species'
-            
-            coord_filename = f'{src_dir_basename}.{purpose}.{label}.coord'
-            downsample_ratio = determine_downsample_ratio(coord_filename)
-            print(f'-> Downsample ratio for {coord_filename}: {downsample_ratio:.2f}')
-            
-            target_sub_dirname = os.path.join(
-                target_dirname,
-                get_filename_with_downsample_suffix(source_sub_dirname, downsample_ratio))
-            
-            # We will save the downsampled data to source_downsample_sub_dirname before copying them
-            # to the target subdirectory target_sub_dirname
-            source_downsample_sub_dirname = get_filename_with_downsample_suffix(source_sub_dirname, downsample_ratio)
-            os.makedirs(source_downsample_sub_dirname, exist_ok=False)
-            downsampled_coord_filename = generate_downsample_coord(coord_filename, downsample_ratio)
-            
-            print(f'\n=> Creating target subdirectory with target_sub_dirname: {target_sub_dirname}')
-            os.makedirs(target_sub_dirname, exist_ok=False)
-            
-            shutil.copyfile(downsampled_coord_filename, os.path.join(target_sub_dirname, downsampled_coord_filename))
-            
-            source_subdir_files = os.listdir(source_sub_dirname)
-            print(f'=> Source subdirectory: {source_sub_dirname}')
-            
-            for filename in source_subdir_files:
-                if filename.endswith('.fa.ir'):
-                    suffix_len = len('.ir')
-                    
-                    source_filepath = os.path.join(source_sub_dirname, filename)
-                    
-                    source_downsampled_filepath = os.path.join(source_downsample_sub_dirname,
-                                                               get_filename_with_downsample_suffix(filename, downsample_ratio))
-                    
-                    target_filepath = os.path.join(target_sub_dirname,
-                                                   create_target_filename(filename[:-suffix_len - 1], purpose, label))
-                    
-                    species_informative_filename = filename[:-len('.fa.ir') - 1] + '.informative'
-                    species_informative_filepath = os.path.join(source_sub_dirname, species_informative_filename)
-                    
-                    if os.path.isfile(species_informative_filepath):
-                        source_species_informative_donwsampled_filepath = os.path.join(
-                            source_downsample_sub_dirname,
-                            get_filename_with_downsample_suffix(species_informative_filename, downsample_ratio))
-                        target_species_informative_filename = os.path.join(target_sub_dirname, species_informative_filename)
-                        
-                        convert_to_final_rep_and_downsample(downsampled_coord_filename, source_filepath, source_downsampled_filepath,
-                                                            species_informative_filepath,
-                                                            source_species_informative_donwsampled_filepath)
-                        print(f'=> Copying {source_downsampled_filepath} to {target_filepath}')
-                        shutil.copyfile(source_downsampled_filepath, target_filepath)
-                        print(f'=> Copying {source_species_informative_donwsampled_filepath} to {target_species_informative_filename}')
-                        shutil.copyfile(source_species_informative_donwsampled_filepath, target_species_informative_filename)
-                    
-                    else:
-                        print(f'-> Did not find the corresponding species informative line index file {species_informative_filepath}')
-                        convert_to_final_rep_and_downsample(downsampled_coord_filename, source_filepath, source_downsampled_filepath)
-                        print(f'=> Copying {source_downsampled_filepath} to {target_filepath}')
-                        shutil.copyfile(source_downsampled_filepath, target_filepath)
+    pool = Pool(num_processes) if num_processes > 1 else None
+    try:
+        for purpose in purpose_list:
+            for label in label_list:
+                source_sub_dirname = f'{src_dir_basename}.{purpose}.{label}.coord.mult_species'
+                
+                coord_filename = f'{src_dir_basename}.{purpose}.{label}.coord'
+                line_count = get_line_count(coord_filename)
+                downsample_ratio = determine_downsample_ratio(line_count)
+                print(f'-> Downsample ratio for {coord_filename}: {downsample_ratio:.2f}')
+                
+                target_sub_dirname = os.path.join(
+                    target_dirname,
+                    get_filename_with_downsample_suffix(source_sub_dirname, downsample_ratio))
+                
+                print(f'\n=> Creating target subdirectory with target_sub_dirname: {target_sub_dirname}')
+                os.makedirs(target_sub_dirname, exist_ok=False)
+                
+                is_kept = generate_downsample_mask(line_count, downsample_ratio)
+                write_downsample_coord(coord_filename, is_kept, os.path.join(
+                    target_sub_dirname, get_filename_with_downsample_suffix(coord_filename, downsample_ratio)))
+                
+                print(f'=> Source subdirectory: {source_sub_dirname}')
+                tasks = get_filter_tasks(source_sub_dirname, target_sub_dirname, purpose, label, is_kept,
+                                         read_coord_keys(coord_filename))
+                results = pool.imap_unordered(run_filter_task, tasks) if pool else map(run_filter_task, tasks)
+                for source_filepath, num_kept_records in results:
+                    print(f'=> Wrote {num_kept_records} records of {source_filepath} to {target_sub_dirname}')
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
     
     print(f'=> Changing the working directory back to {original_dirname}')
     os.chdir(original_dirname)
@@ -177,9 +225,12 @@ if __name__ == '__main__':
         usage='To be called directly with python3 transport_files.py and not as a module with the -m option.')
     parser.add_argument('source_dirname', help='The top level directory to copy from')
     parser.add_argument('target_dirname', help='The target directory to copy data to.')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                        help='number of processes filtering the species files, defaults to the number of cores, '
+                             'run_jobs calls transport_files with a single process instead')
     args = parser.parse_args()
     if args.target_dirname[0] != '/':
         print(f'target dirname must be an absolute path')
         exit(1)
     # /Users/aaron/lsgkm/tests
-    transport_files(args.source_dirname, args.target_dirname)
+    transport_files(args.source_dirname, args.target_dirname, args.processes)
@@ -0,0 +1,274 @@
+import multiprocessing
+import queue
+import traceback
+
+import h5py
+import numpy as np
+
+from coded_features import open_feature_view
+
+# Seconds between the checks that the workers are still alive while waiting for a batch
+result_poll_seconds = 1.0
+
+
+def open_views(hdf5_file, feature_key, label_key):
+    """
+    :return: (features, labels) where the datasets that derive their reverse complement samples are wrapped
+    in their views, see coded_features.open_feature_view. labels is None if label_key is None.
+    """
+    features = open_feature_view(hdf5_file[feature_key])
+    labels = open_feature_view(hdf5_file[label_key]) if label_key is not None else None
+    if labels is not None and len(labels) != len(features):
+        raise ValueError(f'{feature_key} has {len(features)} samples but {label_key} has {len(labels)}')
+    return features, labels
+
+
+def get_view_dtype(view):
+    # CodedFeatureView always decodes to uint8
+    return np.dtype(getattr(view, 'dtype', 'uint8'))
+
+
+class SharedBatchSlot:
+    """
+    Feature and label buffers for one batch, allocated in shared memory before the workers are started
+    so that the workers fill them in place and the main process reads them without copying.
+    """
+    def __init__(self, batch_size, feature_shape, feature_dtype, label_shape, label_dtype):
+        self.feature_spec = ((batch_size,) + tuple(feature_shape), np.dtype(feature_dtype))
+        self.label_spec = None if label_shape is None else ((batch_size,) + tuple(label_shape), np.dtype(label_dtype))
+        self.feature_buffer = multiprocessing.RawArray('B', self.get_num_bytes(self.feature_spec))
+        self.label_buffer = None if label_shape is None else \
+            multiprocessing.RawArray('B', self.get_num_bytes(self.label_spec))
+
+    @staticmethod
+    def get_num_bytes(spec):
+        shape, dtype = spec
+        return max(1, int(np.prod(shape)) * dtype.itemsize)
+
+    @staticmethod
+    def to_array(buffer, spec):
+        shape, dtype = spec
+        return np.frombuffer(buffer, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+    def get_arrays(self):
+        features = self.to_array(self.feature_buffer, self.feature_spec)
+        labels = None if self.label_buffer is None else self.to_array(self.label_buffer, self.label_spec)
+        return features, labels
+
+
+class LoaderWorker(multiprocessing.Process):
+    """
+    Opens its own handle of the hdf5 file once started, then fills the batch slots requested on the task queue.
+    A task is (batch_index, slot_index, ranges, order) where ranges is a list of contiguous (start, stop) sample
+    ranges and order is the permutation applied to the concatenated samples, or None.
+    """
+    def __init__(self, filename, feature_key, label_key, slots, task_queue, result_queue):
+        super().__init__(daemon=True)
+        self.filename = filename
+        self.feature_key = feature_key
+        self.label_key = label_key
+        self.slots = slots
+        self.task_queue = task_queue
+        self.result_queue = result_queue
+
+    def run(self):
+        hdf5_file = None
+        try:
+            hdf5_file = h5py.File(self.filename, 'r')
+            features, labels = open_views(hdf5_file, self.feature_key, self.label_key)
+            slot_arrays = [slot.get_arrays() for slot in self.slots]
+        except Exception:
+            # Answer every task taken with the error, the main process waits for a result per dispatched batch
+            error = traceback.format_exc()
+            if hdf5_file is not None:
+                hdf5_file.close()
+            for batch_index, slot_index, _, _ in iter(self.task_queue.get, None):
+                self.result_queue.put((batch_index, slot_index, 0, error))
+            return
+
+        with hdf5_file:
+            for task in iter(self.task_queue.get, None):
+                batch_index, slot_index, ranges, order = task
+                try:
+                    feature_array, label_array = slot_arrays[slot_index]
+                    count = 0
+                    for start, stop in ranges:
+                        feature_array[count:count + stop - start] = features[start:stop]
+                        if labels is not None:
+                            label_array[count:count + stop - start] = labels[start:stop]
+                        count += stop - start
+
+                    if order is not None:
+                        feature_array[:count] = feature_array[:count][order]
+                        if labels is not None:
+                            label_array[:count] = label_array[:count][order]
+                    self.result_queue.put((batch_index, slot_index, count, None))
+                except Exception:
+                    self.result_queue.put((batch_index, slot_index, 0, traceback.format_exc()))
+
+
+class ParallelHDF5Loader:
+    """
+    Iterates over the (features, labels) batches of an hdf5 file with num_workers worker processes.
+
+    Every epoch the samples are split into contiguous chunks of chunk_size samples, the chunks are shuffled
+    with a generator seeded by (seed, epoch) and grouped into batches, and the samples of each batch are shuffled
+    as well. Reading contiguous chunks keeps the hdf5 reads large while the batches stay well mixed,
+    and the batches are the same for a given seed regardless of the number of workers.
+
+    The datasets that derive their reverse complement samples are read through their views,
+    so the samples are the same as those of the files storing the reverse complement in their second half.
+
+    The yielded arrays live in shared memory and are reused once the next batch is requested,
+    copy them to keep them longer.
+
+    Usage:
+        with ParallelHDF5Loader('chr1_train.hundred.hdf5', batch_size=64, num_workers=4) as loader:
+            for epoch in range(num_epochs):
+                for features, labels in loader.iterate_epoch(epoch):
+                    ...
+    """
+    def __init__(self, filename, feature_key='feature/data', label_key='label/data', batch_size=256,
+                 num_workers=4, chunk_size=32, shuffle=True, seed=0, num_prefetched_batches=2):
+        """
+        :param label_key: None to only load the features, in which case the labels are None
+        :param num_prefetched_batches: number of batches each worker may have in flight
+        """
+        self.filename = filename
+        self.feature_key = feature_key
+        self.label_key = label_key
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.next_epoch = 0
+
+        # The file is closed again before the workers are forked, each worker opens its own handle.
+        with h5py.File(filename, 'r') as hdf5_file:
+            features, labels = open_views(hdf5_file, feature_key, label_key)
+            self.num_samples = len(features)
+            feature_shape, feature_dtype = features.shape[1:], get_view_dtype(features)
+            label_shape, label_dtype = (labels.shape[1:], get_view_dtype(labels)) if labels is not None \
+                else (None, None)
+
+        self.slots = [SharedBatchSlot(batch_size, feature_shape, feature_dtype, label_shape, label_dtype)
+                      for _ in range(num_workers * num_prefetched_batches)]
+        self.slot_arrays = [slot.get_arrays() for slot in self.slots]
+        self.task_queue = multiprocessing.Queue()
+        self.result_queue = multiprocessing.Queue()
+        self.workers = []
+
+    def __len__(self):
+        return (self.num_samples + self.batch_size - 1) // self.batch_size
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        self.workers = [LoaderWorker(self.filename, self.feature_key, self.label_key, self.slots,
+                                     self.task_queue, self.result_queue) for _ in range(self.num_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def close(self):
+        for _ in self.workers:
+            self.task_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def get_result(self):
+        """
+        :return: the next (batch_index, slot_index, count, error) result of the workers
+        :raise RuntimeError: if a worker died while waiting, its batches would never be answered
+        """
+        while True:
+            try:
+                return self.result_queue.get(timeout=result_poll_seconds)
+            except queue.Empty:
+                dead_workers = [worker for worker in self.workers if not worker.is_alive()]
+                if dead_workers:
+                    raise RuntimeError(f'{len(dead_workers)} loader worker(s) of {self.filename} died, '
+                                       f'exit code {dead_workers[0].exitcode}')
+
+    def get_batches(self, epoch):
+        """
+        :return: a list of (ranges, order) for each batch of the epoch, see LoaderWorker
+        """
+        rng = np.random.default_rng((self.seed, epoch))
+        chunk_starts = np.arange(0, self.num_samples, self.chunk_size)
+        if self.shuffle:
+            rng.shuffle(chunk_starts)
+
+        batches = []
+        ranges = []
+        count = 0
+        for chunk_start in chunk_starts:
+            chunk_stop = min(chunk_start + self.chunk_size, self.num_samples)
+            while chunk_start < chunk_stop:
+                # A chunk is split when it straddles two batches
+                stop = min(chunk_stop, chunk_start + self.batch_size - count)
+                ranges.append((int(chunk_start), int(stop)))
+                count += stop - chunk_start
+                chunk_start = stop
+                if count == self.batch_size:
+                    batches.append(ranges)
+                    ranges = []
+                    count = 0
+        if ranges:
+            batches.append(ranges)
+
+        return [(ranges, rng.permutation(sum(stop - start for start, stop in ranges)) if self.shuffle else None)
+                for ranges in batches]
+
+    def iterate_epoch(self, epoch):
+        """
+        :return: a generator of (features, labels) batches, which are shared memory views
+        only valid until the next batch is requested
+        """
+        if not self.workers:
+            raise RuntimeError('The loader has to be started first, e.g. with a with statement')
+
+        batches = self.get_batches(epoch)
+        free_slots = list(range(len(self.slots)))
+        completed = {}
+        num_dispatched = num_received = num_yielded = 0
+        try:
+            while num_yielded < len(batches):
+                while free_slots and num_dispatched < len(batches):
+                    ranges, order = batches[num_dispatched]
+                    self.task_queue.put((num_dispatched, free_slots.pop(), ranges, order))
+                    num_dispatched += 1
+
+                while num_yielded not in completed:
+                    batch_index, slot_index, count, error = self.get_result()
+                    num_received += 1
+                    if error is not None:
+                        raise RuntimeError(f'Failed to load batch {batch_index} of {self.filename}:\n{error}')
+                    completed[batch_index] = slot_index, count
+
+                slot_index, count = completed.pop(num_yielded)
+                feature_array, label_array = self.slot_arrays[slot_index]
+                yield feature_array[:count], None if label_array is None else label_array[:count]
+
+                free_slots.append(slot_index)
+                num_yielded += 1
+        finally:
+            # Wait for the batches still in flight so that they do not leak into the next epoch
+            while num_received < num_dispatched:
+                try:
+                    self.get_result()
+                except RuntimeError:
+                    # The batches of a dead worker never come back
+                    break
+                num_received += 1
+
+    def __iter__(self):
+        epoch = self.next_epoch
+        self.next_epoch += 1
+        return self.iterate_epoch(epoch)
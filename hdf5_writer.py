@@ -0,0 +1,115 @@
+import numpy as np
+
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+compression_choices = ('none', 'lzf', 'gzip', 'blosc')
+default_compression = 'none'
+
+# Each chunk holds whole samples and is about this size, so that reading a sample decompresses little else
+default_chunk_bytes = 1 << 20
+# Upper bound on the memory held by the samples buffered in a BlockWriter
+default_block_bytes = 64 << 20
+
+
+def get_filter_kwargs(compression=default_compression, compression_level=None):
+    """
+    :param compression: one of compression_choices, None meaning 'none'
+    :param compression_level: gzip level in [0, 9] or blosc clevel, defaults to 4
+    :return: the filter keyword arguments for h5py create_dataset
+    """
+    if compression is None or compression == 'none':
+        return {}
+    if compression == 'lzf':
+        return dict(compression='lzf')
+    level = 4 if compression_level is None else compression_level
+    if compression == 'gzip':
+        return dict(compression='gzip', compression_opts=level)
+    if compression == 'blosc':
+        if hdf5plugin is None:
+            raise ImportError('The blosc compression requires the hdf5plugin package')
+        return dict(hdf5plugin.Blosc(cname='lz4', clevel=level, shuffle=hdf5plugin.Blosc.SHUFFLE))
+    raise ValueError(f'Unknown compression {compression}, expected one of {compression_choices}')
+
+
+def get_chunk_shape(shape, dtype, chunk_bytes=default_chunk_bytes):
+    """
+    :param shape: the dataset shape whose first axis is the sample axis
+    :return: a chunk shape made of whole samples, as many as fit in chunk_bytes but at least one
+    """
+    sample_bytes = max(1, int(np.prod(shape[1:], dtype='int64')) * np.dtype(dtype).itemsize)
+    num_samples = min(max(1, chunk_bytes // sample_bytes), max(1, shape[0]))
+    return (num_samples,) + tuple(shape[1:])
+
+
+def create_feature_dataset(group, name, shape, dtype='uint8', compression=default_compression,
+                           compression_level=None, chunk_bytes=default_chunk_bytes):
+    """
+    Creates a dataset chunked along the sample axis with the given compression filter,
+    see get_filter_kwargs for compression and compression_level.
+    """
+    return group.create_dataset(name, shape, dtype=dtype, chunks=get_chunk_shape(shape, dtype, chunk_bytes),
+                                **get_filter_kwargs(compression, compression_level))
+
+
+def get_block_size(dataset, block_bytes=default_block_bytes):
+    """
+    :return: the number of samples of the dataset that fit in block_bytes, but at least one chunk worth
+    """
+    sample_bytes = max(1, int(np.prod(dataset.shape[1:], dtype='int64')) * dataset.dtype.itemsize)
+    return max(dataset.chunks[0] if dataset.chunks else 1, block_bytes // sample_bytes)
+
+
+class BlockWriter:
+    """
+    Buffers (row index, sample) pairs and writes them to the dataset in contiguous blocks of rows.
+    The samples can be written in any order, they are sorted by row index when the buffer is flushed
+    so that every run of consecutive rows becomes a single write.
+    The buffer is flushed once it holds block_size samples, which defaults to about default_block_bytes.
+    """
+    def __init__(self, dataset, block_size=None):
+        self.dataset = dataset
+        self.block_size = get_block_size(dataset) if block_size is None else block_size
+        self.row_indices = []
+        self.samples = []
+        self.num_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        # Nothing is written on failure since the file is incomplete anyway
+        if exc_type is None:
+            self.flush()
+
+    def write(self, row_index, sample):
+        self.row_indices.append(row_index)
+        self.samples.append(sample)
+        if len(self.samples) >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        if not self.samples:
+            return
+        order = np.argsort(self.row_indices, kind='stable')
+        row_indices = np.asarray(self.row_indices)[order]
+        # the positions in order where a new run of consecutive rows begins
+        run_starts = np.flatnonzero(np.diff(row_indices) != 1) + 1
+        for run in np.split(np.arange(len(order)), run_starts):
+            first_row = row_indices[run[0]]
+            self.dataset[first_row:first_row + len(run)] = np.stack([self.samples[order[i]] for i in run])
+        self.num_written += len(order)
+        self.row_indices = []
+        self.samples = []
+
+
+def add_compression_arguments(parser):
+    parser.add_argument('--compression', choices=compression_choices, default=default_compression,
+                        help='filter of the output hdf5 datasets, blosc requires the hdf5plugin package')
+    parser.add_argument('--compression-level', type=int, default=None, help='gzip or blosc compression level')
+
+
+def get_compression_options(args):
+    return dict(compression=args.compression, compression_level=args.compression_level)
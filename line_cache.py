@@ -1,27 +1,105 @@
-class LineCache:
+import sys
+from collections import OrderedDict
+
+cache_policies = ('lru', 'arc')
+
+
+def get_entry_size(value):
+    """
+    Approximates the number of bytes held by a cached value.
+    numpy arrays are measured by their buffer size, tuples by the sum of their elements.
+    """
+    if isinstance(value, tuple):
+        return sum(get_entry_size(element) for element in value)
+    if hasattr(value, 'nbytes'):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+
+class CacheStatistics:
     def __init__(self):
-        self.capacity = 1000
-        self.count_per_eviction = 200
-        self.cache = {}
-        self.key_list = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def reset_stats(self):
+        self.hits = self.misses = self.evictions = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.
+
+    def get_stats_str(self):
+        return f'cache hits: {self.hits} misses: {self.misses} hit rate: {self.hit_rate:.2%} ' \
+               f'evictions: {self.evictions}'
+
+
+class LRUCache(CacheStatistics):
+    """
+    Least recently used cache with O(1) lookups and insertions.
+    The capacity is bounded by the number of entries, by the total size of the values as measured by get_size,
+    or both.
+
+    A failed membership test counts as a miss so that the idiom
+    if key in cache: value = cache[key]
+    is accounted for in the statistics.
+    """
+    def __init__(self, capacity=1000, max_bytes=None, get_size=get_entry_size):
+        super().__init__()
+        if capacity is None and max_bytes is None:
+            raise ValueError('Either capacity or max_bytes has to be specified')
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.get_size = get_size
+        self.num_bytes = 0
+        self.cache = OrderedDict()
+        self.entry_sizes = {}
+
+    def is_over_capacity(self):
+        return (self.capacity is not None and len(self.cache) > self.capacity) or \
+               (self.max_bytes is not None and self.num_bytes > self.max_bytes)
 
     def evict(self):
-        for key in self.key_list[:self.count_per_eviction]:
-            del self.cache[key]
-        self.key_list = self.key_list[self.count_per_eviction:]
+        key, _ = self.cache.popitem(last=False)
+        self.num_bytes -= self.entry_sizes.pop(key, 0)
+        self.evictions += 1
+
+    def get(self, key, default=None):
+        if key not in self.cache:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.cache.move_to_end(key)
+        return self.cache[key]
 
     def __contains__(self, item):
-        return item in self.cache
+        if item in self.cache:
+            return True
+        self.misses += 1
+        return False
 
     def __getitem__(self, item):
+        if item not in self.cache:
+            self.misses += 1
+            raise KeyError(item)
+        self.hits += 1
+        self.cache.move_to_end(item)
         return self.cache[item]
 
     def __setitem__(self, key, value):
-        if len(self.cache) >= self.capacity:
-            self.evict()
+        if key in self.cache:
+            self.cache.move_to_end(key)
         self.cache[key] = value
-        if key not in self.key_list:
-            self.key_list.append(key)
+
+        if self.max_bytes is not None:
+            size = self.get_size(value)
+            self.num_bytes += size - self.entry_sizes.get(key, 0)
+            self.entry_sizes[key] = size
+
+        # Never evict the entry that was just inserted.
+        while len(self.cache) > 1 and self.is_over_capacity():
+            self.evict()
 
     def __len__(self):
         return len(self.cache)
@@ -34,3 +112,131 @@ class LineCache:
 
     def items(self):
         return self.cache.items()
+
+
+class ARCCache(CacheStatistics):
+    """
+    Adaptive replacement cache (Megiddo and Modha) with O(1) lookups and insertions.
+    Entries seen once live in recent, entries seen at least twice live in frequent, and the keys recently evicted
+    from either are remembered in the ghost lists to adapt the target size of recent.
+    This keeps the windows of neighbouring coordinates resident while a scan through new coordinates
+    only churns through recent.
+
+    The capacity is the number of entries.
+    """
+    def __init__(self, capacity=1000):
+        super().__init__()
+        self.capacity = capacity
+        # target size of recent
+        self.target_recent_size = 0
+        self.recent = OrderedDict()
+        self.frequent = OrderedDict()
+        self.recent_ghosts = OrderedDict()
+        self.frequent_ghosts = OrderedDict()
+
+    def replace(self, key):
+        if len(self.recent) + len(self.frequent) < self.capacity:
+            return
+        if self.recent and (not self.frequent or len(self.recent) > self.target_recent_size or
+                            (key in self.frequent_ghosts and len(self.recent) == self.target_recent_size)):
+            evicted_key, _ = self.recent.popitem(last=False)
+            self.recent_ghosts[evicted_key] = None
+        else:
+            evicted_key, _ = self.frequent.popitem(last=False)
+            self.frequent_ghosts[evicted_key] = None
+        self.evictions += 1
+
+    def lookup(self, key):
+        # Returns whether the key is cached and promotes it to frequent on a hit.
+        if key in self.recent:
+            self.frequent[key] = self.recent.pop(key)
+        elif key in self.frequent:
+            self.frequent.move_to_end(key)
+        else:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def get(self, key, default=None):
+        return self.frequent[key] if self.lookup(key) else default
+
+    def __contains__(self, item):
+        if item in self.recent or item in self.frequent:
+            return True
+        self.misses += 1
+        return False
+
+    def __getitem__(self, item):
+        if not self.lookup(item):
+            raise KeyError(item)
+        return self.frequent[item]
+
+    def __setitem__(self, key, value):
+        if key in self.recent:
+            del self.recent[key]
+            self.frequent[key] = value
+        elif key in self.frequent:
+            self.frequent[key] = value
+            self.frequent.move_to_end(key)
+
+        elif key in self.recent_ghosts:
+            delta = max(len(self.frequent_ghosts) / len(self.recent_ghosts), 1)
+            self.target_recent_size = min(self.capacity, self.target_recent_size + delta)
+            self.replace(key)
+            del self.recent_ghosts[key]
+            self.frequent[key] = value
+
+        elif key in self.frequent_ghosts:
+            delta = max(len(self.recent_ghosts) / len(self.frequent_ghosts), 1)
+            self.target_recent_size = max(0, self.target_recent_size - delta)
+            self.replace(key)
+            del self.frequent_ghosts[key]
+            self.frequent[key] = value
+
+        else:
+            recent_history_size = len(self.recent) + len(self.recent_ghosts)
+            total_history_size = recent_history_size + len(self.frequent) + len(self.frequent_ghosts)
+            if recent_history_size >= self.capacity:
+                if len(self.recent) < self.capacity:
+                    self.recent_ghosts.popitem(last=False)
+                    self.replace(key)
+                else:
+                    self.recent.popitem(last=False)
+                    self.evictions += 1
+            elif total_history_size >= self.capacity:
+                if total_history_size >= 2 * self.capacity:
+                    self.frequent_ghosts.popitem(last=False)
+                self.replace(key)
+            self.recent[key] = value
+
+    def __len__(self):
+        return len(self.recent) + len(self.frequent)
+
+    def keys(self):
+        return list(self.recent.keys()) + list(self.frequent.keys())
+
+    def values(self):
+        return list(self.recent.values()) + list(self.frequent.values())
+
+    def items(self):
+        return list(self.recent.items()) + list(self.frequent.items())
+
+
+def create_cache(policy='lru', capacity=1000, max_bytes=None):
+    """
+    :param policy: one of cache_policies
+    :param capacity: max number of entries
+    :param max_bytes: max total size of the values, only supported by the lru policy
+    """
+    if policy == 'lru':
+        return LRUCache(capacity=capacity, max_bytes=max_bytes)
+    if policy == 'arc':
+        if max_bytes is not None:
+            raise ValueError('The arc policy only supports a capacity in number of entries')
+        return ARCCache(capacity=capacity)
+    raise ValueError(f'Unknown cache policy {policy}, expected one of {cache_policies}')
+
+
+# Kept for the scripts that construct the cache directly.
+LineCache = LRUCache
@@ -0,0 +1,175 @@
+import os
+from bisect import bisect_left
+
+import numpy as np
+
+from binary_search import search, scan_through_line_for_number
+from line_cache import cache_policies, create_cache
+from maf_store import MafStore, get_store_dirname, has_maf_store, parse_alignment_line
+
+# Enough for a hundred overlapping 1000 bp windows
+default_cache_capacity = 100000
+
+
+class MafFileReader:
+    """
+    Serves the same windows as maf_store.MafStore directly from chr*_maf_sequence.csv with binary search,
+    for alignment files that have not been converted by maf_store.py.
+    """
+    def __init__(self, alignment_filename, cache_policy='lru', cache_capacity=default_cache_capacity,
+                 cache_max_bytes=None):
+        self.alignment_filename = alignment_filename
+        self.file = open(alignment_filename, 'r')
+        self.species = self.file.readline().strip().split(',')[1:]
+        self.num_species = len(self.species)
+        self.file_byte_size = os.stat(alignment_filename).st_size
+        # maps a coordinate to (letters, byte offset of the line)
+        self.cache = create_cache(cache_policy, cache_capacity, cache_max_bytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def get_window(self, start, stop, fill='X'):
+        """
+        See MafStore.get_window
+        """
+        offsets = []
+        letter_rows = []
+        start_line_hint = None
+        for offset, coordinate in enumerate(range(start, stop)):
+            cached_result = self.cache.get(coordinate)
+            if cached_result:
+                letters, start_line_hint = cached_result
+            else:
+                if start_line_hint is None:
+                    result = search(self.file, coordinate, self.file_byte_size)
+                else:
+                    result = scan_through_line_for_number(alignment_file=self.file,
+                                                          start_line_hint=start_line_hint, number=coordinate)
+                if not result:
+                    continue
+
+                line, start_line_hint = result
+                _, letters = parse_alignment_line(line)
+                self.cache[coordinate] = (letters, start_line_hint)
+
+            offsets.append(offset)
+            letter_rows.append(letters)
+
+        window = np.full((stop - start, self.num_species), ord(fill), dtype='uint8')
+        found = np.zeros(stop - start, dtype=bool)
+        if offsets:
+            window[offsets] = np.frombuffer(b''.join(letter_rows), dtype='uint8').reshape(-1, self.num_species)
+            found[offsets] = True
+        return window, found
+
+
+class MafSweepReader:
+    """
+    Serves the same windows as maf_store.MafStore by streaming chr*_maf_sequence.csv forward exactly once,
+    keeping a sliding buffer of the rows that later windows may still need.
+    The windows have to be requested in non-decreasing order of their start coordinates.
+    """
+    def __init__(self, alignment_filename):
+        self.alignment_filename = alignment_filename
+        self.file = open(alignment_filename, 'r')
+        self.species = self.file.readline().strip().split(',')[1:]
+        self.num_species = len(self.species)
+        # The file is read sequentially so there is nothing to cache.
+        self.cache = None
+        # The buffered rows, sorted by position
+        self.positions = []
+        self.letter_rows = []
+        self.last_start = None
+        self.is_exhausted = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def get_window(self, start, stop, fill='X'):
+        """
+        See MafStore.get_window
+        """
+        if self.last_start is not None and start < self.last_start:
+            raise ValueError(f'Windows have to be requested in sorted order but {start} comes after {self.last_start}')
+        self.last_start = start
+
+        # No later window can need the rows before the current start.
+        num_stale_rows = bisect_left(self.positions, start)
+        del self.positions[:num_stale_rows]
+        del self.letter_rows[:num_stale_rows]
+
+        # Read until the buffer covers every position before stop.
+        while not self.is_exhausted and (not self.positions or self.positions[-1] < stop - 1):
+            line = self.file.readline()
+            if not line:
+                self.is_exhausted = True
+            elif line.strip():
+                position, letters = parse_alignment_line(line)
+                if position >= start:
+                    self.positions.append(position)
+                    self.letter_rows.append(letters)
+
+        num_rows = bisect_left(self.positions, stop)
+        offsets = np.array(self.positions[:num_rows], dtype='int64') - start
+
+        window = np.full((stop - start, self.num_species), ord(fill), dtype='uint8')
+        found = np.zeros(stop - start, dtype=bool)
+        if num_rows:
+            window[offsets] = np.frombuffer(b''.join(self.letter_rows[:num_rows]), dtype='uint8') \
+                .reshape(-1, self.num_species)
+            found[offsets] = True
+        return window, found
+
+
+def add_cache_arguments(parser):
+    parser.add_argument('--cache-policy', choices=cache_policies, default='lru')
+    parser.add_argument('--cache-capacity', type=int, default=default_cache_capacity,
+                        help='max number of coordinates cached when reading from the alignment csv file')
+    parser.add_argument('--cache-max-bytes', type=int, default=None,
+                        help='max number of bytes of the cached alignment rows, only supported by the lru policy')
+
+
+def get_cache_options(args):
+    return dict(cache_policy=args.cache_policy, cache_capacity=args.cache_capacity,
+                cache_max_bytes=args.cache_max_bytes)
+
+
+def open_alignment(alignment_filename, cache_options=None, sorted_sweep=False):
+    """
+    :param alignment_filename: e.g. chr1_maf_sequence.csv
+    :param cache_options: keyword arguments for the cache of MafFileReader, see get_cache_options
+    :param sorted_sweep: whether the windows will be requested in sorted order
+    :return: a MafStore if the alignment file has been converted by maf_store.py, otherwise a MafSweepReader
+    if sorted_sweep is True, otherwise a MafFileReader.
+    All of them provide species, num_species, cache and get_window(start, stop, fill).
+    """
+    if has_maf_store(alignment_filename):
+        print(f'=> Using the binary store {get_store_dirname(alignment_filename)}')
+        return MafStore(get_store_dirname(alignment_filename))
+    if sorted_sweep:
+        print(f'=> Sweeping through {alignment_filename} once')
+        return MafSweepReader(alignment_filename)
+    return MafFileReader(alignment_filename, **(cache_options or {}))
+
+
+def format_cache_stats(alignment):
+    """
+    :return: the cache statistics of the alignment to be appended to the progress messages,
+    or an empty string if the alignment is not cached.
+    """
+    if alignment.cache is None:
+        return ''
+    return f' {alignment.cache.get_stats_str()}'
@@ -0,0 +1,250 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from util.file import get_line_count
+from window_encoding import counting_table
+
+positions_filename = 'positions.npy'
+letters_filename = 'letters.npy'
+# Optional (num_positions x 5) uint8 A G C T X counts of the species other than count_excluded_species,
+# see build_count_track
+counts_filename = 'counts.npy'
+count_excluded_species = 'hg19'
+# The species header is written last so that its presence marks a complete store.
+species_filename = 'species.txt'
+
+
+def get_store_dirname(alignment_filename):
+    # e.g. chr1_maf_sequence.csv -> chr1_maf_sequence.store
+    return os.path.splitext(alignment_filename)[0] + '.store'
+
+
+def parse_alignment_line(line):
+    """
+    :param line: a line from chr*_maf_sequence.csv of the form pos,letter_1,...,letter_100
+    :return: (position, letters) where letters is a bytes object holding one ASCII letter per species
+    """
+    tokens = line.strip().split(',')
+    return int(tokens[0]), ''.join(tokens[1:]).encode('ascii')
+
+
+def build_maf_store(alignment_filename, store_dirname=None, chunk_size=100000):
+    """
+    Converts chr*_maf_sequence.csv into a binary store consisting of
+    positions.npy: a sorted int32 array of the coordinates present in the alignment file
+    letters.npy: a (num_positions x num_species) uint8 matrix holding the ASCII letter of each species
+    species.txt: the species codes in the column order of the letter matrix, one per line
+
+    The letters are kept as ASCII so that the store is lossless, e.g. the case of the letters is preserved.
+
+    :param alignment_filename: e.g. chr1_maf_sequence.csv
+    :param store_dirname: defaults to get_store_dirname(alignment_filename)
+    :param chunk_size: number of lines to parse before flushing them to the memory-mapped arrays
+    :return: the name of the store directory
+    """
+    if store_dirname is None:
+        store_dirname = get_store_dirname(alignment_filename)
+
+    # Excluding the header line.
+    num_positions = get_line_count(alignment_filename) - 1
+
+    with open(alignment_filename, 'r') as alignment_file:
+        species = alignment_file.readline().strip().split(',')[1:]
+        num_species = len(species)
+
+        print(f'=> Converting {alignment_filename} with {num_positions} positions and {num_species} species '
+              f'into {store_dirname}')
+        os.makedirs(store_dirname, exist_ok=True)
+
+        positions = np.lib.format.open_memmap(os.path.join(store_dirname, positions_filename), mode='w+',
+                                              dtype='int32', shape=(num_positions,))
+        letters = np.lib.format.open_memmap(os.path.join(store_dirname, letters_filename), mode='w+',
+                                            dtype='uint8', shape=(num_positions, num_species))
+
+        stamp = time.time()
+        row_index = 0
+        position_chunk = []
+        letter_chunk = bytearray()
+
+        def flush():
+            nonlocal row_index, position_chunk, letter_chunk
+            if not position_chunk:
+                return
+            chunk = np.array(position_chunk, dtype='int32')
+            # Every downstream lookup relies on the positions being strictly increasing.
+            previous_position = positions[row_index - 1] if row_index else None
+            if np.any(np.diff(chunk) <= 0) or (previous_position is not None and chunk[0] <= previous_position):
+                raise ValueError(f'The positions in {alignment_filename} are not strictly increasing '
+                                 f'around line {row_index + 2}')
+
+            next_row_index = row_index + len(chunk)
+            positions[row_index:next_row_index] = chunk
+            letters[row_index:next_row_index] = np.frombuffer(bytes(letter_chunk), dtype='uint8') \
+                .reshape(-1, num_species)
+            row_index = next_row_index
+            position_chunk = []
+            letter_chunk = bytearray()
+
+            print(f'{row_index}/{num_positions} = {row_index / num_positions:.2%} in {time.time() - stamp:.4f}s',
+                  end='\r')
+
+        for line in alignment_file:
+            if not line.strip():
+                continue
+            position, row_letters = parse_alignment_line(line)
+            if len(row_letters) != num_species:
+                raise ValueError(f'Expected {num_species} letters at position {position} but got {len(row_letters)}')
+            position_chunk.append(position)
+            letter_chunk += row_letters
+
+            if len(position_chunk) >= chunk_size:
+                flush()
+        flush()
+
+    if row_index != num_positions:
+        raise ValueError(f'Expected {num_positions} positions but only {row_index} were parsed')
+
+    positions.flush()
+    letters.flush()
+
+    with open(os.path.join(store_dirname, species_filename), 'w') as file:
+        file.write('\n'.join(species) + '\n')
+
+    print(f'\n=> Finished converting {alignment_filename} in {time.time() - stamp:.4f}s')
+    return store_dirname
+
+
+def build_count_track(store_dirname, chunk_size=100000):
+    """
+    Counts the A G C T X letters of the species other than count_excluded_species at every position of the store
+    into counts.npy, where X and N are both counted as X, see window_encoding.count_letters.
+    The counts are written to a temporary file that is renamed once complete.
+
+    :return: the name of the count track file
+    """
+    store = MafStore(store_dirname)
+    species_indices = [index for index, species in enumerate(store.species) if species != count_excluded_species]
+    counts_path = os.path.join(store_dirname, counts_filename)
+    temporary_path = counts_path + '.tmp.npy'
+    counts = np.lib.format.open_memmap(temporary_path, mode='w+', dtype='uint8', shape=(len(store), 5))
+
+    stamp = time.time()
+    print(f'=> Counting the letters of {len(species_indices)} species at {len(store)} positions of {store_dirname}')
+    for chunk_start in range(0, len(store), chunk_size):
+        chunk_stop = min(chunk_start + chunk_size, len(store))
+        letters = np.asarray(store.letters[chunk_start:chunk_stop])[:, species_indices]
+        counts[chunk_start:chunk_stop] = counting_table[letters].sum(axis=1, dtype='uint8')
+        print(f'{chunk_stop}/{len(store)} = {chunk_stop / len(store):.2%} in {time.time() - stamp:.4f}s', end='\r')
+
+    counts.flush()
+    del counts
+    store.close()
+    os.replace(temporary_path, counts_path)
+    print(f'\n=> Finished counting in {time.time() - stamp:.4f}s')
+    return counts_path
+
+
+def has_maf_store(alignment_filename):
+    return os.path.isfile(os.path.join(get_store_dirname(alignment_filename), species_filename))
+
+
+class MafStore:
+    """
+    Read-only, memory-mapped view of a store created by build_maf_store.
+    """
+    def __init__(self, store_dirname):
+        self.store_dirname = store_dirname
+        with open(os.path.join(store_dirname, species_filename), 'r') as file:
+            self.species = file.read().split()
+        self.num_species = len(self.species)
+        # Lookups into the memory maps need no cache.
+        self.cache = None
+        self.positions = np.load(os.path.join(store_dirname, positions_filename), mmap_mode='r')
+        self.letters = np.load(os.path.join(store_dirname, letters_filename), mmap_mode='r')
+        counts_path = os.path.join(store_dirname, counts_filename)
+        self.counts = np.load(counts_path, mmap_mode='r') if os.path.isfile(counts_path) else None
+
+    def has_count_track(self):
+        return self.counts is not None
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # Dropping the references releases the memory maps.
+        self.positions = self.letters = self.counts = None
+
+    def get_rows(self, start, stop):
+        """
+        :return: (positions, letters) for all the positions present in the alignment within [start, stop)
+        """
+        low, high = np.searchsorted(self.positions, (start, stop))
+        return self.positions[low:high], self.letters[low:high]
+
+    def get_window(self, start, stop, fill='X'):
+        """
+        :param start: the first coordinate of the window
+        :param stop: the coordinate right after the last coordinate of the window
+        :param fill: the letter to use for the coordinates that are absent from the alignment
+        :return: (window, found) where window is a (stop - start) x num_species uint8 matrix of ASCII letters,
+        and found is a boolean vector marking the coordinates that are present in the alignment.
+        """
+        positions, letters = self.get_rows(start, stop)
+        offsets = positions - start
+
+        window = np.full((stop - start, self.num_species), ord(fill), dtype='uint8')
+        window[offsets] = letters
+
+        found = np.zeros(stop - start, dtype=bool)
+        found[offsets] = True
+        return window, found
+
+    def get_count_windows(self, window_starts, num_basepairs):
+        """
+        Looks up the count track built by build_count_track for a batch of windows.
+
+        :param window_starts: the first coordinate of each window
+        :return: (counts, found) where counts is a len(window_starts) x num_basepairs x 5 uint8 array
+        holding all zeros for the coordinates absent from the alignment, and found marks the present coordinates
+        """
+        if self.counts is None:
+            raise ValueError(f'{self.store_dirname} has no count track, run maf_store.py --count-track')
+        coordinates = np.asarray(window_starts, dtype='int64')[:, None] + np.arange(num_basepairs)
+        row_indices = np.searchsorted(self.positions, coordinates)
+        clipped_indices = np.minimum(row_indices, max(len(self.positions) - 1, 0))
+        found = (row_indices < len(self.positions)) & (self.positions[clipped_indices] == coordinates) \
+            if len(self.positions) else np.zeros(coordinates.shape, dtype=bool)
+
+        counts = np.zeros(coordinates.shape + (5,), dtype='uint8')
+        counts[found] = self.counts[row_indices[found]]
+        return counts, found
+
+    def get_count_window(self, start, stop):
+        """
+        :return: (counts, found) for the window [start, stop), see get_count_windows
+        """
+        counts, found = self.get_count_windows([start], stop - start)
+        return counts[0], found[0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    # an example filename would be chr2_maf_sequence.csv
+    parser.add_argument('alignment_filenames', nargs='+')
+    parser.add_argument('--count-track', action='store_true',
+                        help='also count the letters of the non-human species at every position, '
+                             'read by step3_extend_counting.py and counting_measure/generate_counting_measure.py')
+    args = parser.parse_args()
+    for filename in args.alignment_filenames:
+        build_maf_store(filename)
+        if args.count_track:
+            build_count_track(get_store_dirname(filename))
@@ -0,0 +1,124 @@
+import time
+
+import numpy as np
+
+from hdf5_writer import get_block_size
+from window_encoding import revcomp_count_permutation
+
+# Maps the A G C T X channels of a one-hot or count encoding to those of the complement strand
+complement_channel_permutation = revcomp_count_permutation
+
+
+def mark_derived_revcomp(dataset, channel_permutation=None, flip=True):
+    """
+    Tags a dataset that only stores the forward strand samples,
+    so that ReverseComplementView serves the reverse complement samples after them.
+
+    :param channel_permutation: the permutation of the last axis giving the complement, None to keep the channels,
+    e.g. complement_channel_permutation for the one-hot and count encodings
+    :param flip: whether the base pair axis is reversed, False for the datasets such as the labels
+    whose reverse complement samples are the same as the forward ones
+    """
+    dataset.attrs['revcomp'] = 'derived'
+    dataset.attrs['revcomp_flip'] = flip
+    if channel_permutation is not None:
+        dataset.attrs['revcomp_channel_permutation'] = channel_permutation
+
+
+def has_derived_revcomp(dataset):
+    return dataset.attrs.get('revcomp') == 'derived'
+
+
+def reverse_complement(samples, channel_permutation=None, flip=True, axis=1):
+    """
+    :param samples: a batch of samples, the sample axis being the first one
+    :param axis: the base pair axis, by default the first axis after the sample axis
+    :return: the reverse complement samples
+    """
+    if flip:
+        samples = np.flip(samples, axis)
+    if channel_permutation is not None:
+        samples = samples[..., channel_permutation]
+    return np.ascontiguousarray(samples)
+
+
+def write_reverse_complement(source, target, channel_permutation, axis=1, only_one_hot=False, block_size=None):
+    """
+    Writes the reverse complement of every sample of the source dataset to the same row of the target dataset,
+    transforming a block of samples at a time.
+
+    :param channel_permutation: the permutation of the last axis giving the complement,
+    e.g. complement_channel_permutation for A G C T X or complement_channel_permutation[:4] for A G C T
+    :param axis: the base pair axis of the samples, the sample axis being 0
+    :param only_one_hot: whether to write the encodings with other than exactly one channel set as all zeros
+    :param block_size: number of samples per block, defaults to hdf5_writer.get_block_size(target)
+    """
+    if block_size is None:
+        block_size = get_block_size(target)
+
+    stamp = time.time()
+    num_samples = source.shape[0]
+    for block_start in range(0, num_samples, block_size):
+        block_stop = min(block_start + block_size, num_samples)
+        block = reverse_complement(source[block_start:block_stop], channel_permutation, axis=axis)
+        if only_one_hot:
+            block *= (block.sum(axis=-1, keepdims=True) == 1)
+        target[block_start:block_stop] = block
+
+        print('{}/{} {:5f} done in {:2f}s'
+              .format(block_stop, num_samples, block_stop / num_samples, time.time() - stamp))
+
+
+def to_indices(item, length):
+    """
+    :param item: an int, a slice or a sequence of indices
+    :return: (indices, is_single) where indices is an int64 array of indices in [0, length)
+    """
+    if isinstance(item, slice):
+        return np.arange(length)[item], False
+    is_single = np.ndim(item) == 0
+    indices = np.atleast_1d(np.asarray(item, dtype='int64'))
+    indices = np.where(indices < 0, indices + length, indices)
+    if indices.size and (indices.min() < 0 or indices.max() >= length):
+        raise IndexError(f'Indices out of the range [0, {length})')
+    return indices, is_single
+
+
+def read_rows(dataset, rows):
+    """
+    :return: dataset[rows] for rows in any order and possibly repeated,
+    which h5py only supports for increasing rows without duplicates
+    """
+    unique_rows, inverse = np.unique(rows, return_inverse=True)
+    if not len(unique_rows):
+        return np.zeros((0,) + dataset.shape[1:], dtype=dataset.dtype)
+    return dataset[unique_rows][inverse]
+
+
+class ReverseComplementView:
+    """
+    Read-only view of a dataset tagged by mark_derived_revcomp, holding the N forward strand samples.
+    It serves 2N samples where sample i + N is the reverse complement of sample i,
+    the same samples as the datasets storing the reverse complement in their second half.
+
+    Indexing with an int returns a single sample, indexing with a slice or a sequence of indices returns a batch.
+    """
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.num_samples = dataset.shape[0]
+        self.flip = bool(dataset.attrs.get('revcomp_flip', True))
+        channel_permutation = dataset.attrs.get('revcomp_channel_permutation')
+        self.channel_permutation = None if channel_permutation is None else np.asarray(channel_permutation)
+        self.shape = (2 * self.num_samples,) + dataset.shape[1:]
+        self.dtype = dataset.dtype
+
+    def __len__(self):
+        return 2 * self.num_samples
+
+    def __getitem__(self, item):
+        indices, is_single = to_indices(item, len(self))
+        samples = read_rows(self.dataset, indices % self.num_samples)
+        is_revcomp = indices >= self.num_samples
+        if is_revcomp.any():
+            samples[is_revcomp] = reverse_complement(samples[is_revcomp], self.channel_permutation, self.flip)
+        return samples[0] if is_single else samples
@@ -1,32 +1,181 @@
+import argparse
+import time
+
+import numpy as np
+
+from coord_partition import PartitionBuilder, get_partition_filename
+
+# Number of bytes of coord read at once
+default_buffer_bytes = 16 << 20
+
+
+def get_split_filename(name):
+    return f'{name}_coord'
+
+
+class SplitRule:
+    """
+    Selects the lines of the coordinate file written to a split, every line going to the first split
+    whose rule it matches and to no split if it matches none.
+
+    :param rows: (first_row, stop_row) to only select the rows in [first_row, stop_row), stop_row being None for
+    the end of the file, None for every row
+    :param chroms: the chromosomes to select, None for every chromosome
+    :param fraction: the probability of selecting each line matching the other conditions, None to select all of
+    them. The draws come from a generator seeded with seed created for each pass over the file, see create_generator,
+    one draw per line of the file, so the same rules on the same file always select the same lines.
+    """
+    def __init__(self, name, rows=None, chroms=None, fraction=None, seed=0):
+        self.name = name
+        self.rows = rows
+        self.chroms = None if chroms is None else list(chroms)
+        self.fraction = fraction
+        self.seed = seed
+
+    def create_generator(self):
+        # A new generator for every pass over the file, so that every pass draws the same numbers
+        return np.random.default_rng(self.seed)
+
+    def select(self, first_row, chroms, generator):
+        """
+        :param first_row: the row of the first line of the block
+        :param chroms: the array of the chromosomes of the lines of the block
+        :param generator: the generator of the rule for the current pass, see create_generator,
+        only drawn from if the rule has a fraction
+        :return: the boolean mask of the lines of the block matching the rule
+        """
+        is_selected = np.ones(len(chroms), dtype=bool)
+        if self.rows is not None:
+            rows = first_row + np.arange(len(chroms))
+            first_rule_row, stop_rule_row = self.rows
+            is_selected &= rows >= first_rule_row
+            if stop_rule_row is not None:
+                is_selected &= rows < stop_rule_row
+        if self.chroms is not None:
+            is_selected &= np.isin(chroms, self.chroms)
+        if self.fraction is not None:
+            is_selected &= generator.random(len(chroms)) < self.fraction
+        return is_selected
+
+    def __str__(self):
+        conditions = []
+        if self.rows is not None:
+            conditions.append('rows [{}, {})'.format(self.rows[0], 'end' if self.rows[1] is None else self.rows[1]))
+        if self.chroms is not None:
+            conditions.append('chroms {}'.format(','.join(self.chroms)))
+        if self.fraction is not None:
+            conditions.append(f'fraction {self.fraction} seed {self.seed}')
+        return '{}: {}'.format(self.name, ' '.join(conditions) or 'every line')
+
+
+def get_default_rules():
+    """
+    :return: the first 2,200,000 lines for training, the next 4,000 for validation
+    and the lines of chr8 and chr9 among the remaining ones for testing
+    """
+    return [SplitRule('train', rows=(0, 2200000)),
+            SplitRule('valid', rows=(2200000, 2204000)),
+            SplitRule('test', rows=(2204000, None), chroms=['chr8', 'chr9'])]
+
+
+def split_coordinates(coord_filename, rules, buffer_bytes=default_buffer_bytes):
+    """
+    Writes the {name}_coord file of every split in a single pass over the coordinate file, along with its
+    partition index {name}_coord.npz whose rows map every line of the split to its row in the coordinate file,
+    see coord_partition.load_coord_partition. The blank lines go to no split, but still count as rows.
+
+    :param rules: the SplitRule of every split, see SplitRule for how a line is assigned to a split
+    :return: a dict from the name of every split to its number of lines
+    """
+    if len({rule.name for rule in rules}) != len(rules):
+        raise ValueError('Every split needs a distinct name')
+    builders = {rule.name: PartitionBuilder() for rule in rules}
+    line_counts = {rule.name: 0 for rule in rules}
+    generators = {rule.name: rule.create_generator() for rule in rules}
+    split_files = {}
+    stamp = time.time()
+    first_row = 0
+    try:
+        for rule in rules:
+            split_files[rule.name] = open(get_split_filename(rule.name), 'w')
+
+        with open(coord_filename, 'r') as coord_file:
+            while True:
+                lines = coord_file.readlines(buffer_bytes)
+                if not lines:
+                    break
+                tokens = [line.split() for line in lines]
+                chroms = np.array([line_tokens[0] if line_tokens else '' for line_tokens in tokens])
+
+                # The partition index has no line for them, so the blank lines are left out of the text files too
+                is_unassigned = chroms != ''
+                for rule in rules:
+                    is_selected = rule.select(first_row, chroms, generators[rule.name]) & is_unassigned
+                    is_unassigned &= ~is_selected
+                    line_indices = np.flatnonzero(is_selected)
+                    split_files[rule.name].writelines([lines[line_index] for line_index in line_indices])
+                    builder = builders[rule.name]
+                    for line_index in line_indices:
+                        line_tokens = tokens[line_index]
+                        builder.add(line_tokens[0], int(line_tokens[1]), int(line_tokens[2]), first_row + line_index)
+                    line_counts[rule.name] += len(line_indices)
+
+                first_row += len(lines)
+                print(f'processed {first_row} lines in {time.time() - stamp:.4f}s', end='\r')
+    finally:
+        for split_file in split_files.values():
+            split_file.close()
+    print()
+
+    # Saved once the text files are closed so that the indices record their final size and modification time
+    for rule in rules:
+        partition_filename = get_partition_filename(get_split_filename(rule.name))
+        builders[rule.name].build().save(partition_filename, get_split_filename(rule.name))
+        print(f'{line_counts[rule.name]} lines for {get_split_filename(rule.name)} ({rule}), '
+              f'index saved to {partition_filename}')
+    print(f'=> {first_row - sum(line_counts.values())} of the {first_row} lines are in no split')
+    return line_counts
+
+
+def parse_split_rule(arguments):
+    """
+    :param arguments: the name of the split followed by its conditions, e.g.
+    ['test', 'rows=2204000:', 'chroms=chr8,chr9'] or ['train', 'fraction=0.9', 'seed=1']
+    """
+    name, conditions = arguments[0], arguments[1:]
+    kwargs = {}
+    for condition in conditions:
+        key, _, value = condition.partition('=')
+        if key == 'rows':
+            first_row, _, stop_row = value.partition(':')
+            kwargs['rows'] = (int(first_row or 0), int(stop_row) if stop_row else None)
+        elif key == 'chroms':
+            kwargs['chroms'] = value.split(',')
+        elif key == 'fraction':
+            kwargs['fraction'] = float(value)
+        elif key == 'seed':
+            kwargs['seed'] = int(value)
+        else:
+            raise ValueError(f'Unknown condition {condition} of split {name}, '
+                             f'expected rows=FIRST:STOP, chroms=CHROM,... fraction=F or seed=S')
+    return SplitRule(name, **kwargs)
+
+
 def run():
-    line_number = 0
-    with open('coord', 'r') as f, open('train_coord', 'w') as train_file, open('valid_coord', 'w') as valid_file, \
-            open('test_coord', 'w') as test_file:
-        for _ in range(2200000):
-            line = f.readline()
-            train_file.write(line)
-            line_number += 1
-        print("{} lines for train_coord".format(line_number))
-
-        line_number = 0
-        for _ in range(2200001, 2204000 + 1):
-            line = f.readline()
-            valid_file.write(line)
-            line_number += 1
-        print("{} lines for valid_coord".format(line_number))
-
-        line_number = 0
-        while True:
-            line = f.readline()
-            if not line:
-                break
-            chrom = line.split()[0]
-            if chrom != 'chr8' and chrom != 'chr9':
-                continue
-            test_file.write(line)
-            line_number += 1
-        print("{} lines for test_coord".format(line_number))
+    split_coordinates('coord', get_default_rules())
 
 
 if __name__ == '__main__':
-    run()
+    parser = argparse.ArgumentParser(description='Splits the coordinate file into the {name}_coord files')
+    parser.add_argument('--coord-filename', default='coord')
+    parser.add_argument('--split', dest='splits', nargs='+', action='append', default=None,
+                        metavar=('NAME', 'CONDITION'),
+                        help='a split and its conditions among rows=FIRST:STOP, chroms=CHROM,..., fraction=F and '
+                             'seed=S, every line going to the first split whose conditions it matches, e.g. '
+                             '--split test chroms=chr8,chr9 --split valid fraction=0.01 seed=1 --split train. '
+                             'Defaults to train rows=0:2200000, valid rows=2200000:2204000 and '
+                             'test rows=2204000: chroms=chr8,chr9')
+    parser.add_argument('--buffer-bytes', type=int, default=default_buffer_bytes)
+    args = parser.parse_args()
+    rules = get_default_rules() if args.splits is None else [parse_split_rule(split) for split in args.splits]
+    split_coordinates(args.coord_filename, rules, args.buffer_bytes)
@@ -1,53 +1,38 @@
 import os
-import twobitreader
+
+from genome_store import GenomeStore
+from util.coordinate import iterate_coordinate_blocks
 
 dirname = 'hg19_fasta_aggregate'
+# Number of coordinate lines whose windows are extracted at once
+block_size = 10000
 
 
 def get_destination_filename(chr, data_purpose):
     return os.path.join(dirname, '{}_{}'.format(chr, data_purpose))
 
 
-def coord_to_letter(coord_filename, data_purpose, genome_dict):
+def coord_to_letter(coord_filename, data_purpose, genome_store):
+    """
+    :param genome_store: a genome_store.GenomeStore, the windows crossing the ends of a chromosome
+    are padded with N for the coordinates out of the chromosome
+    """
     print('Handling coordinate file: {}'.format(coord_filename))
     opened_files = {}
     flanking_number = 50
-    with open(coord_filename, 'r') as coordinate_file:
-        for line in coordinate_file:
-            tokens = line.split()
-            chr, start, stop = tokens[0], int(tokens[1]), int(tokens[2])
+    for _, chroms, starts, stops in iterate_coordinate_blocks(coord_filename, block_size):
+        windows, num_padded = genome_store.get_window_list(chroms, starts - flanking_number, stops + flanking_number)
+        for chr, start, stop, window, window_num_padded in zip(chroms, starts, stops, windows, num_padded):
             if chr not in opened_files:
                 print('opening {}'.format(get_destination_filename(chr, data_purpose)))
                 opened_files[chr] = open(get_destination_filename(chr, data_purpose), 'w')
 
-            target_length = 2 * flanking_number + stop - start
-            dna_sequence = genome_dict[chr].get_slice(start - flanking_number, stop + flanking_number)
-            if len(dna_sequence) != target_length:
-                print('The DNA sequence is not 200 bp in length!')
+            dna_sequence = window.tobytes().decode('ascii')
+            if window_num_padded:
+                print('The DNA sequence is not {} bp in length!'.format(len(window)))
                 print('chr: {} start: {} stop: {}'.format(chr, start, stop))
-                
-                middle = genome_dict[chr].get_slice(start, stop)
-                assert (len(middle) == 200)
-                
-                left = genome_dict[chr].get_slice(start - flanking_number, start)
-                right = genome_dict[chr].get_slice(stop + 1, stop + 401)
-                
-                if len(left) != flanking_number:
-                    print('The left flanking sequence has length {}'.format(len(left)))
-                    padding = 'N' * (flanking_number - len(left))
-                    left = padding + left
-                
-                if len(right) != flanking_number:
-                    print('The right flanking sequence has length {}'.format(len(right)))
-                    padding = 'N' * (flanking_number - len(right))
-                    right = right + padding
-                
-                padded_sequence = left + middle + right
-                assert (len(padded_sequence) == target_length)
-                print('Padded the sequence to {}'.format(padded_sequence))
-                opened_files[chr].write('>{}\n{}'.format(start, padded_sequence) + '\n')
-                continue
-            
+                print('Padded the sequence with {} N to {}'.format(window_num_padded, dna_sequence))
+
             opened_files[chr].write('>{}\n{}'.format(start, dna_sequence) + '\n')
     
     for chr_index, file in opened_files.items():
@@ -56,11 +41,11 @@ def coord_to_letter(coord_filename, data_purpose, genome_dict):
 
 
 def run():
-    genome_dict = twobitreader.TwoBitFile('hg19.2bit')
+    genome_store = GenomeStore('hg19.2bit')
     os.makedirs(dirname, exist_ok=False)
-    coord_to_letter('train_coord', 'train', genome_dict=genome_dict)
-    coord_to_letter('valid_coord', 'valid', genome_dict)
-    coord_to_letter('test_coord', 'test', genome_dict)
+    coord_to_letter('train_coord', 'train', genome_store=genome_store)
+    coord_to_letter('valid_coord', 'valid', genome_store)
+    coord_to_letter('test_coord', 'test', genome_store)
 
 
 if __name__ == '__main__':
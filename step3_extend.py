@@ -1,127 +1,84 @@
 import argparse
 import h5py
 import numpy as np
-import os
 import time
 
-from binary_search import search, scan_through_line_for_number
-from line_cache import LineCache
+from hdf5_writer import BlockWriter, add_compression_arguments, create_feature_dataset, get_compression_options
+from maf_reader import add_cache_arguments, format_cache_stats, get_cache_options, open_alignment
+from util.coordinate import add_genome_arguments, open_coordinate_lines
+from window_encoding import four_channel_table, to_letter_codes
 
 
-mapping = {
-    'a': np.array([1, 0, 0, 0]),
-    'A': np.array([1, 0, 0, 0]),
-
-    'g': np.array([0, 1, 0, 0]),
-    'G': np.array([0, 1, 0, 0]),
-
-    'c': np.array([0, 0, 1, 0]),
-    'C': np.array([0, 0, 1, 0]),
-
-    't': np.array([0, 0, 0, 1]),
-    'T': np.array([0, 0, 0, 1]),
-
-    'X': np.array([0, 0, 0, 0]),
-
-    'N': np.array([0, 0, 0, 0]),
-    'n': np.array([0, 0, 0, 0])
-}
-
-
-def extend_dataset(chr, purpose):
+def extend_dataset(chr, purpose, cache_options=None, sorted_sweep=False, line_range=None, hdf5_filename=None,
+                   compression_options=None, twobit_filename=None):
+    """
+    :param twobit_filename: e.g. hg19.2bit to read the human letters from the genome instead of data/{chr}_{purpose},
+    see util.coordinate.open_coordinate_lines
+    """
     checkpoint_time_str = time.strftime('%a %b %d %Y %H:%M:%S UTC%z', time.localtime(time.time()))
     print('Current time: {}'.format(checkpoint_time_str))
-    
-    cache = LineCache()
-    
-    array_list = []
 
-    coordinate_filename = os.path.join('data', '{}_{}'.format(chr, purpose))
+    # Only the lines in line_range are extended, into the rows counted from its first line
+    coordinate_filename, line_count, coordinate_lines = open_coordinate_lines(chr, purpose, sorted_sweep, line_range,
+                                                                              twobit_filename)
     alignment_filename = '{}_maf_sequence.csv'.format(chr)
-    hdf5_filename = '{}_{}.align.hdf5'.format(chr, purpose)
+    if hdf5_filename is None:
+        hdf5_filename = '{}_{}.align.hdf5'.format(chr, purpose)
 
     print('=> coordinate_filename: {}'.format(coordinate_filename))
     print('=> alignment_filename: {}'.format(alignment_filename))
     print('=> target hdf5_filename: {}'.format(hdf5_filename))
-    file_byte_size = os.stat(alignment_filename).st_size
-    with open(coordinate_filename, 'r') as file, open(alignment_filename, 'r') as alignment_file:
-        header = alignment_file.readline().strip().split(',')
-        human_index = header.index('hg19')
+
+    with open_alignment(alignment_filename, cache_options, sorted_sweep) as alignment, \
+            h5py.File(hdf5_filename, 'w') as hdf5_file:
+        feature_group = hdf5_file.create_group('feature')
+        feature_data = create_feature_dataset(feature_group, 'data', (line_count, 100, 1000, 4),
+                                              **(compression_options or {}))
+
+        human_index = alignment.species.index('hg19')
+        non_human_indices = [index for index in range(alignment.num_species) if index != human_index]
 
         processed_line_count = 0
         start_time = time.time()
         flanking_number = 400
 
-        for line in file:
-            processed_line_count += 1
-            (start_coordinate, sequence) = line.strip().split(',')
-            start_coordinate = int(start_coordinate)
-
-            alignment_matrix = np.zeros((1000, 100, 4), dtype='uint8')
-
-            for letter_index, hg_letter in enumerate(sequence):
-                alignment_matrix[letter_index, 0, :] = mapping[hg_letter]
-
-            start_line_hint = None
-            for letter_index, coordinate in enumerate(range(start_coordinate - flanking_number, start_coordinate + 200 + flanking_number)):
-                if coordinate in cache:
-                    # c1+=1
-                    cached_result = cache[coordinate]
-                    alignment_matrix[letter_index][1:, :] = cached_result[0]
-                    start_line_hint = cached_result[1]
-                    continue
-                    
-                elif not start_line_hint:
-                    
-                    result = search(alignment_file, coordinate, file_byte_size)
-                else:
-                    result = scan_through_line_for_number(alignment_file=alignment_file, start_line_hint=start_line_hint, number=coordinate)
-
-                if result:
-                    start_line_hint = result[1]
-                    tokens = result[0].strip().split(',')
-                    # Important: pop the human_index first before removing the start index,
-                    # so that the human_index will be the correct index.
-                    del tokens[human_index]
-                    del tokens[0]
-                    
-                    # aligned_letters is 100x4
-                    aligned_letters = alignment_matrix[letter_index]
-                    for species_index, letter in enumerate(tokens):
-                        # aligned_letters is 100x4
-                        # +1 because we put hg19 in the first row
-                        aligned_letters[species_index + 1, :] = mapping[letter]
-
-                    cache[coordinate] = (aligned_letters[1:, :], start_line_hint)
-
-            array_list.append(alignment_matrix.transpose((1, 0, 2)))
-
-            if processed_line_count % 1000 == 0:
-                elapsed_time = time.time() - start_time
-                time_per_line = elapsed_time / processed_line_count
-                print('Processed {} lines in {:5f}s, averaging: {:5f}s per line'
-                      .format(processed_line_count, elapsed_time, time_per_line))
-
-    stamp = time.time()
-    print('=> Serializing...')
-    with h5py.File(hdf5_filename, 'w') as file:
-        feature_group = file.create_group('feature')
-        
-        array_list_length = len(array_list)
-
-        feature_data = feature_group.create_dataset('data', (array_list_length, 100, 1000, 4), dtype='uint8')
-        for index, matrix in enumerate(array_list):
-            feature_data[index] = matrix
-            
-            if index % 1000 == 0:
-                print("{}/{} in {:5f}s".format(index, array_list_length, time.time() - stamp))
-
-    print('=> Finished serializeing in {:.5f}s'.format(time.time() - stamp))
+        # The samples are written to the rows of their lines as they are extended
+        with BlockWriter(feature_data) as writer:
+            for line_index, start_coordinate, sequence in coordinate_lines:
+                processed_line_count += 1
+
+                # X is encoded as all zeros so the coordinates absent from the alignment are all zeros
+                window, _ = alignment.get_window(start_coordinate - flanking_number,
+                                                 start_coordinate + 200 + flanking_number, fill='X')
+
+                # 1000 x 100 letters with hg19 in the first row
+                letters = np.empty((len(sequence), 1 + len(non_human_indices)), dtype='uint8')
+                letters[:, 0] = to_letter_codes(sequence)
+                letters[:, 1:] = window[:, non_human_indices]
+
+                alignment_matrix = four_channel_table[letters]
+                writer.write(line_index, alignment_matrix.transpose((1, 0, 2)))
+
+                if processed_line_count % 1000 == 0:
+                    elapsed_time = time.time() - start_time
+                    time_per_line = elapsed_time / processed_line_count
+                    print('Processed {} lines in {:5f}s, averaging: {:5f}s per line, {} samples written{}'
+                          .format(processed_line_count, elapsed_time, time_per_line, writer.num_written,
+                                  format_cache_stats(alignment)))
+
+    print('=> Finished {} lines in {:.5f}s'.format(processed_line_count, time.time() - start_time))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('chr')
     parser.add_argument('purpose')
+    parser.add_argument('--sorted-sweep', action='store_true',
+                        help='process the coordinates in sorted order, streaming the alignment file only once')
+    add_cache_arguments(parser)
+    add_genome_arguments(parser)
+    add_compression_arguments(parser)
     args = parser.parse_args()
-    extend_dataset(args.chr, args.purpose)
+    extend_dataset(args.chr, args.purpose, cache_options=get_cache_options(args),
+                   sorted_sweep=args.sorted_sweep, compression_options=get_compression_options(args),
+                   twobit_filename=args.twobit)
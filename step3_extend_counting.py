@@ -2,157 +2,116 @@ import argparse
 import os
 import time
 
-import biotool.file_binary_search as file_binary_search
 import h5py
 import numpy as np
 
-from binary_search import scan_through_line_for_number
-from line_cache import LineCache
-from nucleotide_mapping import mapping, complement_mapping, map_counts_to_vec, map_counts_to_revcomp_vec
-from util.file import get_line_count
-
-
-def extend_dataset(chrom, purpose, maf_dir):
+from hdf5_writer import BlockWriter, add_compression_arguments, create_feature_dataset, get_compression_options
+from maf_reader import add_cache_arguments, format_cache_stats, get_cache_options, open_alignment
+from maf_store import MafStore
+from reverse_complement import complement_channel_permutation, mark_derived_revcomp
+from util.coordinate import add_genome_arguments, open_coordinate_lines
+from window_encoding import complement_onehot_table, count_letters_with_revcomp, encode_window, onehot_table, \
+    revcomp_count_permutation, to_letter_codes
+
+
+def extend_dataset(chrom, purpose, maf_dir, cache_options=None, sorted_sweep=False, line_range=None,
+                   hdf5_filename=None, compression_options=None, derive_revcomp=False, twobit_filename=None):
+    """
+    :param twobit_filename: e.g. hg19.2bit to read the human letters from the genome instead of
+    data/{chrom}_{purpose}, see util.coordinate.open_coordinate_lines
+    :param derive_revcomp: whether to only store the forward strand, see reverse_complement.ReverseComplementView
+    """
     checkpoint_time_str = time.strftime('%a %b %d %Y %H:%M:%S UTC%z', time.localtime(time.time()))
     print('Current time: {}'.format(checkpoint_time_str))
 
-    cache = LineCache()
-
-    matrix_list = []
-    revcomp_matrix_list = []
-
-    coordinate_filename = os.path.join('data', '{}_{}'.format(chrom, purpose))
+    # Only the lines in line_range are extended, into the rows counted from its first line
+    coordinate_filename, line_count, coordinate_lines = open_coordinate_lines(chrom, purpose, sorted_sweep,
+                                                                              line_range, twobit_filename)
     alignment_filename = os.path.join(maf_dir, f'{chrom}_maf_sequence.csv')
-    hdf5_filename = '{}_{}.counting.hdf5'.format(chrom, purpose)
+    if hdf5_filename is None:
+        hdf5_filename = '{}_{}.counting.hdf5'.format(chrom, purpose)
     num_rows = 2
     num_non_humans = 99
 
     print('=> coordinate_filename: {}'.format(coordinate_filename))
     print('=> alignment_filename: {}'.format(alignment_filename))
     print('=> target hdf5_filename: {}'.format(hdf5_filename))
-    file_byte_size = os.stat(alignment_filename).st_size
-
-    line_count = get_line_count(coordinate_filename)
 
     flanking_number = 400
     seq_len = 200 + 2 * flanking_number
-    last_bp_index = seq_len - 1
     feature_dim = 5
 
-    serializing_index = 0
-
-    with open(coordinate_filename, 'r') as coord_file, open(alignment_filename, 'r') as alignment_file, \
+    with open_alignment(alignment_filename, cache_options, sorted_sweep) as alignment, \
             h5py.File(hdf5_filename, 'w') as hdf5_file:
 
         feature_group = hdf5_file.create_group('feature')
-        feature_data = feature_group.create_dataset('data', (line_count * 2, seq_len, num_rows, feature_dim),
-                                                    dtype='uint8')
-
-        header = alignment_file.readline().strip().split(',')
-        human_index = header.index('hg19')
+        num_strands = 1 if derive_revcomp else 2
+        feature_data = create_feature_dataset(feature_group, 'data',
+                                              (line_count * num_strands, seq_len, num_rows, feature_dim),
+                                              **(compression_options or {}))
+        if derive_revcomp:
+            # The complement permutes both the one-hot human channels and the count channels
+            mark_derived_revcomp(feature_data, complement_channel_permutation)
+
+        human_index = alignment.species.index('hg19')
+        non_human_indices = [index for index in range(alignment.num_species) if index != human_index]
+        # The count track built by maf_store.py --count-track already holds the counts of the non-human species
+        use_count_track = isinstance(alignment, MafStore) and alignment.has_count_track()
+        if use_count_track:
+            print(f'=> Using the count track of {alignment.store_dirname}')
 
         processed_line_count = 0
         start_time = time.time()
 
-        for line in coord_file:
-            processed_line_count += 1
-            (start_coordinate, sequence) = line.strip().split(',')
-            start_coordinate = int(start_coordinate)
-
-            # 1000 x 2 x 5
-            seq_matrix = np.zeros((seq_len, num_rows, feature_dim), dtype='uint8')
-            revcomp_seq_matrix = np.zeros((seq_len, num_rows, feature_dim), dtype='uint8')
-
-            start_line_hint = None
-            for bp_index, (hg_letter, coordinate) in enumerate(
-                    zip(sequence, range(start_coordinate - flanking_number, start_coordinate + 200 + flanking_number))):
-
-                if coordinate in cache:
-                    # the entry for revcomp_alignment_matrix in the cache corresponds to the
-                    # coordinate last_seq_index - bp_index on the reverse complement strand
-                    (seq_matrix[bp_index, :, :],
-                     revcomp_seq_matrix[last_bp_index - bp_index, :, :],
-                     start_line_hint) = cache[coordinate]
-                    continue
-
-                # insert the human letter first
-                seq_matrix[bp_index, 0, :] = mapping[hg_letter]
-                revcomp_seq_matrix[last_bp_index - bp_index, 0, :] = complement_mapping[hg_letter]
-
-                if not start_line_hint:
-                    # TODO: test they are equal
-                    # result = search(alignment_file, coordinate, file_byte_size)
-                    result = file_binary_search.search(alignment_filename, coordinate, num_header_lines=1)
+        # In the sorted sweep mode the lines are visited in genomic order
+        # and each sample is still written to the row of its line
+        with BlockWriter(feature_data) as writer:
+            for line_index, start_coordinate, sequence in coordinate_lines:
+                processed_line_count += 1
+
+                window_start = start_coordinate - flanking_number
+                window_stop = start_coordinate + 200 + flanking_number
+
+                # 1000 x 2 x 5
+                # the first row is the human letter and the second row counts the letters of the non-human species
+                seq_matrix = np.empty((seq_len, num_rows, feature_dim), dtype='uint8')
+                revcomp_seq_matrix = np.empty((seq_len, num_rows, feature_dim), dtype='uint8')
+
+                seq_matrix[:, 0, :], revcomp_seq_matrix[:, 0, :] = encode_window(to_letter_codes(sequence),
+                                                                                 onehot_table, complement_onehot_table)
+                # Coordinates absent from the alignment are counted as X for all the non-human species
+                if use_count_track:
+                    counts, found = alignment.get_count_window(window_start, window_stop)
+                    counts[~found, 4] = len(non_human_indices)
+                    seq_matrix[:, 1, :], revcomp_seq_matrix[:, 1, :] = counts, counts[::-1, revcomp_count_permutation]
                 else:
-                    result = scan_through_line_for_number(alignment_file=alignment_file,
-                                                          start_line_hint=start_line_hint, number=coordinate)
-
-                if result:
-                    tokens, start_line_hint = result[0].strip().split(','), result[1]
-                    # Important: pop the human_index first before removing the start index,
-                    # so that the human_index will be the correct index.
-                    del tokens[human_index]
-                    del tokens[0]
-
-                    a = g = c = t = x = 0
-                    for remaining_token_index, letter in enumerate(tokens):
-                        upper = letter.upper()
-                        a += upper == 'A'
-                        g += upper == 'G'
-                        c += upper == 'C'
-                        t += upper == 'T'
-                        x += upper == 'X' or upper == 'N'
-
-                    assert a + g + c + t + x == num_non_humans, f'{a + g + c + t + x} != {num_non_humans}'
-                    seq_matrix[bp_index, 1, :] = map_counts_to_vec(a=a, g=g, c=c, t=t, x=x)
-                    revcomp_seq_matrix[last_bp_index - bp_index, 1, :] = map_counts_to_revcomp_vec(a=a, g=g, c=c, t=t,
-                                                                                                   x=x)
-
-                    cache[coordinate] = (seq_matrix[bp_index],
-                                         revcomp_seq_matrix[last_bp_index - bp_index],
-                                         start_line_hint)
+                    window, _ = alignment.get_window(window_start, window_stop, fill='X')
+                    seq_matrix[:, 1, :], revcomp_seq_matrix[:, 1, :] = \
+                        count_letters_with_revcomp(window[:, non_human_indices])
 
-                else:
-                    # broadcasting along the species dimension
-                    seq_matrix[bp_index, 1, :] = map_counts_to_vec(a=0, g=0, c=0, t=0, x=num_non_humans)
-                    revcomp_seq_matrix[last_bp_index - bp_index, 1, :] = map_counts_to_revcomp_vec(a=0, g=0, c=0, t=0,
-                                                                                                   x=num_non_humans)
-
-            matrix_list.append(seq_matrix)
-            revcomp_matrix_list.append(revcomp_seq_matrix)
+                row_sums = seq_matrix[:, 1, :].sum(axis=1)
+                assert np.all(row_sums == num_non_humans), \
+                    f'{row_sums[row_sums != num_non_humans][0]} != {num_non_humans}'
 
-            if processed_line_count % 100 == 1:
-                for matrix, revcomp_matrix in zip(matrix_list, revcomp_matrix_list):
-                    feature_data[serializing_index] = matrix
+                writer.write(line_index, seq_matrix)
+                if not derive_revcomp:
                     # For the reverse complement strand
-                    feature_data[serializing_index + line_count] = revcomp_matrix
-                    serializing_index += 1
-
-                matrix_list = []
-                revcomp_matrix_list = []
-
-                elapsed_time = time.time() - start_time
-                time_per_line = elapsed_time / processed_line_count
-                print(
-                    f'{processed_line_count}/{line_count} = {processed_line_count / line_count:.2%} in {elapsed_time:.4f}s '
-                    f'averaging {time_per_line:2f}s per line '
-                    f'current serializing index: {serializing_index}',
-                    end='\r')
-
-        # Serializing the remaining data
-        if matrix_list:
-            assert len(matrix_list) == len(revcomp_matrix_list)
-            for matrix, revcomp_matrix, in zip(matrix_list, revcomp_matrix_list):
-                feature_data[serializing_index] = matrix
-                # For the reverse complement strand
-                feature_data[serializing_index + line_count] = revcomp_matrix
-                serializing_index += 1
-            elapsed_time = time.time() - start_time
-            time_per_line = elapsed_time / processed_line_count
-            print(
-                f'{processed_line_count}/{line_count} = {processed_line_count / line_count:.2%} in {elapsed_time:.4f}s '
-                f'averaging {time_per_line:2f}s per line '
-                f'current serializing index: {serializing_index}')
+                    writer.write(line_index + line_count, revcomp_seq_matrix)
+
+                if processed_line_count % 100 == 1:
+                    print_progress(processed_line_count, line_count, start_time, writer, alignment, end='\r')
+
+        print_progress(processed_line_count, line_count, start_time, writer, alignment)
+
+
+def print_progress(processed_line_count, line_count, start_time, writer, alignment, end='\n'):
+    elapsed_time = time.time() - start_time
+    time_per_line = elapsed_time / max(processed_line_count, 1)
+    print(
+        f'{processed_line_count}/{line_count} = {processed_line_count / max(line_count, 1):.2%} in {elapsed_time:.4f}s '
+        f'averaging {time_per_line:2f}s per line '
+        f'samples written: {writer.num_written}{format_cache_stats(alignment)}',
+        end=end)
 
 
 if __name__ == '__main__':
@@ -160,5 +119,14 @@ if __name__ == '__main__':
     parser.add_argument('chr')
     parser.add_argument('purpose')
     parser.add_argument('maf_dir')
+    parser.add_argument('--sorted-sweep', action='store_true',
+                        help='process the coordinates in sorted order, streaming the alignment file only once')
+    add_cache_arguments(parser)
+    add_genome_arguments(parser)
+    parser.add_argument('--derive-revcomp', action='store_true',
+                        help='only store the forward strand, read it with reverse_complement.ReverseComplementView')
+    add_compression_arguments(parser)
     args = parser.parse_args()
-    extend_dataset(args.chr, args.purpose, args.maf_dir)
+    extend_dataset(args.chr, args.purpose, args.maf_dir, cache_options=get_cache_options(args),
+                   sorted_sweep=args.sorted_sweep, compression_options=get_compression_options(args),
+                   derive_revcomp=args.derive_revcomp, twobit_filename=args.twobit)
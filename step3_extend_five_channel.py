@@ -1,155 +1,129 @@
 import argparse
-import os
 import time
 
-import biotool.file_binary_search as file_binary_search
 import h5py
 import numpy as np
 
-from binary_search import scan_through_line_for_number
-from line_cache import LineCache
-from nucleotide_mapping import mapping, complement_mapping
-from util.file import get_line_count
-
-
-def extend_dataset(chrom, purpose):
+from coded_features import create_coded_dataset, encode_letters, feature_encodings
+from hdf5_writer import BlockWriter, add_compression_arguments, create_feature_dataset, get_compression_options
+from maf_reader import add_cache_arguments, format_cache_stats, get_cache_options, open_alignment
+from reverse_complement import complement_channel_permutation, mark_derived_revcomp
+from util.coordinate import add_genome_arguments, open_coordinate_lines
+from window_encoding import complement_onehot_table, encode_window, onehot_table, to_letter_codes
+
+
+def extend_dataset(chrom, purpose, cache_options=None, sorted_sweep=False, line_range=None, hdf5_filename=None,
+                   compression_options=None, encoding='onehot', derive_revcomp=False, twobit_filename=None):
+    """
+    :param twobit_filename: e.g. hg19.2bit to read the human letters from the genome instead of
+    data/{chrom}_{purpose}, see util.coordinate.open_coordinate_lines
+    :param encoding: one of coded_features.feature_encodings
+    :param derive_revcomp: whether to only store the forward strand of the onehot encoding,
+    see reverse_complement.ReverseComplementView. The code and packed encodings always derive the reverse complement.
+    """
     checkpoint_time_str = time.strftime('%a %b %d %Y %H:%M:%S UTC%z', time.localtime(time.time()))
     print('Current time: {}'.format(checkpoint_time_str))
 
-    cache = LineCache()
-
-    matrix_list = []
-    revcomp_matrix_list = []
-
-    coordinate_filename = os.path.join('data', '{}_{}'.format(chrom, purpose))
+    # Only the lines in line_range are extended, into the rows counted from its first line
+    coordinate_filename, line_count, coordinate_lines = open_coordinate_lines(chrom, purpose, sorted_sweep,
+                                                                              line_range, twobit_filename)
     alignment_filename = '{}_maf_sequence.csv'.format(chrom)
-    hdf5_filename = '{}_{}.hundred.hdf5'.format(chrom, purpose)
+    if hdf5_filename is None:
+        hdf5_filename = '{}_{}.hundred.hdf5'.format(chrom, purpose)
     num_species = 100
 
     print('=> coordinate_filename: {}'.format(coordinate_filename))
     print('=> alignment_filename: {}'.format(alignment_filename))
     print('=> target hdf5_filename: {}'.format(hdf5_filename))
-    file_byte_size = os.stat(alignment_filename).st_size
-
-    line_count = get_line_count(coordinate_filename)
 
     flanking_number = 400
     seq_len = 200 + 2 * flanking_number
-    last_bp_index = seq_len - 1
     feature_dim = 5
 
-    serializing_index = 0
-
-    with open(coordinate_filename, 'r') as coord_file, open(alignment_filename, 'r') as alignment_file, \
+    with open_alignment(alignment_filename, cache_options, sorted_sweep) as alignment, \
             h5py.File(hdf5_filename, 'w') as hdf5_file:
 
         feature_group = hdf5_file.create_group('feature')
-        feature_data = feature_group.create_dataset('data', (line_count * 2, seq_len, num_species, feature_dim),
-                                                    dtype='uint8')
-
-        header = alignment_file.readline().strip().split(',')
-        human_index = header.index('hg19')
+        if encoding == 'onehot':
+            num_strands = 1 if derive_revcomp else 2
+            feature_data = create_feature_dataset(feature_group, 'data',
+                                                  (line_count * num_strands, seq_len, num_species, feature_dim),
+                                                  **(compression_options or {}))
+            if derive_revcomp:
+                mark_derived_revcomp(feature_data, complement_channel_permutation)
+        else:
+            # Only the forward strand is stored, coded_features.CodedFeatureView derives the reverse complement
+            feature_data = create_coded_dataset(feature_group, 'data', line_count, (seq_len, num_species), encoding,
+                                                **(compression_options or {}))
+
+        human_index = alignment.species.index('hg19')
+        non_human_indices = [index for index in range(alignment.num_species) if index != human_index]
 
         processed_line_count = 0
         start_time = time.time()
 
-        for line in coord_file:
-            processed_line_count += 1
-            (start_coordinate, sequence) = line.strip().split(',')
-            start_coordinate = int(start_coordinate)
-
-            # 1000 x 100 x 5
-            alignment_matrix = np.zeros((seq_len, num_species, feature_dim), dtype='uint8')
-            revcomp_alignment_matrix = np.zeros((seq_len, num_species, feature_dim), dtype='uint8')
-
-            start_line_hint = None
-            for bp_index, (hg_letter, coordinate) in enumerate(
-                    zip(sequence, range(start_coordinate - flanking_number, start_coordinate + 200 + flanking_number))):
-
-                if coordinate in cache:
-                    # the entry for revcomp_alignment_matrix in the cache corresponds to the coordinate last_seq_index - bp_index
-                    # on the reverse complement strand
-                    (alignment_matrix[bp_index, :, :],
-                     revcomp_alignment_matrix[last_bp_index - bp_index, :, :],
-                     start_line_hint) = cache[coordinate]
-                    continue
-
-                # insert the human letter first
-                alignment_matrix[bp_index, 0, :] = mapping[hg_letter]
-                revcomp_alignment_matrix[last_bp_index - bp_index, 0, :] = complement_mapping[hg_letter]
-
-                if not start_line_hint:
-                    # TODO: test they are equal
-                    # result = search(alignment_file, coordinate, file_byte_size)
-                    result = file_binary_search.search(alignment_filename, coordinate, num_header_lines=1)
+        # In the sorted sweep mode the lines are visited in genomic order
+        # and each sample is still written to the row of its line
+        with BlockWriter(feature_data) as writer:
+            for line_index, start_coordinate, sequence in coordinate_lines:
+                processed_line_count += 1
+
+                # Coordinates absent from the alignment are filled with X for all the non-human species
+                window, _ = alignment.get_window(start_coordinate - flanking_number,
+                                                 start_coordinate + 200 + flanking_number, fill='X')
+
+                # 1000 x 100 letters with hg19 in the first row
+                letters = np.empty((seq_len, num_species), dtype='uint8')
+                letters[:, 0] = to_letter_codes(sequence)
+                letters[:, 1:] = window[:, non_human_indices]
+
+                if encoding == 'onehot' and derive_revcomp:
+                    # 1000 x 100 x 5
+                    writer.write(line_index, onehot_table[letters])
+                elif encoding == 'onehot':
+                    # 1000 x 100 x 5
+                    # revcomp_alignment_matrix[seq_len - 1 - bp_index] is the complement of alignment_matrix[bp_index]
+                    alignment_matrix, revcomp_alignment_matrix = encode_window(letters, onehot_table,
+                                                                               complement_onehot_table)
+
+                    writer.write(line_index, alignment_matrix)
+                    # For the reverse complement strand
+                    writer.write(line_index + line_count, revcomp_alignment_matrix)
                 else:
-                    result = scan_through_line_for_number(alignment_file=alignment_file,
-                                                          start_line_hint=start_line_hint, number=coordinate)
-
-                if result:
-                    tokens, start_line_hint = result[0].strip().split(','), result[1]
-                    # Important: pop the human_index first before removing the start index,
-                    # so that the human_index will be the correct index.
-                    del tokens[human_index]
-                    del tokens[0]
-
-                    # aligned_letters is 100x5
-                    aligned_letters = alignment_matrix[bp_index]
-                    revcomp_aligned_letters = revcomp_alignment_matrix[last_bp_index - bp_index]
+                    writer.write(line_index, encode_letters(letters, encoding))
 
-                    for remaining_token_index, letter in enumerate(tokens):
-                        # +1 because we put hg19 in the first row
-                        species_index = remaining_token_index + 1
-                        aligned_letters[species_index, :] = mapping[letter]
-                        revcomp_aligned_letters[species_index, :] = complement_mapping[letter]
+                if processed_line_count % 100 == 1:
+                    print_progress(processed_line_count, line_count, start_time, writer, alignment, end='\r')
 
-                    cache[coordinate] = (aligned_letters, revcomp_aligned_letters, start_line_hint)
+        print_progress(processed_line_count, line_count, start_time, writer, alignment)
 
-                else:
-                    # broadcasting along the species dimension
-                    alignment_matrix[bp_index, 1:, :] = mapping['X']
-                    revcomp_alignment_matrix[last_bp_index - bp_index, 1:, :] = complement_mapping['X']
-
-            matrix_list.append(alignment_matrix)
-            revcomp_matrix_list.append(revcomp_alignment_matrix)
 
-            if processed_line_count % 100 == 1:
-                for matrix, revcomp_matrix in zip(matrix_list, revcomp_matrix_list):
-                    feature_data[serializing_index] = matrix
-                    # For the reverse complement strand
-                    feature_data[serializing_index + line_count] = revcomp_matrix
-                    serializing_index += 1
-
-                matrix_list = []
-                revcomp_matrix_list = []
-
-                elapsed_time = time.time() - start_time
-                time_per_line = elapsed_time / processed_line_count
-                print(
-                    f'{processed_line_count}/{line_count} = {processed_line_count / line_count:.2%} in {elapsed_time:.4f}s '
-                    f'averaging {time_per_line:2f}s per line '
-                    f'current serializing index: {serializing_index}',
-                    end='\r')
-
-        # Serializing the remaining data
-        if matrix_list:
-            assert len(matrix_list) == len(revcomp_matrix_list)
-            for matrix, revcomp_matrix, in zip(matrix_list, revcomp_matrix_list):
-                feature_data[serializing_index] = matrix
-                # For the reverse complement strand
-                feature_data[serializing_index + line_count] = revcomp_matrix
-                serializing_index += 1
-            elapsed_time = time.time() - start_time
-            time_per_line = elapsed_time / processed_line_count
-            print(
-                f'{processed_line_count}/{line_count} = {processed_line_count / line_count:.2%} in {elapsed_time:.4f}s '
-                f'averaging {time_per_line:2f}s per line '
-                f'current serializing index: {serializing_index}')
+def print_progress(processed_line_count, line_count, start_time, writer, alignment, end='\n'):
+    elapsed_time = time.time() - start_time
+    time_per_line = elapsed_time / max(processed_line_count, 1)
+    print(
+        f'{processed_line_count}/{line_count} = {processed_line_count / max(line_count, 1):.2%} in {elapsed_time:.4f}s '
+        f'averaging {time_per_line:2f}s per line '
+        f'samples written: {writer.num_written}{format_cache_stats(alignment)}',
+        end=end)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('chr')
     parser.add_argument('purpose')
+    parser.add_argument('--sorted-sweep', action='store_true',
+                        help='process the coordinates in sorted order, streaming the alignment file only once')
+    add_cache_arguments(parser)
+    add_genome_arguments(parser)
+    parser.add_argument('--encoding', choices=feature_encodings, default='onehot',
+                        help='code and packed store a nucleotide code per position and species for the forward strand '
+                             'only, read them with coded_features.CodedFeatureView')
+    parser.add_argument('--derive-revcomp', action='store_true',
+                        help='only store the forward strand of the onehot encoding, '
+                             'read it with reverse_complement.ReverseComplementView')
+    add_compression_arguments(parser)
     args = parser.parse_args()
-    extend_dataset(args.chr, args.purpose)
+    extend_dataset(args.chr, args.purpose, cache_options=get_cache_options(args),
+                   sorted_sweep=args.sorted_sweep, compression_options=get_compression_options(args),
+                   encoding=args.encoding, derive_revcomp=args.derive_revcomp, twobit_filename=args.twobit)
@@ -1,200 +1,86 @@
 import argparse
 import h5py
-import numpy as np
-import os
 import time
 
-from binary_search import search, get_location_from_line
-from line_cache import LineCache
+from hdf5_writer import BlockWriter, add_compression_arguments, create_feature_dataset, get_compression_options
+from maf_reader import add_cache_arguments, format_cache_stats, get_cache_options, open_alignment
+from util.coordinate import add_genome_arguments, open_coordinate_lines
+from window_encoding import complement_onehot_table, encode_window, onehot_table
 
-a_array = np.array([1, 0, 0, 0, 0], dtype='uint8')
-g_array = np.array([0, 1, 0, 0, 0], dtype='uint8')
-c_array = np.array([0, 0, 1, 0, 0], dtype='uint8')
-t_array = np.array([0, 0, 0, 1, 0], dtype='uint8')
-x_array = np.array([0, 0, 0, 0, 1], dtype='uint8')
-zero_array = np.array([0, 0, 0, 0, 0], dtype='uint8')
 
-mapping = {
-    'a': a_array,
-    'A': a_array,
-
-    'g': g_array,
-    'G': g_array,
-
-    'c': c_array,
-    'C': c_array,
-
-    't': t_array,
-    'T': t_array,
-
-    'X': x_array,
-
-    'N': zero_array,
-    'n': zero_array
-}
-
-complement_mapping = {
-    'a': t_array,
-    'A': t_array,
-
-    'g': c_array,
-    'G': c_array,
-
-    'c': g_array,
-    'C': g_array,
-
-    't': a_array,
-    'T': a_array,
-
-    'X': x_array,
-
-    'N': zero_array,
-    'n': zero_array
-}
-
-
-def scan_through_line_for_number(alignment_file, start_line_hint, number):
-    alignment_file.seek(start_line_hint)
-
-    for line in alignment_file:
-        location = get_location_from_line(line)
-
-        if not location:
-            raise ValueError('There still lines in the alignment file but cannot obtain coordinate location')
-
-        if location == number:
-            return line, start_line_hint
-
-        # The lines are sorted so if the current location is already greater than the one
-        # we're searching for we know what we search does not exist.
-        elif location > number:
-            return None
-
-        start_line_hint += len(bytes(line, 'ascii'))
-
-    return None
-
-
-def extend_dataset(chrom, purpose):
+def extend_dataset(chrom, purpose, cache_options=None, sorted_sweep=False, compression_options=None,
+                   twobit_filename=None):
+    """
+    :param twobit_filename: e.g. hg19.2bit to read the human letters from the genome instead of
+    data/{chrom}_{purpose}, see util.coordinate.open_coordinate_lines
+    """
     checkpoint_time_str = time.strftime('%a %b %d %Y %H:%M:%S UTC%z', time.localtime(time.time()))
     print('Current time: {}'.format(checkpoint_time_str))
 
-    cache = LineCache()
-
-    array_list = []
-    reverse_complement_array_list = []
-
-    coordinate_filename = os.path.join('data', '{}_{}'.format(chrom, purpose))
+    coordinate_filename, line_count, coordinate_lines = open_coordinate_lines(chrom, purpose, sorted_sweep,
+                                                                              twobit_filename=twobit_filename)
     alignment_filename = '{}_maf_sequence.csv'.format(chrom)
     hdf5_filename = '{}_{}.short.hdf5'.format(chrom, purpose)
     hdf5_revcomp_filename = '{}_{}.revcomp.short.hdf5'.format(chrom, purpose)
     species_indices = [42, 74, 39, 21, 78, 69, 83, 94, 81, 96, 71, 17, 75, 12]
     number_of_species = len(species_indices)
 
-    file_byte_size = os.stat(alignment_filename).st_size
     print('=> coordinate_filename: {}'.format(coordinate_filename))
     print('=> alignment_filename: {}'.format(alignment_filename))
     print('=> target hdf5_filename: {}'.format(hdf5_filename))
     print('=> target reverse complement hdf5_filename: {}'.format(hdf5_revcomp_filename))
 
-    with open(coordinate_filename, 'r') as file, open(alignment_filename, 'r') as alignment_file:
-        header = alignment_file.readline().strip().split(',')
+    seq_len = 200
+    feature_dim = 5
+    shape = (line_count, number_of_species, seq_len, feature_dim)
+
+    with open_alignment(alignment_filename, cache_options, sorted_sweep) as alignment, \
+            h5py.File(hdf5_filename, 'w') as hdf5_file, h5py.File(hdf5_revcomp_filename, 'w') as revcomp_file:
+        feature_data = create_feature_dataset(hdf5_file.create_group('feature'), 'data', shape,
+                                              **(compression_options or {}))
+        revcomp_feature_data = create_feature_dataset(revcomp_file.create_group('feature'), 'data', shape,
+                                                      **(compression_options or {}))
 
         processed_line_count = 0
         start_time = time.time()
 
-        seq_len = 200
-        feature_dim = 5
-
-        for line in file:
-            processed_line_count += 1
-            start_coordinate = int(line.strip().split(',')[0])
-
-            # revcomp_matrix is the reverse complement of the sequences
-            alignment_matrix = np.zeros((seq_len, number_of_species, feature_dim), dtype='uint8')
-            revcomp_matrix = np.zeros((seq_len, number_of_species, feature_dim), dtype='uint8')
-
-            start_line_hint = None
-            end_index = seq_len - 1
-            for letter_index, coordinate in enumerate(range(start_coordinate, start_coordinate + seq_len)):
-                if coordinate in cache:
-                    cached_result = cache[coordinate]
-                    alignment_matrix[letter_index] = cached_result[0]
-                    revcomp_matrix[end_index - letter_index] = cached_result[1]
-                    start_line_hint = cached_result[2]
-
-                    continue
-
-                elif not start_line_hint:
-                    result = search(alignment_file, coordinate, file_byte_size)
-                else:
-                    result = scan_through_line_for_number(alignment_file=alignment_file,
-                                                          start_line_hint=start_line_hint, number=coordinate)
-
-                if result:
-                    start_line_hint = result[1]
-                    tokens = result[0].strip().split(',')
-                    # the first token is pos
-                    del tokens[0]
-
-                    # aligned_letters is of shape (num_species , feature_dim)
-                    # revcomp_letters is associated at the index end_index - letter_index
-                    aligned_letters = alignment_matrix[letter_index]
-                    revcomp_letters = revcomp_matrix[end_index - letter_index]
-
-                    for row_number, species_index in enumerate(species_indices):
-                        letter = tokens[species_index]
-                        aligned_letters[row_number, :] = mapping[letter]
-                        revcomp_letters[row_number, :] = complement_mapping[letter]
-
-                    cache[coordinate] = (aligned_letters, revcomp_letters, start_line_hint)
-
-            array_list.append(alignment_matrix.transpose((1, 0, 2)))
-            reverse_complement_array_list.append(revcomp_matrix.transpose((1, 0, 2)))
-
-            if processed_line_count % 1000 == 0:
-                elapsed_time = time.time() - start_time
-                time_per_line = elapsed_time / processed_line_count
-                print('Processed {} lines in {:5f}s, averaging: {:5f}s per line'
-                      .format(processed_line_count, elapsed_time, time_per_line), end='\r')
-
-    stamp = time.time()
-    print('\n=> Serializing...')
-    with h5py.File(hdf5_filename, 'w') as file:
-        feature_group = file.create_group('feature')
-
-        array_list_length = len(array_list)
-
-        feature_data = feature_group.create_dataset('data',
-                                                    (array_list_length, number_of_species, seq_len, feature_dim),
-                                                    dtype='uint8')
-        for index, matrix in enumerate(array_list):
-            feature_data[index] = matrix
-
-            if index % 1000 == 0:
-                print("{}/{} in {:5f}s".format(index, array_list_length, time.time() - stamp), end='\r')
+        # The samples are written to the rows of their lines as they are extended
+        with BlockWriter(feature_data) as writer, BlockWriter(revcomp_feature_data) as revcomp_writer:
+            for line_index, start_coordinate, _ in coordinate_lines:
+                processed_line_count += 1
 
-    print('\n=> Serializing the reverse complement...')
-    with h5py.File(hdf5_revcomp_filename, 'w') as file:
-        feature_group = file.create_group('feature')
+                # The letters of the selected species,
+                # with the coordinates absent from the alignment encoded as all zeros
+                window, _ = alignment.get_window(start_coordinate, start_coordinate + seq_len, fill='N')
 
-        array_list_length = len(reverse_complement_array_list)
+                # revcomp_matrix is the reverse complement of the sequences
+                # both are of shape (seq_len, number_of_species, feature_dim)
+                alignment_matrix, revcomp_matrix = encode_window(window[:, species_indices], onehot_table,
+                                                                 complement_onehot_table)
 
-        feature_data = feature_group.create_dataset('data',
-                                                    (array_list_length, number_of_species, seq_len, feature_dim),
-                                                    dtype='uint8')
-        for index, matrix in enumerate(reverse_complement_array_list):
-            feature_data[index] = matrix
+                writer.write(line_index, alignment_matrix.transpose((1, 0, 2)))
+                revcomp_writer.write(line_index, revcomp_matrix.transpose((1, 0, 2)))
 
-            if index % 1000 == 0:
-                print("{}/{} in {:5f}s".format(index, array_list_length, time.time() - stamp), end='\r')
+                if processed_line_count % 1000 == 0:
+                    elapsed_time = time.time() - start_time
+                    time_per_line = elapsed_time / processed_line_count
+                    print('Processed {} lines in {:5f}s, averaging: {:5f}s per line{}'
+                          .format(processed_line_count, elapsed_time, time_per_line,
+                                  format_cache_stats(alignment)), end='\r')
 
-    print('\n=> Finished serializeing in {:.5f}s'.format(time.time() - stamp))
+    print('\n=> Finished {} lines in {:.5f}s'.format(processed_line_count, time.time() - start_time))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('chr')
     parser.add_argument('purpose')
+    parser.add_argument('--sorted-sweep', action='store_true',
+                        help='process the coordinates in sorted order, streaming the alignment file only once')
+    add_cache_arguments(parser)
+    add_genome_arguments(parser)
+    add_compression_arguments(parser)
     args = parser.parse_args()
-    extend_dataset(args.chr, args.purpose)
+    extend_dataset(args.chr, args.purpose, cache_options=get_cache_options(args),
+                   sorted_sweep=args.sorted_sweep, compression_options=get_compression_options(args),
+                   twobit_filename=args.twobit)
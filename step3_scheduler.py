@@ -0,0 +1,288 @@
+import argparse
+import os
+import sys
+import time
+import traceback
+from collections import defaultdict
+from contextlib import redirect_stdout
+from multiprocessing import Pool
+
+import h5py
+
+import step3_extend
+import step3_extend_counting
+import step3_extend_five_channel
+from coded_features import feature_encodings
+from hdf5_writer import add_compression_arguments, create_feature_dataset, get_block_size, get_compression_options
+from maf_reader import add_cache_arguments, get_cache_options
+from util.coordinate import add_genome_arguments, open_coordinate_lines
+
+# variant -> hdf5 filename format
+variants = {
+    'align': '{}_{}.align.hdf5',
+    'five_channel': '{}_{}.hundred.hdf5',
+    'counting': '{}_{}.counting.hdf5',
+}
+
+all_chroms = [f'chr{index}' for index in range(1, 23)] + ['chrX', 'chrY']
+all_purposes = ['train', 'valid', 'test']
+
+
+def get_shard_filename(hdf5_filename, shard_index, num_shards):
+    # e.g. chr1_train.hundred.hdf5 -> chr1_train.hundred.shard_3_of_8.hdf5
+    return '{}.shard_{}_of_{}.hdf5'.format(os.path.splitext(hdf5_filename)[0], shard_index, num_shards)
+
+
+def get_line_ranges(line_count, num_shards):
+    """
+    :return: a list of at most num_shards non-empty (first_line, stop_line) covering [0, line_count),
+    empty if there are no lines
+    """
+    if line_count == 0:
+        return []
+    num_shards = max(1, min(num_shards, line_count))
+    boundaries = [line_count * shard_index // num_shards for shard_index in range(num_shards + 1)]
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+class WorkUnit:
+    def __init__(self, variant, chrom, purpose, shard_index, num_shards, line_range):
+        self.variant = variant
+        self.chrom = chrom
+        self.purpose = purpose
+        self.shard_index = shard_index
+        self.num_shards = num_shards
+        self.line_range = line_range
+        self.attempts = 0
+
+    @property
+    def hdf5_filename(self):
+        return variants[self.variant].format(self.chrom, self.purpose)
+
+    @property
+    def shard_filename(self):
+        return get_shard_filename(self.hdf5_filename, self.shard_index, self.num_shards)
+
+    @property
+    def num_lines(self):
+        return self.line_range[1] - self.line_range[0]
+
+    def is_done(self):
+        # Shards are renamed to their final name only once they are complete.
+        return os.path.isfile(self.shard_filename)
+
+    def __str__(self):
+        return '{} {} {} shard {}/{} lines [{}, {})'.format(self.variant, self.chrom, self.purpose,
+                                                             self.shard_index + 1, self.num_shards, *self.line_range)
+
+
+def run_work_unit(unit, maf_dir, cache_options, sorted_sweep, encoding, derive_revcomp, twobit_filename=None):
+    """
+    Extends the lines of a single shard into a temporary file which is renamed to the shard filename on success.
+    The output of the step3 script is redirected to a log file next to the shard.
+
+    :return: (pid, elapsed seconds)
+    """
+    stamp = time.time()
+    temp_filename = unit.shard_filename + '.tmp'
+    log_filename = unit.shard_filename + '.log'
+    # The shards are only read once by merge_shards so they are left uncompressed
+    kwargs = dict(cache_options=cache_options, sorted_sweep=sorted_sweep, line_range=unit.line_range,
+                  hdf5_filename=temp_filename, compression_options=dict(compression=None),
+                  twobit_filename=twobit_filename)
+
+    with open(log_filename, 'w') as log_file, redirect_stdout(log_file):
+        if unit.variant == 'align':
+            step3_extend.extend_dataset(unit.chrom, unit.purpose, **kwargs)
+        elif unit.variant == 'five_channel':
+            step3_extend_five_channel.extend_dataset(unit.chrom, unit.purpose, encoding=encoding,
+                                                     derive_revcomp=derive_revcomp, **kwargs)
+        else:
+            step3_extend_counting.extend_dataset(unit.chrom, unit.purpose, maf_dir, derive_revcomp=derive_revcomp,
+                                                 **kwargs)
+
+    os.replace(temp_filename, unit.shard_filename)
+    return os.getpid(), time.time() - stamp
+
+
+def merge_shards(units, compression_options=None):
+    """
+    Merges the shard files of the same (variant, chrom, purpose) into the hdf5 file the step3 script would create.
+    For the shards holding the reverse complement samples, the second half of each shard is copied to
+    the second half of the merged dataset, i.e. row i of the merged dataset is the reverse complement of row
+    i - line_count.
+    """
+    units = sorted(units, key=lambda u: u.shard_index)
+    hdf5_filename = units[0].hdf5_filename
+    line_count = units[-1].line_range[1]
+
+    stamp = time.time()
+    temp_filename = hdf5_filename + '.tmp'
+    with h5py.File(temp_filename, 'w') as hdf5_file:
+        feature_data = None
+        for unit in units:
+            with h5py.File(unit.shard_filename, 'r') as shard_file:
+                shard_data = shard_file['feature/data']
+                if feature_data is None:
+                    feature_data = create_feature_dataset(
+                        hdf5_file.create_group('feature'), 'data',
+                        (shard_data.shape[0] // unit.num_lines * line_count,) + shard_data.shape[1:],
+                        dtype=shard_data.dtype, **(compression_options or {}))
+                    feature_data.attrs.update(shard_data.attrs)
+
+                # Whether the shard holds the reverse complement samples in its second half
+                has_revcomp = shard_data.shape[0] == 2 * unit.num_lines
+
+                first_line = unit.line_range[0]
+                block_size = get_block_size(feature_data)
+                for block_start in range(0, unit.num_lines, block_size):
+                    block_stop = min(block_start + block_size, unit.num_lines)
+                    feature_data[first_line + block_start:first_line + block_stop] = \
+                        shard_data[block_start:block_stop]
+                    if has_revcomp:
+                        feature_data[line_count + first_line + block_start:line_count + first_line + block_stop] = \
+                            shard_data[unit.num_lines + block_start:unit.num_lines + block_stop]
+
+    os.replace(temp_filename, hdf5_filename)
+    print('=> Merged {} shards into {} in {:.4f}s'.format(len(units), hdf5_filename, time.time() - stamp))
+
+
+def print_throughput(worker_stats, total_lines, elapsed_time):
+    print('=> Throughput per worker:')
+    for pid, (num_units, num_lines, busy_time) in sorted(worker_stats.items()):
+        print('-> worker {}: {} shards {} lines in {:.2f}s = {:.2f} lines/s'
+              .format(pid, num_units, num_lines, busy_time, num_lines / busy_time if busy_time else 0.))
+    print('=> Total: {} lines in {:.2f}s = {:.2f} lines/s'
+          .format(total_lines, elapsed_time, total_lines / elapsed_time if elapsed_time else 0.))
+
+
+def schedule(variant_names, chroms, purposes, num_shards, num_workers=None, max_retries=2, maf_dir='.',
+             cache_options=None, sorted_sweep=False, keep_shards=False, compression_options=None, encoding='onehot',
+             derive_revcomp=False, twobit_filename=None):
+    """
+    Fans out the (variant, chrom, purpose, shard) work units across a process pool.
+    Each shard covers a contiguous range of lines of data/{chrom}_{purpose}, or of the lines of chrom in
+    {purpose}_coord with twobit_filename, and is written to its own file,
+    and the shards are merged into the usual hdf5 file once all of them are complete.
+
+    Rerunning the same command resumes the build: the merged hdf5 files that already exist are skipped,
+    as are the shards whose files already exist.
+
+    :param num_shards: the number of shards per (chrom, purpose)
+    :param num_workers: defaults to the number of cores
+    :param max_retries: the number of times a failed work unit is resubmitted
+    :param encoding: the feature encoding of the five_channel variant, see coded_features.feature_encodings
+    :param derive_revcomp: whether the five_channel and counting variants only store the forward strand
+    :param twobit_filename: e.g. hg19.2bit to slice the human letters from the genome instead of reading them
+    from data/{chrom}_{purpose}, see util.coordinate.open_coordinate_lines
+    :return: True if every hdf5 file has been created
+    """
+    groups = defaultdict(list)
+    for variant in variant_names:
+        for chrom in chroms:
+            for purpose in purposes:
+                hdf5_filename = variants[variant].format(chrom, purpose)
+                if os.path.isfile(hdf5_filename):
+                    print('=> Skipping {} which already exists'.format(hdf5_filename))
+                    continue
+                if twobit_filename is None:
+                    coordinate_filename = os.path.join('data', '{}_{}'.format(chrom, purpose))
+                else:
+                    coordinate_filename = '{}_coord'.format(purpose)
+                if not os.path.isfile(coordinate_filename):
+                    print('=> Skipping {} {} since {} does not exist'.format(chrom, purpose, coordinate_filename))
+                    continue
+
+                _, line_count, _ = open_coordinate_lines(chrom, purpose, twobit_filename=twobit_filename)
+                if line_count == 0:
+                    # There is nothing to merge, and step2 would not have written data/{chrom}_{purpose} either
+                    print('=> Skipping {} {} which has no lines in {}'.format(chrom, purpose, coordinate_filename))
+                    continue
+                line_ranges = get_line_ranges(line_count, num_shards)
+                for shard_index, line_range in enumerate(line_ranges):
+                    groups[variant, chrom, purpose].append(
+                        WorkUnit(variant, chrom, purpose, shard_index, len(line_ranges), line_range))
+
+    pending_units = []
+    for units in groups.values():
+        for unit in units:
+            if unit.is_done():
+                print('=> Resuming from the completed {}'.format(unit))
+            else:
+                pending_units.append(unit)
+    total_lines = sum(unit.num_lines for unit in pending_units)
+    print('=> {} work units with {} lines to process'.format(len(pending_units), total_lines))
+
+    # pid -> [num_units, num_lines, busy_time]
+    worker_stats = defaultdict(lambda: [0, 0, 0.])
+    failed_units = []
+    stamp = time.time()
+
+    with Pool(num_workers) as pool:
+        while pending_units:
+            unit_args = (maf_dir, cache_options, sorted_sweep, encoding, derive_revcomp, twobit_filename)
+            results = [(unit, pool.apply_async(run_work_unit, (unit,) + unit_args)) for unit in pending_units]
+            pending_units = []
+            for unit, result in results:
+                unit.attempts += 1
+                try:
+                    pid, elapsed_time = result.get()
+                except Exception:
+                    print('=> {} failed on attempt {}:\n{}'.format(unit, unit.attempts, traceback.format_exc()))
+                    if unit.attempts <= max_retries:
+                        pending_units.append(unit)
+                    else:
+                        failed_units.append(unit)
+                    continue
+
+                worker_stats[pid][0] += 1
+                worker_stats[pid][1] += unit.num_lines
+                worker_stats[pid][2] += elapsed_time
+                print('-> {} done in {:.2f}s by worker {}'.format(unit, elapsed_time, pid))
+
+    print_throughput(worker_stats, total_lines, time.time() - stamp)
+
+    for units in groups.values():
+        if any(not unit.is_done() for unit in units):
+            print('=> Not merging {} as some of its shards failed'.format(units[0].hdf5_filename))
+            continue
+        merge_shards(units, compression_options)
+        if not keep_shards:
+            for unit in units:
+                os.remove(unit.shard_filename)
+                os.remove(unit.shard_filename + '.log')
+
+    for unit in failed_units:
+        print('=> Gave up on {} after {} attempts, see {}.log'.format(unit, unit.attempts, unit.shard_filename))
+    return not failed_units
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--variants', nargs='+', choices=list(variants), default=['five_channel'])
+    parser.add_argument('--chroms', nargs='+', default=all_chroms)
+    parser.add_argument('--purposes', nargs='+', choices=all_purposes, default=all_purposes)
+    parser.add_argument('--num-shards', type=int, default=os.cpu_count(),
+                        help='number of shards per chromosome and purpose')
+    parser.add_argument('--num-workers', type=int, default=None, help='defaults to the number of cores')
+    parser.add_argument('--max-retries', type=int, default=2)
+    parser.add_argument('--maf-dir', default='.', help='directory of chr*_maf_sequence.csv for the counting variant')
+    parser.add_argument('--keep-shards', action='store_true', help='keep the shard files and logs after merging')
+    parser.add_argument('--sorted-sweep', action='store_true',
+                        help='process the coordinates of each shard in sorted order')
+    add_cache_arguments(parser)
+    add_genome_arguments(parser)
+    parser.add_argument('--encoding', choices=feature_encodings, default='onehot',
+                        help='feature encoding of the five_channel variant')
+    parser.add_argument('--derive-revcomp', action='store_true',
+                        help='only store the forward strand for the five_channel and counting variants')
+    add_compression_arguments(parser)
+    args = parser.parse_args()
+
+    success = schedule(args.variants, args.chroms, args.purposes, args.num_shards, num_workers=args.num_workers,
+                       max_retries=args.max_retries, maf_dir=args.maf_dir, cache_options=get_cache_options(args),
+                       sorted_sweep=args.sorted_sweep, keep_shards=args.keep_shards,
+                       compression_options=get_compression_options(args), encoding=args.encoding,
+                       derive_revcomp=args.derive_revcomp, twobit_filename=args.twobit)
+    if not success:
+        sys.exit(1)
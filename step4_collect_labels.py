@@ -1,9 +1,15 @@
-from collections import defaultdict
 import numpy as np
 import h5py
 from scipy import io
 import time
 
+from coord_partition import load_coord_partition
+from reverse_complement import has_derived_revcomp, mark_derived_revcomp
+
+# Number of coordinate lines whose labels are read at once,
+# i.e. about 60MB of uint8 labels for the 919 labels of each line
+label_block_size = 1 << 16
+
 
 class Timer:
     def __init__(self):
@@ -16,129 +22,116 @@ class Timer:
         return time.time() - self.stamp
 
 
-class ProgressTracker(Timer):
-    def __init__(self, frequency):
-        super().__init__()
-        self.frequency = frequency
-
-    def print_progress(self, line_index):
-        if line_index % self.frequency == 0:
-            elapsed = self.get_elapsed_time()
-            processed_line_count = line_index + 1
-            print(f'processed {processed_line_count} lines in {elapsed:5f}s, '
-                  f'averaging {elapsed / processed_line_count:5f}s per line')
-
-
-def collect_labels():
+def create_label_dataset(hdf5_file, num_lines, num_labels):
+    """
+    The labels are tiled to match the reverse complement samples stored in the second half of the features.
+    If the features only store the forward strand, the labels are stored once and tagged
+    so that reverse_complement.ReverseComplementView serves them for the reverse complement samples as well.
+
+    :return: the dataset, to be filled with add_labels
+    """
+    group = hdf5_file.create_group('label')
+    if has_derived_revcomp(hdf5_file['feature/data']):
+        label_data = group.create_dataset('data', (num_lines, num_labels), dtype='uint8')
+        mark_derived_revcomp(label_data, flip=False)
+    else:
+        label_data = group.create_dataset('data', (2 * num_lines, num_labels), dtype='uint8')
+    return label_data
+
+
+def add_labels(purpose, labels, transposed=False, block_size=label_block_size):
+    """
+    Scatters the labels of the lines of {purpose}_coord into the label datasets of the chr*_{purpose}.hundred.hdf5
+    files in a single pass over the label matrix, reading block_size lines at a time.
+    Since the lines of a chromosome are its rows in file order, the lines of a chromosome within a block
+    are a contiguous range of its rows and each block is a single write per chromosome.
+
+    :param labels: the num_lines x num_labels label matrix, or the num_labels x num_lines matrix with
+    transposed=True as the traindata dataset of train.mat read with h5py
+    """
+    partition = load_coord_partition(f'{purpose}_coord')
+    num_lines = len(partition)
+    num_labels = labels.shape[0] if transposed else labels.shape[1]
+    chroms = partition.chrom_names
+    chrom_rows = {chrom: partition.get_chrom_lines(chrom) for chrom in chroms}
+
+    # For every line, the index of its chromosome in chroms and its row in the chromosome's files
+    line_chroms = partition.chrom_ids
+    line_rows = np.empty(num_lines, dtype='int64')
+    for rows in chrom_rows.values():
+        line_rows[rows] = np.arange(len(rows))
+
+    hdf5_files = {}
+    label_datasets = {}
+    try:
+        for chrom in chroms:
+            hdf5_filename = f'{chrom}_{purpose}.hundred.hdf5'
+            print(f'=> opening {hdf5_filename}')
+            hdf5_files[chrom] = h5py.File(hdf5_filename, 'r+')
+            label_datasets[chrom] = create_label_dataset(hdf5_files[chrom], len(chrom_rows[chrom]), num_labels)
+
+        timer = Timer()
+        for block_start in range(0, num_lines, block_size):
+            block_stop = min(block_start + block_size, num_lines)
+            # A contiguous read of the label matrix, one line per row
+            if transposed:
+                block = np.asarray(labels[:, block_start:block_stop]).T
+            else:
+                block = np.asarray(labels[block_start:block_stop])
+            block = block.astype('uint8', copy=False)
+
+            block_chroms = line_chroms[block_start:block_stop]
+            for chrom_index in np.unique(block_chroms):
+                is_chrom = block_chroms == chrom_index
+                chrom = chroms[chrom_index]
+                first_row = line_rows[block_start:block_stop][is_chrom][0]
+                chrom_labels = block[is_chrom]
+                label_data = label_datasets[chrom]
+                label_data[first_row:first_row + len(chrom_labels)] = chrom_labels
+                if len(label_data) == 2 * len(chrom_rows[chrom]):
+                    reverse_first_row = len(chrom_rows[chrom]) + first_row
+                    label_data[reverse_first_row:reverse_first_row + len(chrom_labels)] = chrom_labels
+
+            elapsed = timer.get_elapsed_time()
+            print(f'processed {block_stop} lines in {elapsed:5f}s, averaging {elapsed / block_stop:5f}s per line')
+
+        for chrom in chroms:
+            print(f'=> {chrom} has {len(chrom_rows[chrom])} labels with a corresponding array of shape '
+                  f'{label_datasets[chrom].shape}')
+    finally:
+        for hdf5_file in hdf5_files.values():
+            hdf5_file.close()
+    print(f'=> added the labels to the {len(chroms)} chr*_{purpose}.hundred.hdf5 files')
+
+
+def add_training_labels():
     print('=> collecting training labels')
-
-    labels_dict = defaultdict(list)
-    tracker = ProgressTracker(10000)
-
-    with open('train_coord', 'r') as train_coord_file, h5py.File('train.mat', 'r') as train_file:
+    with h5py.File('train.mat', 'r') as train_file:
         training_labels = train_file['traindata']
         print(f'training labels has shape: {training_labels.shape}')
+        add_labels('train', training_labels, transposed=True)
 
-        for line_index, line in enumerate(train_coord_file):
-            tokens = line.split()
-            chrom, start, stop = tokens[0], int(tokens[1]), int(tokens[2])
-            labels_dict[chrom].append(training_labels[:, line_index])
-            tracker.print_progress(line_index)
-
-    return labels_dict
 
-
-def add_labels_to_dataset(labels_dict):
-    for chrom, label_list in labels_dict.items():
-        label_array = np.tile(label_list, (2, 1))
-        print(f'=> {chrom} has {len(label_list)} labels with a corresponding array of shape {label_array.shape}')
-
-        hdf5_filename = f'{chrom}_train.hundred.hdf5'
-        print(f'=> opening {hdf5_filename}')
-
-        with h5py.File(hdf5_filename, 'r+') as hdf5_file:
-            group = hdf5_file.create_group('label')
-            group.create_dataset('data', data=label_array, dtype='uint8')
-        print(f'=> added the labels to {hdf5_filename}')
-
-
-def collect_validation_labels():
+def add_validation_labels():
     print('=> collecting validation labels')
+    validation_labels = io.loadmat('valid.mat')['validdata']
+    print(f'validation labels has shape: {validation_labels.shape}')
+    add_labels('valid', validation_labels)
 
-    labels_dict = defaultdict(list)
-    tracker = ProgressTracker(10000)
-
-    validation_file = io.loadmat('valid.mat')
-
-    with open('valid_coord', 'r') as valid_coord_file:
-        validation_labels = validation_file['validdata']
-        print(f'validation labels has shape: {validation_labels.shape}')
 
-        for line_index, line in enumerate(valid_coord_file):
-            tokens = line.split()
-            chrom = tokens[0]
-            labels_dict[chrom].append(validation_labels[line_index, :])
-            tracker.print_progress(line_index)
-
-    return labels_dict
-
-
-def add_labels_to_validation_dataset(labels_dict):
-    for chrom, label_list in labels_dict.items():
-        label_array = np.tile(label_list, (2, 1))
-        print(f'=> {chrom} has {len(label_list)} labels with a corresponding array of shape {label_array.shape}')
-
-        hdf5_filename = f'{chrom}_valid.hundred.hdf5'
-        print(f'=> opening {hdf5_filename}')
-
-        with h5py.File(hdf5_filename, 'r+') as hdf5_file:
-            group = hdf5_file.create_group('label')
-            group.create_dataset('data', data=label_array, dtype='uint8')
-        print(f'=> added the labels to {hdf5_filename}')
-
-
-def collect_test_labels():
+def add_test_labels():
     print('=> collecting test labels')
-    labels_dict = defaultdict(list)
-    tracker = ProgressTracker(10000)
-
-    test_file = io.loadmat('test.mat')
-    test_labels = test_file['testdata']
+    test_labels = io.loadmat('test.mat')['testdata']
     print(f'testing labels has shape {test_labels.shape}')
-
-    with open('test_coord', 'r') as test_coord_file:
-        for line_index, line in enumerate(test_coord_file):
-            tokens = line.split()
-            chrom = tokens[0]
-            labels_dict[chrom].append(test_labels[line_index, :])
-            tracker.print_progress(line_index)
-
-    return labels_dict
-
-
-def add_labels_to_test_dataset(labels_dict):
-    for chrom, label_list in labels_dict.items():
-        label_array = np.tile(label_list, (2, 1))
-        print(f'=> {chrom} has {len(label_list)} labels with a corresponding array of shape {label_array.shape}')
-
-        hdf5_filename = f'{chrom}_test.hundred.hdf5'
-        print(f'=> opening {hdf5_filename}')
-
-        with h5py.File(hdf5_filename, 'r+') as hdf5_file:
-            group = hdf5_file.create_group('label')
-            group.create_dataset('data', data=label_array, dtype='uint8')
-        print(f'=> added the labels to {hdf5_filename}')
+    add_labels('test', test_labels)
 
 
 if __name__ == '__main__':
     print('=> adding labels to the training dataset')
-    collected_train_labels = collect_labels()
-    add_labels_to_dataset(collected_train_labels)
+    add_training_labels()
 
-    collected_validation_labels = collect_validation_labels()
     print('=> adding labels to the validation dataset')
-    add_labels_to_validation_dataset(collected_validation_labels)
+    add_validation_labels()
 
-    collected_test_labels = collect_test_labels()
     print('=> adding labels to the testing dataset')
-    add_labels_to_test_dataset(collected_test_labels)
+    add_test_labels()
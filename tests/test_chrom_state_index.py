@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+import pytest
+
+import chrom_state_index
+from bed_binary_search import search
+from chrom_state_index import SegmentationIndex, missing_state
+
+num_basepairs = 100
+
+
+def write_segmentation(filename, seed=0):
+    # Sorted intervals with gaps that are absent from the segmentation
+    rng = np.random.RandomState(seed)
+    with open(filename, 'w') as file:
+        position = 10
+        for _ in range(60):
+            length = rng.randint(1, 80)
+            file.write(f'chr1\t{position}\t{position + length}\tU{rng.randint(1, 101)}\n')
+            position += length + rng.randint(0, 2) * rng.randint(1, 30)
+    return position
+
+
+@pytest.fixture(scope='module')
+def segmentation(tmp_path_factory):
+    """
+    :return: (filename, end, index) of a chr1 segmentation and the index of its states
+    """
+    filename = str(tmp_path_factory.mktemp('segmentation') / 'chr1_segmentation.bed')
+    end = write_segmentation(filename)
+    return filename, end, SegmentationIndex(use_cache=False, get_filename=lambda chrom: filename)
+
+
+def search_states(filename, window_start):
+    """
+    :return: (states, num_missing) of the window as generate_chrom_state_data.py looked up every base pair
+    """
+    states = []
+    num_missing = 0
+    with open(filename, 'r') as file:
+        for coordinate in range(window_start, window_start + num_basepairs):
+            result = search(file, coordinate, os.stat(filename).st_size)
+            if result:
+                states.append(int(result[0].split()[3][1:]) - 1)
+            else:
+                states.append(missing_state)
+                num_missing += 1
+    return states, num_missing
+
+
+# Windows before the segmentation, within it, and across and after its end
+@pytest.mark.parametrize('get_window_start', [lambda end: -30, lambda end: 0, lambda end: 55, lambda end: 700,
+                                              lambda end: end - 40, lambda end: end + 100])
+def test_states_match_binary_search(segmentation, get_window_start):
+    filename, end, index = segmentation
+    window_start = get_window_start(end)
+
+    states, num_missing = index.get_states('chr1', np.array([window_start]), num_basepairs)
+
+    expected_states, expected_num_missing = search_states(filename, window_start)
+    assert states[0].tolist() == expected_states
+    assert num_missing == expected_num_missing
+
+
+def test_batched_windows_match_single_windows(segmentation):
+    filename, end, index = segmentation
+    window_starts = np.array([end - 40, -30, 700, 55, end + 100, 0])
+    states, num_missing = index.get_states('chr1', window_starts, num_basepairs)
+    expected = [search_states(filename, window_start) for window_start in window_starts]
+    assert states.tolist() == [expected_states for expected_states, _ in expected]
+    assert num_missing == sum(expected_num_missing for _, expected_num_missing in expected)
+
+
+def test_cache_and_sub_blocks_match_whole_lookup(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'chr1_segmentation.bed')
+    end = write_segmentation(filename, seed=1)
+    window_starts = np.random.RandomState(1).randint(-200, end + 200, 50)
+    expected = SegmentationIndex(use_cache=False, get_filename=lambda chrom: filename).get_block_states(
+        'chr1', window_starts, num_basepairs)
+
+    monkeypatch.setattr(chrom_state_index, 'index_block_bytes', 8 * num_basepairs * 3 + 1)
+    for _ in range(2):
+        # The first lookup writes the .npz cache and the second one reads it
+        index = SegmentationIndex(use_cache=True, get_filename=lambda chrom: filename)
+        states, num_missing = index.get_states('chr1', window_starts, num_basepairs)
+        assert np.array_equal(states, expected[0]) and num_missing == expected[1]
+    assert os.path.isfile(str(tmp_path / 'chr1_segmentation.npz'))
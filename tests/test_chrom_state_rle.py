@@ -0,0 +1,50 @@
+import h5py
+import numpy as np
+
+from chrom_state_index import num_chromatin_states
+from chrom_state_rle import RunLengthStateView, RunLengthStateWriter, create_rle_group, decode_runs, encode_runs
+from generate_chrom_state_onehot import chrom_state_onehot_table
+
+num_basepairs = 50
+
+
+def get_states(num_windows, seed=0):
+    """
+    :return: windows made of a few segments, as the chromatin states are, plus a window changing at every base pair
+    """
+    rng = np.random.RandomState(seed)
+    states = np.empty((num_windows, num_basepairs), dtype='uint8')
+    for window in states:
+        boundaries = np.sort(rng.choice(np.arange(1, num_basepairs), rng.randint(0, 4), replace=False))
+        window[:] = np.repeat(rng.randint(0, num_chromatin_states, len(boundaries) + 1),
+                              np.diff(np.concatenate(([0], boundaries, [num_basepairs]))))
+    states[-1] = np.arange(num_basepairs) % num_chromatin_states
+    return states
+
+
+def test_encode_decode_round_trip():
+    states = get_states(200)
+    run_states, run_lengths, runs_per_window = encode_runs(states)
+    assert runs_per_window.sum() == len(run_states) == len(run_lengths)
+    assert np.all(run_lengths > 0)
+    assert np.array_equal(decode_runs(run_states, run_lengths, num_basepairs), states)
+
+
+def test_view_matches_dense_one_hot(tmp_path):
+    states = get_states(200, seed=1)
+    with h5py.File(tmp_path / 'chrom_states_rle.hdf5', 'w') as hdf5_file:
+        writer = RunLengthStateWriter(create_rle_group(hdf5_file, 'state', len(states), num_basepairs))
+        # Written in blocks as generate_chrom_state_onehot.generate_rle does
+        for block_start in range(0, len(states), 64):
+            writer.write(states[block_start:block_start + 64])
+        assert writer.num_windows == len(states)
+
+        view = RunLengthStateView(hdf5_file['state'])
+        onehot_view = RunLengthStateView(hdf5_file['state'], onehot=True)
+        dense = chrom_state_onehot_table[states]
+        assert onehot_view.shape == dense.shape
+        assert np.array_equal(view[:], states)
+        assert np.array_equal(onehot_view[:], dense)
+        assert np.array_equal(onehot_view[63], dense[63])
+        indices = [199, 5, 6, 7, 5, 64, 0]
+        assert np.array_equal(onehot_view[indices], dense[indices])
@@ -0,0 +1,62 @@
+import h5py
+import numpy as np
+import pytest
+
+from coded_features import CodedFeatureView, create_coded_dataset, encode_letters, open_feature_view
+from nucleotide_mapping import complement_mapping, mapping
+from window_encoding import code_table, get_num_packed_bytes, pack_codes, unpack_codes
+
+# The letters of the alignment files handled by nucleotide_mapping
+alignment_letters = np.frombuffer(b''.join(letter.encode('ascii') for letter in mapping), dtype='uint8')
+
+
+def get_letters(num_samples, seq_len=30, num_species=7, seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.choice(alignment_letters, (num_samples, seq_len, num_species))
+
+
+def encode_with_mapping(letters):
+    """
+    :return: (forward, revcomp) one-hot samples as the five channel extender wrote them letter by letter
+    """
+    seq_len, num_species = letters.shape
+    forward = np.zeros((seq_len, num_species, 5), dtype='uint8')
+    revcomp = np.zeros((seq_len, num_species, 5), dtype='uint8')
+    for bp_index in range(seq_len):
+        for species_index in range(num_species):
+            letter = chr(letters[bp_index, species_index])
+            forward[bp_index, species_index] = mapping[letter]
+            revcomp[seq_len - 1 - bp_index, species_index] = complement_mapping[letter]
+    return forward, revcomp
+
+
+@pytest.mark.parametrize('num_codes', [1, 7, 8, 13, 3000])
+def test_pack_codes_round_trip(num_codes):
+    codes = code_table[get_letters(1, num_codes, 1, seed=num_codes)[0, :, 0]]
+    packed = pack_codes(codes)
+    assert packed.shape == (get_num_packed_bytes(num_codes),)
+    assert np.array_equal(unpack_codes(packed, (num_codes,)), codes)
+    # A batch of packed samples
+    assert np.array_equal(unpack_codes(np.stack([packed, packed]), (num_codes,)), np.stack([codes, codes]))
+
+
+@pytest.mark.parametrize('encoding', ['code', 'packed'])
+def test_coded_view_matches_one_hot_mapping(tmp_path, encoding):
+    letters = get_letters(12)
+    with h5py.File(tmp_path / 'features.hdf5', 'w') as hdf5_file:
+        dataset = create_coded_dataset(hdf5_file, 'data', len(letters), letters.shape[1:], encoding)
+        for sample_index, sample_letters in enumerate(letters):
+            dataset[sample_index] = encode_letters(sample_letters, encoding)
+
+        view = open_feature_view(dataset)
+        assert isinstance(view, CodedFeatureView)
+        assert len(view) == 2 * len(letters) and view.shape == (24, 30, 7, 5)
+        expected = np.empty(view.shape, dtype='uint8')
+        for sample_index, sample_letters in enumerate(letters):
+            expected[sample_index], expected[sample_index + len(letters)] = encode_with_mapping(sample_letters)
+
+        assert np.array_equal(view[:], expected)
+        assert np.array_equal(view[5], expected[5])
+        assert np.array_equal(view[-1], expected[-1])
+        indices = [20, 3, 3, 15, 0]
+        assert np.array_equal(view[indices], expected[indices])
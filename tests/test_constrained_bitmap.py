@@ -0,0 +1,94 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from constrained_data import constrained_bitmap
+from constrained_data.constrained_bitmap import ConstrainedBitmaps, build_bitmap, get_bitmap_filename, get_text_filename
+from constrained_data.constrained_data_binary_search import search
+
+num_basepairs = 100
+
+
+def write_phast_cons(dirname, chrom, intervals):
+    with open(get_text_filename(chrom, dirname), 'w') as file:
+        for index, (start, end_exclusive) in enumerate(intervals):
+            file.write(f'{index}\t{chrom}\t{start}\t{end_exclusive}\tlod=12\t240\n')
+
+
+def get_sorted_intervals(seed=0):
+    # Sorted and disjoint as in phastConsElements100way.txt
+    rng = np.random.RandomState(seed)
+    boundaries = np.cumsum(rng.randint(1, 60, 80))
+    return list(zip(boundaries[0::2].tolist(), boundaries[1::2].tolist()))
+
+
+@pytest.fixture
+def phast_cons_dirname(tmp_path):
+    write_phast_cons(tmp_path, 'chr1', get_sorted_intervals())
+    return str(tmp_path)
+
+
+def is_constrained(text_filename, coordinate):
+    # As constrained_data/generate_constrained_element_data.py looked up every base pair
+    with open(text_filename, 'r') as file:
+        coordinate_is_present, _, _ = search(file, coordinate, os.stat(text_filename).st_size)
+    return coordinate_is_present
+
+
+def test_states_match_binary_search(phast_cons_dirname):
+    end = get_sorted_intervals()[-1][1]
+    window_starts = np.array([-50, 0, 17, 300, end - 10, end + 500])
+
+    states = ConstrainedBitmaps(phast_cons_dirname).get_states('chr1', window_starts, num_basepairs)
+
+    text_filename = get_text_filename('chr1', phast_cons_dirname)
+    coordinates = window_starts[:, None] + np.arange(num_basepairs)
+    expected = [[is_constrained(text_filename, coordinate) for coordinate in row] for row in coordinates.tolist()]
+    assert states.astype(bool).tolist() == expected
+
+
+def test_sub_blocks_match_whole_lookup(tmp_path, monkeypatch):
+    write_phast_cons(tmp_path, 'chr1', get_sorted_intervals(seed=1))
+    bitmaps = ConstrainedBitmaps(str(tmp_path))
+    window_starts = np.random.RandomState(1).randint(-200, 3000, 50)
+    expected = bitmaps.get_block_states('chr1', window_starts, num_basepairs)
+    monkeypatch.setattr(constrained_bitmap, 'lookup_block_bytes', 8 * num_basepairs * 3 + 1)
+    assert np.array_equal(bitmaps.get_states('chr1', window_starts, num_basepairs), expected)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_bitmap_of_overlapping_intervals(seed):
+    rng = np.random.RandomState(seed)
+    starts = rng.randint(0, 2000, 200)
+    ends = starts + rng.randint(0, 300, 200)
+    # More overlapping intervals than an int8 count can hold
+    starts = np.append(starts, [500] * 300)
+    ends = np.append(ends, [520] * 300)
+
+    expected = np.zeros(ends.max(), dtype=bool)
+    for start, end_exclusive in zip(starts, ends):
+        expected[start:end_exclusive] = True
+    bits = np.unpackbits(build_bitmap(starts, ends))
+    assert np.array_equal(bits[:len(expected)], expected)
+    assert not bits[len(expected):].any()
+
+
+def test_split_into_chroms_runs_from_the_repository_root(tmp_path):
+    root_dirname = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    table_filename = str(tmp_path / 'phastConsElements100way.txt')
+    with open(table_filename, 'w') as file:
+        # Unsorted and spread over two chromosomes, as the genome-wide table
+        for index, (chrom, start) in enumerate([('chr2', 500), ('chr1', 300), ('chr2', 100), ('chr1', 40)]):
+            file.write(f'{index}\t{chrom}\t{start}\t{start + 20}\tlod=12\t240\n')
+
+    for options in [[], ['--bitmap']]:
+        subprocess.run([sys.executable, '-m', 'constrained_data.split_into_chroms', '--filename', table_filename,
+                        '--phast-cons-dir', str(tmp_path)] + options, cwd=root_dirname, check=True,
+                       stdout=subprocess.DEVNULL)
+
+    with open(get_text_filename('chr1', str(tmp_path)), 'r') as file:
+        assert [line.split()[2] for line in file] == ['40', '300']
+    assert np.array_equal(np.load(get_bitmap_filename('chr2', str(tmp_path))), build_bitmap([100, 500], [120, 520]))
@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+
+from coord_partition import load_coord_partition
+from util.coordinate import iterate_coordinate_blocks, read_chrom_starts
+
+
+def write_coord(filename, seed):
+    rng = np.random.RandomState(seed)
+    lines = []
+    for chrom, start in zip(rng.choice(['chr3', 'chr1', 'chrX', 'chr22'], 80), rng.randint(0, 10 ** 8, 80)):
+        # Extra columns such as the labels of the merged bed files are ignored
+        lines.append(f'{chrom}\t{start}\t{start + 200}\t{rng.randint(2)}\n')
+    with open(filename, 'w') as file:
+        file.writelines(lines)
+    return [line.split()[:3] for line in lines]
+
+
+def test_partition_matches_parsed_lines(tmp_path):
+    filename = str(tmp_path / 'train_coord')
+    tokens = write_coord(filename, seed=0)
+
+    partition = load_coord_partition(filename)
+    assert len(partition) == len(tokens)
+    assert partition.get_line_chroms(0, len(partition)) == [chrom for chrom, _, _ in tokens]
+    assert partition.starts.tolist() == [int(start) for _, start, _ in tokens]
+    assert partition.stops.tolist() == [int(stop) for _, _, stop in tokens]
+    assert partition.rows.tolist() == list(range(len(tokens)))
+
+    for chrom in ['chr1', 'chr3', 'chrX', 'chr22', 'chrY']:
+        # The lines of a chromosome in the order step2 writes them to data/{chrom}_{purpose}
+        assert read_chrom_starts(filename, chrom).tolist() == \
+            [int(start) for line_chrom, start, _ in tokens if line_chrom == chrom]
+
+    blocks = list(iterate_coordinate_blocks(filename, 7))
+    assert [first_line for first_line, _, _, _ in blocks] == list(range(0, len(tokens), 7))
+    assert sum((chroms for _, chroms, _, _ in blocks), []) == [chrom for chrom, _, _ in tokens]
+    assert np.concatenate([starts for _, _, starts, _ in blocks]).tolist() == partition.starts.tolist()
+
+
+def test_readers_do_not_write_the_index(tmp_path):
+    filename = str(tmp_path / 'test_coord')
+    write_coord(filename, seed=3)
+    load_coord_partition(filename)
+    list(iterate_coordinate_blocks(filename, 10))
+    read_chrom_starts(filename, 'chr1')
+    assert os.listdir(tmp_path) == ['test_coord']
+
+
+def test_rewritten_coordinates_are_parsed_again(tmp_path):
+    filename = str(tmp_path / 'valid_coord')
+    write_coord(filename, seed=1)
+    first_starts = load_coord_partition(filename, save_cache=True).starts.tolist()
+    assert os.path.isfile(filename + '.npz')
+    assert load_coord_partition(filename).starts.tolist() == first_starts
+
+    # Even with the modification time of the indexed file, the size tells that the lines changed
+    stat = os.stat(filename)
+    tokens = write_coord(filename, seed=2)[:50]
+    with open(filename, 'w') as file:
+        file.writelines(f'{chrom}\t{start}\t{stop}\n' for chrom, start, stop in tokens)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert load_coord_partition(filename).starts.tolist() == [int(start) for _, start, _ in tokens]
@@ -0,0 +1,84 @@
+import os
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+from counting_measure.count_track import CountTracks
+from counting_measure.counting_measure_binary_search import search
+from maf_store import MafStore, build_count_track, build_maf_store, count_excluded_species, get_store_dirname
+from window_encoding import count_letters
+
+num_basepairs = 60
+# hg19 is the 43rd species of chr*_maf_sequence.csv, as get_counts expected
+species = [f'sp{index}' for index in range(42)] + [count_excluded_species] + [f'sp{index}' for index in range(42, 57)]
+alignment_letters = list('AGCTagctXxNn-')
+
+
+def write_alignment(filename, seed=0):
+    """
+    :return: the positions present in the alignment, with gaps between some of them
+    """
+    rng = np.random.RandomState(seed)
+    positions = 100 + np.cumsum(rng.randint(1, 4, 300))
+    with open(filename, 'w') as file:
+        file.write(','.join(['pos'] + species) + '\n')
+        for position in positions:
+            file.write(','.join([str(position)] + list(rng.choice(alignment_letters, len(species)))) + '\n')
+    return positions
+
+
+def get_counts(line):
+    # As counting_measure/generate_counting_measure.py counted a line of the alignment file
+    count_dict = defaultdict(int)
+    tokens = line.strip().lower().split(',')[1:]
+    tokens.pop(42)
+    for base in tokens:
+        count_dict[base] += 1
+    return np.array([count_dict['a'], count_dict['g'], count_dict['c'], count_dict['t']], dtype='uint8')
+
+
+class TestCountTracks:
+    """
+    counting_measure/count_track.py and the count track of maf_store.py against the counting of the alignment lines
+    """
+    @pytest.fixture
+    def alignment_filename(self, tmp_path):
+        return str(tmp_path / 'chr1_maf_sequence.csv')
+
+    def test_window_counts_match_counted_lines(self, alignment_filename):
+        positions = write_alignment(alignment_filename)
+        window_starts = np.array([0, 90, 150, positions[-1] - 20, positions[-1] + 10])
+
+        with CountTracks(os.path.dirname(alignment_filename)) as count_tracks:
+            counts, num_missing = count_tracks.get_window_counts(['chr1'] * len(window_starts), window_starts,
+                                                                 num_basepairs)
+
+        file_byte_size = os.stat(alignment_filename).st_size
+        with open(alignment_filename, 'r') as file:
+            results = [[search(file, window_start + offset, file_byte_size) for offset in range(num_basepairs)]
+                       for window_start in window_starts]
+        assert num_missing == sum(result is None for window_results in results for result in window_results)
+        for window_counts, window_results in zip(counts, results):
+            for bp_counts, result in zip(window_counts, window_results):
+                assert bp_counts[:4].tolist() == (get_counts(result[0]).tolist() if result else [0] * 4)
+
+    @pytest.mark.parametrize('get_window_start', [lambda positions: 50, lambda positions: 200,
+                                                  lambda positions: positions[-1] - 30])
+    def test_count_window_matches_counted_letters(self, alignment_filename, get_window_start):
+        positions = write_alignment(alignment_filename, seed=1)
+        build_maf_store(alignment_filename)
+        build_count_track(get_store_dirname(alignment_filename))
+        window_start = get_window_start(positions)
+        window_stop = window_start + num_basepairs
+
+        with MafStore(get_store_dirname(alignment_filename)) as store:
+            non_human_indices = [index for index, name in enumerate(store.species) if name != count_excluded_species]
+            # As step3_extend_counting.py counts a window without the count track
+            window, expected_found = store.get_window(window_start, window_stop, fill='X')
+            expected = count_letters(window[:, non_human_indices])
+
+            counts, found = store.get_count_window(window_start, window_stop)
+        assert np.array_equal(found, expected_found)
+        counts[~found, 4] = len(non_human_indices)
+        assert np.array_equal(counts, expected)
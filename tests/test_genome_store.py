@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pytest
+
+import step2_coord_to_fasta
+import step2_coord_to_letter
+from genome_store import GenomeStore, get_chrom_filename
+
+chrom_sizes = {'chr1': 5000, 'chr2': 1800}
+
+
+@pytest.fixture
+def genome_store(tmp_path):
+    """
+    A store whose chromosomes are already decoded into its cache, so that the 2bit file is never read
+    """
+    rng = np.random.RandomState(16)
+    cache_dirname = tmp_path / 'hg19.genome'
+    cache_dirname.mkdir()
+    for chrom, size in chrom_sizes.items():
+        np.save(get_chrom_filename(str(cache_dirname), chrom), rng.choice(np.frombuffer(b'ACGTacgtN', 'uint8'), size))
+    return GenomeStore(str(tmp_path / 'hg19.2bit'))
+
+
+def get_padded_sequence(genome_store, chrom, start, stop):
+    # The letters of [start, stop) with N for the coordinates out of the chromosome
+    size = genome_store.get_chrom_size(chrom)
+    return 'N' * max(0, min(-start, stop - start)) + genome_store.get_sequence(chrom, start, stop) + \
+        'N' * max(0, min(stop - size, stop - start))
+
+
+def test_windows_match_sequences(genome_store):
+    starts = [-1200, -30, 0, 17, 2500, 4980, 5000, 6000]
+    windows, num_padded = genome_store.get_windows('chr1', starts, 1000)
+    for start, window, window_num_padded in zip(starts, windows, num_padded):
+        sequence = get_padded_sequence(genome_store, 'chr1', start, start + 1000)
+        assert window.tobytes().decode('ascii') == sequence
+        assert window_num_padded == 1000 - len(genome_store.get_sequence('chr1', start, start + 1000))
+
+    chroms = ['chr2', 'chr1', 'chr2', 'chr1']
+    batch, _ = genome_store.get_window_batch(chroms, [10, 20, 1700, 4990], 300)
+    assert [window.tobytes().decode('ascii') for window in batch] == \
+        [get_padded_sequence(genome_store, chrom, start, start + 300)
+         for chrom, start in zip(chroms, [10, 20, 1700, 4990])]
+
+    stops = [200, 20, 1750, 5100]
+    windows, num_padded = genome_store.get_window_list(chroms, [10, 20, 1700, 4990], stops)
+    assert [window.tobytes().decode('ascii') for window in windows] == \
+        [get_padded_sequence(genome_store, chrom, start, stop)
+         for chrom, start, stop in zip(chroms, [10, 20, 1700, 4990], stops)]
+    assert num_padded.tolist() == [0, 0, 0, 100]
+
+
+@pytest.mark.parametrize('module, flanking_bp, parse_line', [
+    (step2_coord_to_letter, 400, lambda line: tuple(line.strip().split(','))),
+    (step2_coord_to_fasta, 50, lambda line: tuple(line.strip().lstrip('>').split('\n'))),
+])
+def test_step2_lines_match_genome_slices(genome_store, tmp_path, monkeypatch, module, flanking_bp, parse_line):
+    monkeypatch.chdir(tmp_path)
+    # Most lines span 200 bp, but the windows follow the length of each line
+    coordinates = [('chr1', 1000, 1200), ('chr2', 150, 330), ('chr1', 4200, 4400), ('chr2', 1700, 1950),
+                   ('chr1', 400, 401), ('chr1', 2000, 2200)]
+    with open('train_coord', 'w') as file:
+        file.writelines(f'{chrom}\t{start}\t{stop}\n' for chrom, start, stop in coordinates)
+    os.mkdir('out')
+    monkeypatch.setattr(module, 'get_destination_filename', lambda chrom, purpose: os.path.join('out', chrom))
+
+    module.coord_to_letter('train_coord', 'train', genome_store)
+
+    for chrom in chrom_sizes:
+        with open(os.path.join('out', chrom), 'r') as file:
+            text = file.read()
+        if module is step2_coord_to_fasta:
+            lines = [parse_line(record) for record in text.split('\n>') if record]
+        else:
+            lines = [parse_line(line) for line in text.splitlines()]
+        # As the windows were sliced from the 2bit file, in the order of the coordinate file
+        assert lines == [(str(start), get_padded_sequence(genome_store, chrom, start - flanking_bp, stop + flanking_bp))
+                         for line_chrom, start, stop in coordinates if line_chrom == chrom]
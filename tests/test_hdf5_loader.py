@@ -0,0 +1,94 @@
+import h5py
+import numpy as np
+import pytest
+
+import hdf5_loader
+from hdf5_loader import ParallelHDF5Loader
+
+num_samples = 203
+
+
+@pytest.fixture(scope='module')
+def hdf5_filename(tmp_path_factory):
+    filename = str(tmp_path_factory.mktemp('loader') / 'chr20_train.align.hdf5')
+    rng = np.random.RandomState(20)
+    with h5py.File(filename, 'w') as hdf5_file:
+        hdf5_file.create_dataset('feature/data', data=rng.randint(0, 2, (num_samples, 10, 6, 4)).astype('uint8'))
+        # The label of a sample is its row, so that every batch tells which samples it holds
+        hdf5_file.create_dataset('label/data', data=np.arange(num_samples, dtype='int64')[:, None])
+    return filename
+
+
+def read_epoch(loader, epoch):
+    # The batches are shared memory views that are reused once the next batch is requested
+    return [(features.copy(), labels.copy()) for features, labels in loader.iterate_epoch(epoch)]
+
+
+@pytest.mark.parametrize('batch_size, chunk_size', [(16, 5), (64, 32), (300, 7)])
+def test_epoch_reads_every_sample_once(hdf5_filename, batch_size, chunk_size):
+    with h5py.File(hdf5_filename, 'r') as hdf5_file:
+        all_features = hdf5_file['feature/data'][:]
+
+    with ParallelHDF5Loader(hdf5_filename, batch_size=batch_size, num_workers=2, chunk_size=chunk_size) as loader:
+        batches = read_epoch(loader, 0)
+
+    assert len(batches) == len(loader) == -(-num_samples // batch_size)
+    assert all(len(features) == batch_size for features, _ in batches[:-1])
+    rows = np.concatenate([labels[:, 0] for _, labels in batches])
+    assert sorted(rows) == list(range(num_samples))
+    # The features stay paired with the label of their row
+    for features, labels in batches:
+        assert np.array_equal(features, all_features[labels[:, 0]])
+
+
+def test_batches_only_depend_on_seed_and_epoch(hdf5_filename):
+    def get_rows(num_workers, seed, epoch):
+        with ParallelHDF5Loader(hdf5_filename, batch_size=32, num_workers=num_workers, seed=seed) as loader:
+            return np.concatenate([labels[:, 0] for _, labels in read_epoch(loader, epoch)]).tolist()
+
+    rows = get_rows(1, seed=0, epoch=0)
+    assert get_rows(3, seed=0, epoch=0) == rows
+    assert get_rows(2, seed=0, epoch=1) != rows
+    assert get_rows(2, seed=1, epoch=0) != rows
+
+
+def test_unshuffled_epoch_follows_file_order(hdf5_filename):
+    with ParallelHDF5Loader(hdf5_filename, label_key=None, batch_size=50, num_workers=2, shuffle=False) as loader:
+        labels = [labels for _, labels in loader.iterate_epoch(0)]
+        features = np.concatenate([features.copy() for features, _ in loader.iterate_epoch(1)])
+    assert labels == [None] * len(loader)
+    with h5py.File(hdf5_filename, 'r') as hdf5_file:
+        assert np.array_equal(features, hdf5_file['feature/data'][:])
+
+
+def test_abandoned_epoch_does_not_leak_into_the_next(hdf5_filename):
+    with ParallelHDF5Loader(hdf5_filename, batch_size=16, num_workers=2) as loader:
+        for batch_index, _ in enumerate(loader.iterate_epoch(0)):
+            if batch_index == 2:
+                break
+        rows = np.concatenate([labels[:, 0] for _, labels in read_epoch(loader, 1)])
+    assert sorted(rows) == list(range(num_samples))
+
+
+def test_worker_startup_failure_is_raised(hdf5_filename, tmp_path):
+    filename = str(tmp_path / 'chr21_train.align.hdf5')
+    with h5py.File(hdf5_filename, 'r') as source, h5py.File(filename, 'w') as hdf5_file:
+        source.copy('feature', hdf5_file)
+        source.copy('label', hdf5_file)
+
+    loader = ParallelHDF5Loader(filename, batch_size=16, num_workers=2)
+    # The workers open the file after the loader has read its shapes
+    with h5py.File(filename, 'a') as hdf5_file:
+        del hdf5_file['label']
+    with loader:
+        with pytest.raises(RuntimeError, match='Failed to load batch'):
+            read_epoch(loader, 0)
+
+
+def test_dead_worker_is_raised(hdf5_filename, monkeypatch):
+    monkeypatch.setattr(hdf5_loader, 'result_poll_seconds', 0.1)
+    with ParallelHDF5Loader(hdf5_filename, batch_size=16, num_workers=1) as loader:
+        loader.workers[0].kill()
+        loader.workers[0].join()
+        with pytest.raises(RuntimeError, match='died'):
+            read_epoch(loader, 0)
@@ -0,0 +1,52 @@
+import h5py
+import numpy as np
+import pytest
+
+from hdf5_writer import BlockWriter, create_feature_dataset, get_block_size, get_chunk_shape, get_filter_kwargs
+
+
+@pytest.fixture
+def hdf5_file(tmp_path):
+    with h5py.File(tmp_path / 'features.hdf5', 'w') as file:
+        yield file
+
+
+@pytest.mark.parametrize('block_size', [1, 7, 1000])
+def test_block_writer_matches_row_by_row_writes(hdf5_file, block_size):
+    rng = np.random.RandomState(block_size)
+    samples = rng.randint(0, 256, (300, 20, 5)).astype('uint8')
+    # Rows written in any order with gaps, as the sorted-sweep extenders do
+    rows = rng.permutation(400)[:300]
+
+    expected = hdf5_file.create_dataset('expected', (400, 20, 5), dtype='uint8')
+    for row, sample in zip(rows, samples):
+        expected[row] = sample
+
+    dataset = create_feature_dataset(hdf5_file, 'data', (400, 20, 5), compression='gzip')
+    with BlockWriter(dataset, block_size=block_size) as writer:
+        for row, sample in zip(rows, samples):
+            writer.write(row, sample)
+    assert writer.num_written == 300
+    assert np.array_equal(dataset[:], expected[:])
+
+
+def test_block_writer_does_not_flush_on_failure(hdf5_file):
+    dataset = create_feature_dataset(hdf5_file, 'data', (10, 3))
+    with pytest.raises(RuntimeError):
+        with BlockWriter(dataset, block_size=100) as writer:
+            writer.write(0, np.ones(3, dtype='uint8'))
+            raise RuntimeError
+    assert not dataset[:].any()
+
+
+def test_chunks_hold_whole_samples(hdf5_file):
+    assert get_chunk_shape((1000, 1000, 100, 5), 'uint8') == (2, 1000, 100, 5)
+    assert get_chunk_shape((3, 10), 'uint8') == (3, 10)
+    dataset = create_feature_dataset(hdf5_file, 'data', (100000, 1000))
+    assert dataset.chunks == (1048, 1000)
+    assert get_block_size(dataset) == (64 << 20) // 1000
+
+
+def test_uncompressed_by_default(hdf5_file):
+    assert get_filter_kwargs() == {}
+    assert create_feature_dataset(hdf5_file, 'data', (10, 10)).compression is None
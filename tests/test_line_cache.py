@@ -0,0 +1,91 @@
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from line_cache import ARCCache, LRUCache, create_cache
+
+
+def get_value(key):
+    return np.full(4, key, dtype='int64')
+
+
+def look_up(cache, key):
+    # The idiom of the step3 extenders
+    if key in cache:
+        return cache[key]
+    value = get_value(key)
+    cache[key] = value
+    return value
+
+
+def get_trace(seed=0, length=5000):
+    rng = np.random.RandomState(seed)
+    # A hot set of keys interleaved with scans through new keys
+    hot_keys = rng.randint(0, 50, length)
+    scan_keys = np.arange(1000, 1000 + length)
+    return np.where(rng.rand(length) < 0.7, hot_keys, scan_keys).tolist()
+
+
+@pytest.mark.parametrize('policy', ['lru', 'arc'])
+def test_cached_values_match_uncached_lookups(policy):
+    cache = create_cache(policy, capacity=64)
+    trace = get_trace()
+    for key in trace:
+        assert np.array_equal(look_up(cache, key), get_value(key))
+        assert len(cache) <= 64
+    assert cache.hits + cache.misses == len(trace)
+
+
+def test_lru_matches_reference_lru():
+    cache = LRUCache(capacity=32)
+    reference = OrderedDict()
+    num_reference_hits = 0
+    for key in get_trace(seed=1):
+        if key in reference:
+            reference.move_to_end(key)
+            num_reference_hits += 1
+        else:
+            reference[key] = None
+            if len(reference) > 32:
+                reference.popitem(last=False)
+        look_up(cache, key)
+        assert list(cache.keys()) == list(reference)
+    assert cache.hits == num_reference_hits
+
+
+def test_lru_max_bytes():
+    cache = LRUCache(capacity=None, max_bytes=10 * get_value(0).nbytes)
+    for key in range(100):
+        cache[key] = get_value(key)
+        assert cache.num_bytes <= cache.max_bytes
+    assert list(cache.keys()) == list(range(90, 100))
+
+
+def test_arc_keeps_frequent_keys_through_a_scan():
+    cache = ARCCache(capacity=20)
+    for _ in range(2):
+        for key in range(10):
+            look_up(cache, key)
+    for key in range(1000, 2000):
+        look_up(cache, key)
+    assert all(key in cache for key in range(10))
+
+    lru_cache = LRUCache(capacity=20)
+    for key in list(range(10)) * 2 + list(range(1000, 2000)):
+        look_up(lru_cache, key)
+    assert not any(key in lru_cache.cache for key in range(10))
+
+
+def test_arc_history_is_bounded():
+    cache = ARCCache(capacity=16)
+    for key in get_trace(seed=2):
+        look_up(cache, key)
+        assert len(cache.recent) + len(cache.recent_ghosts) <= 16
+        assert len(cache) + len(cache.recent_ghosts) + len(cache.frequent_ghosts) <= 32
+        assert 0 <= cache.target_recent_size <= 16
+
+
+def test_arc_rejects_max_bytes():
+    with pytest.raises(ValueError):
+        create_cache('arc', capacity=10, max_bytes=100)
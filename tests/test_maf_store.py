@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+import pytest
+
+from binary_search import search
+from maf_store import MafStore, build_maf_store, has_maf_store
+
+species = ['hg19', 'panTro4', 'gorGor3', 'ponAbe2', 'rheMac3', 'mm10', 'canFam3', 'galGal4']
+
+
+@pytest.fixture
+def alignment_filename(tmp_path):
+    # Gaps of up to 5 coordinates between the positions present in the alignment
+    rng = np.random.RandomState(3)
+    positions = 1000 + np.cumsum(rng.randint(1, 6, 250))
+    filename = str(tmp_path / 'chr2_maf_sequence.csv')
+    with open(filename, 'w') as file:
+        file.write(','.join(['pos'] + species) + '\n')
+        for position in positions:
+            file.write(','.join([str(position)] + list(rng.choice(list('AGCTagctNn-X'), len(species)))) + '\n')
+    return filename
+
+
+def search_letters(file, coordinate, file_byte_size):
+    # The letters of a coordinate as binary_search.search finds them in chr*_maf_sequence.csv
+    result = search(file, coordinate, file_byte_size)
+    if not result:
+        return None
+    return ''.join(result[0].strip().split(',')[1:]).encode('ascii')
+
+
+@pytest.mark.parametrize('chunk_size', [1, 17, 100000])
+def test_store_rows_match_binary_search(alignment_filename, chunk_size):
+    store_dirname = build_maf_store(alignment_filename, chunk_size=chunk_size)
+    assert has_maf_store(alignment_filename)
+    store = MafStore(store_dirname)
+    assert store.species == species
+
+    file_byte_size = os.stat(alignment_filename).st_size
+    with open(alignment_filename, 'r') as file:
+        for window_start in range(990, int(store.positions[-1]) + 10, 37):
+            window_stop = window_start + 40
+            window, found = store.get_window(window_start, window_stop, fill='X')
+            for offset, coordinate in enumerate(range(window_start, window_stop)):
+                letters = search_letters(file, coordinate, file_byte_size)
+                assert found[offset] == (letters is not None)
+                expected = letters if letters is not None else b'X' * len(species)
+                assert window[offset].tobytes() == expected
+
+
+def test_unsorted_positions_are_rejected(tmp_path):
+    filename = str(tmp_path / 'chr3_maf_sequence.csv')
+    with open(filename, 'w') as file:
+        file.write('pos,hg19,mm10\n10,A,C\n12,G,T\n11,a,c\n')
+
+    with pytest.raises(ValueError, match='strictly increasing'):
+        build_maf_store(filename, chunk_size=2)
+    assert not has_maf_store(filename)
@@ -0,0 +1,134 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import genome_store
+from genome_store import GenomeStore, get_chrom_filename
+from gkm_datagen import narrowpeak_to_fa as narrowpeak_to_fa_module
+from gkm_datagen.narrowpeak_to_fa import filter_close_coordinates, map_to_real_coordinates, narrowpeak_to_fa
+
+
+def map_one_by_one(sampled_starts, forbidden_starts, forbidden_stops):
+    # As generate_negative_sequence_coord shifted every sample through the sorted forbidden intervals
+    real_starts = []
+    for start in sampled_starts:
+        for forbidden_start, forbidden_stop in zip(forbidden_starts, forbidden_stops):
+            if start >= forbidden_start:
+                start += forbidden_stop - forbidden_start
+            else:
+                break
+        real_starts.append(start)
+    return real_starts
+
+
+def filter_in_place(sorted_starts, min_distance):
+    # As filter_close_coordinates popped the elements too close to the pivot from the sorted list
+    starts = list(sorted_starts)
+    current_value = starts[-1]
+    current_index = len(starts) - 2
+    while current_index >= 0:
+        if current_value - starts[current_index] < min_distance:
+            starts.pop(current_index)
+        else:
+            current_value = starts[current_index]
+        current_index -= 1
+    return starts
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_map_to_real_coordinates_matches_one_by_one(seed):
+    rng = np.random.RandomState(seed)
+    max_len = 50
+    # The positive sequences overlap once their starts are moved max_len to the left
+    positive_starts = np.sort(rng.randint(0, 5000, 40))
+    forbidden_starts = positive_starts - max_len
+    forbidden_stops = positive_starts + rng.randint(1, 100, 40)
+    sampled_starts = np.sort(rng.choice(4000, 300, replace=False))
+
+    real_starts = map_to_real_coordinates(sampled_starts, forbidden_starts, forbidden_stops)
+    assert real_starts.tolist() == map_one_by_one(sampled_starts, forbidden_starts, forbidden_stops)
+
+
+@pytest.mark.parametrize('min_distance', [1, 5, 40])
+def test_filter_close_coordinates_matches_in_place_filter(min_distance):
+    sorted_starts = np.sort(np.random.RandomState(min_distance).randint(0, 2000, 200))
+    kept_indices = filter_close_coordinates(sorted_starts, min_distance)
+    assert sorted_starts[kept_indices].tolist() == filter_in_place(sorted_starts, min_distance)
+    assert len(filter_close_coordinates(sorted_starts[:0], min_distance)) == 0
+
+
+def test_contains_letter_matches_sequence_scan(tmp_path, monkeypatch):
+    # A chromosome already decoded into the cache of the store, so that the 2bit file is never read
+    rng = np.random.RandomState(0)
+    letters = rng.choice(np.frombuffer(b'ACGTacgt', dtype='uint8'), 3000)
+    for run_start in rng.randint(0, 3000, 30):
+        letters[run_start:run_start + rng.randint(1, 40)] = ord('N')
+    letters[:7] = letters[-5:] = ord('N')
+    np.save(get_chrom_filename(str(tmp_path), 'chr1'), letters)
+    # Runs of N spanning several chunks
+    monkeypatch.setattr(genome_store, 'run_chunk_size', 64)
+
+    store = GenomeStore(str(tmp_path / 'hg19.2bit'), cache_dirname=str(tmp_path))
+    starts = rng.randint(-50, 3050, 500)
+    stops = starts + rng.randint(0, 60, 500)
+    has_n = store.contains_letter('chr1', starts, stops)
+    assert has_n.tolist() == ['N' in store.get_sequence('chr1', start, stop) for start, stop in zip(starts, stops)]
+
+
+@pytest.mark.parametrize('chunk_size', [4, 8, 1 << 24])
+def test_contains_letter_at_run_boundaries(tmp_path, monkeypatch, chunk_size):
+    # Runs of N at the start of the chromosome, across a chunk boundary and at its end
+    letters = np.frombuffer(b'NNNacgtNNNNNNNNNNNNgtacACGTNacgtNN', dtype='uint8')
+    np.save(get_chrom_filename(str(tmp_path), 'chr2'), letters)
+    monkeypatch.setattr(genome_store, 'run_chunk_size', chunk_size)
+    store = GenomeStore(str(tmp_path / 'hg19.2bit'), cache_dirname=str(tmp_path))
+
+    run_starts, run_stops = store.get_letter_runs('chr2')
+    assert list(zip(run_starts, run_stops)) == [(0, 3), (7, 19), (27, 28), (32, 34)]
+
+    windows = [(3, 7), (2, 3), (3, 8), (6, 7), (19, 27), (18, 19), (26, 27), (27, 28), (28, 32), (28, 33),
+               (33, 40), (34, 40), (10, 10), (-5, 0), (-5, 1)]
+    has_n = store.contains_letter('chr2', [start for start, _ in windows], [stop for _, stop in windows])
+    assert has_n.tolist() == ['N' in store.get_sequence('chr2', start, stop) for start, stop in windows]
+    assert has_n.tolist() == [False, True, True, False, False, True, False, True, False, True,
+                              True, False, False, False, True]
+
+
+def test_seed_makes_the_output_reproducible(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.RandomState(24)
+    chrom_sizes = {'chr1': 60000, 'chr2': 40000}
+    for chrom, size in chrom_sizes.items():
+        letters = rng.choice(np.frombuffer(b'ACGTacgt', dtype='uint8'), size)
+        letters[size // 2:size // 2 + 300] = ord('N')
+        np.save(get_chrom_filename(str(tmp_path), chrom), letters)
+    # The negative sequences are sampled from these chromosomes instead of the whole hg19
+    monkeypatch.setattr(narrowpeak_to_fa_module, 'sizes', chrom_sizes)
+    store = GenomeStore(str(tmp_path / 'hg19.2bit'), cache_dirname=str(tmp_path))
+    with open('peaks.narrowPeak', 'w') as file:
+        for chrom, start in zip(rng.choice(list(chrom_sizes), 40), rng.randint(1000, 25000, 40)):
+            file.write(f'{chrom}\t{start}\t{start + rng.randint(100, 300)}\t.\t0\n')
+
+    def read_outputs(seed, output_prefix):
+        narrowpeak_to_fa('peaks.narrowPeak', output_prefix, genome_store=store, seed=seed)
+        outputs = {}
+        for filename in sorted(os.listdir(output_prefix)):
+            with open(os.path.join(output_prefix, filename), 'r') as file:
+                outputs[filename[len(output_prefix):]] = file.read()
+        return outputs
+
+    outputs = read_outputs(1, 'first')
+    assert read_outputs(1, 'second') == outputs
+    assert read_outputs(2, 'third') != outputs
+    assert outputs['.train.neg.fa.ir'] and outputs['.test.pos.fa.ir']
+
+
+def test_runs_as_a_module_without_pythonpath():
+    root_dirname = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment = {name: value for name, value in os.environ.items() if name != 'PYTHONPATH'}
+    result = subprocess.run([sys.executable, '-m', 'gkm_datagen.narrowpeak_to_fa', '--help'], cwd=root_dirname,
+                            env=environment, check=True, capture_output=True, text=True)
+    assert '--work-dir' in result.stdout and '--seed' in result.stdout
@@ -0,0 +1,48 @@
+import h5py
+import numpy as np
+import pytest
+
+from nucleotide_mapping import map_counts_to_revcomp_vec
+from reverse_complement import ReverseComplementView, complement_channel_permutation, mark_derived_revcomp
+
+num_samples = 9
+
+
+def get_counts_revcomp(sample):
+    # As the counting extender wrote the reverse complement strand, base pair by base pair
+    return np.stack([map_counts_to_revcomp_vec(*counts) for counts in sample[::-1]]).astype('uint8')
+
+
+def get_state_revcomp(sample):
+    # As the chromatin state and constrained element generators wrote it
+    return sample[::-1]
+
+
+def get_label_revcomp(sample):
+    # The labels of the reverse complement samples are those of the forward ones
+    return sample
+
+
+@pytest.mark.parametrize('sample_shape,get_revcomp,mark_kwargs', [
+    ((40, 5), get_counts_revcomp, dict(channel_permutation=complement_channel_permutation)),
+    ((40,), get_state_revcomp, dict()),
+    ((919,), get_label_revcomp, dict(flip=False)),
+])
+def test_view_matches_stored_reverse_complement(tmp_path, sample_shape, get_revcomp, mark_kwargs):
+    forward = np.random.RandomState(0).randint(0, 100, (num_samples,) + sample_shape).astype('uint8')
+    stored = np.concatenate([forward, [get_revcomp(sample) for sample in forward]])
+
+    with h5py.File(tmp_path / 'features.hdf5', 'w') as hdf5_file:
+        dataset = hdf5_file.create_dataset('data', data=forward)
+        mark_derived_revcomp(dataset, **mark_kwargs)
+        view = ReverseComplementView(dataset)
+
+        assert len(view) == len(stored) and view.shape == stored.shape
+        assert np.array_equal(view[:], stored)
+        assert np.array_equal(view[3:15:2], stored[3:15:2])
+        for index in (0, num_samples - 1, num_samples, -1):
+            assert np.array_equal(view[index], stored[index])
+        indices = [12, 1, 1, 17, 0, 9]
+        assert np.array_equal(view[indices], stored[indices])
+        with pytest.raises(IndexError):
+            view[2 * num_samples]
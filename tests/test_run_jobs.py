@@ -0,0 +1,120 @@
+import os
+import time
+
+import pytest
+
+from gkm_datagen import run_jobs as run_jobs_module
+from gkm_datagen.run_jobs import create_work_units, read_jobs, run_jobs, stages
+
+output_prefixes = ['E003-H3K4me3', 'E004-H3K27ac', 'E005-DNase']
+
+
+def record_stage(job, stage):
+    # A single write to a file opened for appending, so that the lines of concurrent workers are not interleaved
+    with open(os.path.join(job.state_dirname, 'stages.log'), 'a') as log_file:
+        log_file.write(f'{job.output_prefix} {stage}\n')
+
+
+def fake_fasta_stage(job):
+    record_stage(job, 'fasta')
+
+
+def fake_species_stage(job, coord_name):
+    # The four species stages of a job finish close together, before the parent handles their results
+    time.sleep(0.1)
+    failure_filename = os.path.join(job.state_dirname, f'{job.output_prefix}.{coord_name}.fail')
+    if os.path.isfile(failure_filename):
+        os.remove(failure_filename)
+        raise RuntimeError(f'{coord_name} failed')
+    record_stage(job, f'species.{coord_name}')
+
+
+def fake_transport_stage(job):
+    record_stage(job, 'transport')
+
+
+@pytest.fixture
+def job_list(tmp_path, monkeypatch):
+    """
+    Replaces the stages by ones that only record that they ran, in the state directory of the jobs
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(run_jobs_module, 'run_fasta_stage', fake_fasta_stage)
+    monkeypatch.setattr(run_jobs_module, 'run_species_stage', fake_species_stage)
+    monkeypatch.setattr(run_jobs_module, 'run_transport_stage', fake_transport_stage)
+    os.mkdir('work')
+    with open('jobs.np', 'w') as file:
+        file.writelines(f'{prefix}.narrowPeak {prefix}\n\n' for prefix in output_prefixes)
+    return 'jobs.np'
+
+
+def run_recorded(job_list, **kwargs):
+    """
+    :return: (success, the stages run by run_jobs in the order they completed)
+    """
+    log_filename = os.path.join('work', 'job_state', 'stages.log')
+    if os.path.isfile(log_filename):
+        os.remove(log_filename)
+    success = run_jobs(job_list, 'narrow', 'target', work_dirname='work', num_workers=4, **kwargs)
+    if not os.path.isfile(log_filename):
+        return success, []
+    with open(log_filename, 'r') as log_file:
+        return success, [tuple(line.split()) for line in log_file]
+
+
+def test_units_follow_their_dependencies():
+    jobs = read_jobs('/dev/null', 'narrow', 'work', 'target', 'state')
+    assert jobs == []
+
+    units = create_work_units([run_jobs_module.Job('a.narrowPeak', 'a', 'work', 'target', 'state')])
+    assert [unit.stage for unit in units] == stages
+    for index, unit in enumerate(units):
+        assert all(units.index(dependency) < index for dependency in unit.dependencies)
+
+
+def test_every_stage_runs_once_after_its_dependencies(job_list):
+    success, ran = run_recorded(job_list)
+    assert success
+    # In particular transport is submitted once even though its four dependencies finish together
+    assert sorted(ran) == sorted((prefix, stage) for prefix in output_prefixes for stage in stages)
+    for prefix in output_prefixes:
+        job_stages = [stage for job_prefix, stage in ran if job_prefix == prefix]
+        assert job_stages[0] == 'fasta' and job_stages[-1] == 'transport'
+
+
+def test_rerun_resumes_from_the_done_markers(job_list):
+    assert run_recorded(job_list)[0]
+    assert run_recorded(job_list) == (True, [])
+
+    # The stages depending on a stage to run again are run again as well
+    os.remove(os.path.join('work', 'job_state', f'{output_prefixes[1]}.fasta.done'))
+    success, ran = run_recorded(job_list)
+    assert success
+    assert sorted(ran) == sorted((output_prefixes[1], stage) for stage in stages)
+
+
+def test_failed_stages_are_retried(job_list):
+    failure_filename = os.path.join('work', 'job_state', f'{output_prefixes[0]}.test.neg.fail')
+    os.makedirs(os.path.dirname(failure_filename))
+    open(failure_filename, 'w').close()
+    success, ran = run_recorded(job_list, max_retries=1)
+    assert success
+    assert ran.count((output_prefixes[0], 'species.test.neg')) == 1
+    assert ran.count((output_prefixes[0], 'transport')) == 1
+
+    for prefix in output_prefixes:
+        os.remove(os.path.join('work', 'job_state', f'{prefix}.fasta.done'))
+    open(failure_filename, 'w').close()
+    success, ran = run_recorded(job_list, max_retries=0)
+    assert not success
+    # The job whose stage gave up is never transported, the others are
+    assert (output_prefixes[0], 'transport') not in ran
+    assert all((prefix, 'transport') in ran for prefix in output_prefixes[1:])
+
+
+def test_seed_reaches_the_fasta_stage_of_every_job(job_list, monkeypatch):
+    monkeypatch.setattr(run_jobs_module, 'run_fasta_stage', lambda job: record_stage(job, f'fasta.seed{job.seed}'))
+    success, recorded = run_recorded(job_list, seed=7)
+    assert success
+    assert sorted(stage for stage in recorded if stage[1].startswith('fasta')) == \
+        [(prefix, 'fasta.seed7') for prefix in output_prefixes]
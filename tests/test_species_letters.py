@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+import pytest
+
+from gkm_datagen.species_letters_from_coord import get_species_letters_from_coord
+
+all_chroms = [f'chr{number}' for number in range(1, 23)] + ['chrX', 'chrY']
+# The first species only have X and N, which makes them noninformative for every window
+species = [f'{code}{index}' for index, code in enumerate(['xn'] * 4 + ['sp'] * 96)]
+
+
+def write_alignments(dirname, rng):
+    """
+    Writes the 24 chr*_maf_sequence.csv files, only chr1 and chr7 having positions
+    :return: a dict mapping (chrom, position) to the 100 letters of the position
+    """
+    rows = {}
+    for chrom in all_chroms:
+        with open(os.path.join(dirname, f'{chrom}_maf_sequence.csv'), 'w') as file:
+            file.write(','.join(['pos'] + species) + '\n')
+            if chrom not in ('chr1', 'chr7'):
+                continue
+            for position in 300 + np.cumsum(rng.randint(1, 3, 2000)):
+                letters = list(rng.choice(list('XN'), 4)) + list(rng.choice(list('ACGTacgtnxXN-'), 96))
+                rows[chrom, int(position)] = letters
+                file.write(','.join([str(position)] + letters) + '\n')
+    return rows
+
+
+def extract_coordinate_by_coordinate(coord_filename, rows, ignore_noninformative):
+    """
+    :return: the contents of the species files as get_species_letters_from_coord wrote them
+    one coordinate at a time, for windows of at least 100 bp so that a missing coordinate is N for every species
+    """
+    species_contents = [''] * len(species)
+    informative_contents = [''] * len(species)
+    with open(coord_filename, 'r') as coord_file:
+        for line_index, line in enumerate(coord_file):
+            chrom, start, stop = line.split()[:3]
+            sequences = [''] * len(species)
+            for coordinate in range(int(start), int(stop)):
+                for species_index, letter in enumerate(rows.get((chrom, coordinate), ['N'] * len(species))):
+                    sequences[species_index] += letter
+            for species_index, sequence in enumerate(sequences):
+                is_informative = any(letter not in 'XN' for letter in sequence)
+                if is_informative or not ignore_noninformative:
+                    species_contents[species_index] += f'>{chrom} {start} {stop}\n{sequence}\n'
+                if is_informative:
+                    informative_contents[species_index] += f'{line_index}\n'
+    return species_contents, informative_contents
+
+
+@pytest.mark.parametrize('ignore_noninformative', [False, True])
+@pytest.mark.parametrize('batch_size', [1, 4, 1000])
+def test_species_files_match_coordinate_by_coordinate_extraction(tmp_path, monkeypatch, ignore_noninformative,
+                                                                  batch_size):
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.RandomState(batch_size)
+    rows = write_alignments('.', rng)
+    with open('peaks_pos.coord', 'w') as file:
+        for chrom, start in zip(rng.choice(['chr1', 'chr7'], 11), rng.randint(0, 4600, 11)):
+            file.write(f'{chrom}\t{start}\t{start + rng.randint(100, 150)}\n')
+    os.mkdir('out')
+
+    get_species_letters_from_coord('peaks_pos.coord', 'out', ignore_noninformative, batch_size)
+
+    species_contents, informative_contents = extract_coordinate_by_coordinate('peaks_pos.coord', rows,
+                                                                              ignore_noninformative)
+    dirname = os.path.join('out', 'peaks_pos.coord.mult_species')
+    for species_index, code in enumerate(species):
+        with open(os.path.join(dirname, f'{species_index}_{code}.fa.ir'), 'r') as file:
+            assert file.read() == species_contents[species_index]
+        with open(os.path.join(dirname, f'{species_index}_{code}.informative'), 'r') as file:
+            assert file.read() == informative_contents[species_index]
+    assert informative_contents[0] == ''
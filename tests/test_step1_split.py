@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from coord_partition import get_partition_filename
+from step1_split import SplitRule, get_split_filename, parse_split_rule, split_coordinates
+
+num_train, num_valid = 20, 4
+chroms = ['chr1', 'chr8', 'chr9', 'chrX']
+
+
+def write_coord(filename, num_lines=60, seed=0):
+    rng = np.random.RandomState(seed)
+    with open(filename, 'w') as file:
+        for start in np.sort(rng.randint(0, 100000, num_lines)):
+            file.write(f'{rng.choice(chroms)}\t{start}\t{start + 200}\n')
+
+
+def split_line_by_line(coord_filename):
+    """
+    :return: the lines and rows of every split, as step1_split.run selected them before the split rules,
+    with num_train and num_valid lines for training and validation
+    """
+    splits = {name: ([], []) for name in ['train', 'valid', 'test']}
+    with open(coord_filename, 'r') as file:
+        for row, line in enumerate(file):
+            if row < num_train:
+                name = 'train'
+            elif row < num_train + num_valid:
+                name = 'valid'
+            elif line.split()[0] in ('chr8', 'chr9'):
+                name = 'test'
+            else:
+                continue
+            splits[name][0].append(line)
+            splits[name][1].append(row)
+    return splits
+
+
+@pytest.mark.parametrize('buffer_bytes', [1, 100, 1 << 20])
+def test_default_rules_match_line_by_line_split(tmp_path, monkeypatch, buffer_bytes):
+    monkeypatch.chdir(tmp_path)
+    write_coord('coord')
+    rules = [SplitRule('train', rows=(0, num_train)),
+             SplitRule('valid', rows=(num_train, num_train + num_valid)),
+             parse_split_rule(['test', f'rows={num_train + num_valid}:', 'chroms=chr8,chr9'])]
+
+    line_counts = split_coordinates('coord', rules, buffer_bytes)
+
+    for name, (lines, rows) in split_line_by_line('coord').items():
+        with open(get_split_filename(name), 'r') as file:
+            assert file.readlines() == lines
+        with np.load(get_partition_filename(get_split_filename(name))) as partition:
+            assert partition['rows'].tolist() == rows
+        assert line_counts[name] == len(lines)
+
+
+def test_fractions_depend_only_on_seed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_coord('coord', num_lines=500)
+
+    def get_split_lines(seed, buffer_bytes):
+        split_coordinates('coord', [SplitRule('test', chroms=['chr8']),
+                                    SplitRule('valid', fraction=0.2, seed=seed),
+                                    SplitRule('train')], buffer_bytes)
+        split_lines = {}
+        for name in ['test', 'valid', 'train']:
+            with open(get_split_filename(name), 'r') as file:
+                split_lines[name] = file.readlines()
+        return split_lines
+
+    split_lines = get_split_lines(1, 1 << 20)
+    assert get_split_lines(1, 50) == split_lines
+    assert get_split_lines(2, 1 << 20)['valid'] != split_lines['valid']
+    with open('coord', 'r') as file:
+        lines = file.readlines()
+    # Every line goes to exactly one split
+    assert sorted(sum(split_lines.values(), [])) == sorted(lines)
+    assert all(line.split()[0] == 'chr8' for line in split_lines['test'])
+    assert not any(line.split()[0] == 'chr8' for line in split_lines['valid'] + split_lines['train'])
+    assert 0 < len(split_lines['valid']) < len(split_lines['train'])
+
+
+def test_rules_select_the_same_lines_on_every_pass(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_coord('coord', num_lines=300, seed=4)
+    rules = [SplitRule('valid', fraction=0.3, seed=7), SplitRule('train')]
+
+    def get_split_lines():
+        split_coordinates('coord', rules)
+        with open(get_split_filename('valid'), 'r') as file:
+            return file.readlines()
+
+    assert get_split_lines() == get_split_lines()
+
+
+def test_blank_lines_go_to_no_split(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_coord('coord', num_lines=40, seed=5)
+    with open('coord', 'r') as file:
+        lines = file.readlines()
+    lines[3:3] = ['\n']
+    lines[17:17] = ['\n', '\n']
+    with open('coord', 'w') as file:
+        file.writelines(lines)
+
+    line_counts = split_coordinates('coord', [SplitRule('train', rows=(0, 30)), SplitRule('test')])
+
+    for name in ['train', 'test']:
+        with open(get_split_filename(name), 'r') as file:
+            split_lines = file.readlines()
+        with np.load(get_partition_filename(get_split_filename(name))) as partition:
+            rows = partition['rows'].tolist()
+        # The rows of the index still point at the lines of coord, blank lines included
+        assert split_lines == [lines[row] for row in rows]
+        assert all(line.strip() for line in split_lines)
+        assert line_counts[name] == len(rows)
+    assert sum(line_counts.values()) == 40
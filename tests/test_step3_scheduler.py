@@ -0,0 +1,91 @@
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+import step3_extend
+import step3_extend_counting
+import step3_extend_five_channel
+from step3_scheduler import get_line_ranges, schedule
+
+num_lines = 7
+hdf5_filenames = {'align': 'chr5_train.align.hdf5', 'five_channel': 'chr5_train.hundred.hdf5',
+                  'counting': 'chr5_train.counting.hdf5'}
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """
+    A chr5_maf_sequence.csv of 100 species and the data/chr5_train lines of step2_coord_to_letter.py,
+    in the working directory of the step3 scripts
+    """
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.RandomState(5)
+    species = ['hg19'] + [f'species{index}' for index in range(99)]
+    with open('chr5_maf_sequence.csv', 'w') as file:
+        file.write(','.join(['pos'] + species) + '\n')
+        for position in 20000 + np.cumsum(rng.randint(1, 3, 3000)):
+            file.write(f'{position},' + ','.join(rng.choice(list('ACGTacgtNX'), len(species))) + '\n')
+
+    os.mkdir('data')
+    with open(os.path.join('data', 'chr5_train'), 'w') as file:
+        for start in np.sort(rng.randint(19000, 26000, num_lines)):
+            file.write(f'{start},' + ''.join(rng.choice(list('ACGTacgtN'), 1000)) + '\n')
+    return tmp_path
+
+
+def extend_unsharded(variant, hdf5_filename):
+    if variant == 'align':
+        step3_extend.extend_dataset('chr5', 'train', hdf5_filename=hdf5_filename)
+    elif variant == 'five_channel':
+        step3_extend_five_channel.extend_dataset('chr5', 'train', hdf5_filename=hdf5_filename)
+    else:
+        step3_extend_counting.extend_dataset('chr5', 'train', '.', hdf5_filename=hdf5_filename)
+
+
+def test_line_ranges_cover_the_lines():
+    for line_count in range(1, 12):
+        for num_shards in range(1, 15):
+            line_ranges = get_line_ranges(line_count, num_shards)
+            assert len(line_ranges) == min(line_count, num_shards)
+            assert line_ranges[0][0] == 0 and line_ranges[-1][1] == line_count
+            assert all(first < stop for first, stop in line_ranges)
+            assert all(previous[1] == current[0] for previous, current in zip(line_ranges, line_ranges[1:]))
+    assert get_line_ranges(0, 4) == []
+
+
+def test_merged_shards_match_unsharded_extension(workdir):
+    """
+    Both strands of the five_channel and counting variants are split across the shards,
+    the merged file has to hold the forward strand of every line followed by the reverse complement of every line
+    """
+    variant_names = ['align', 'five_channel', 'counting']
+    assert schedule(variant_names, ['chr5'], ['train'], num_shards=3, num_workers=2)
+
+    for variant in variant_names:
+        extend_unsharded(variant, 'unsharded.hdf5')
+        with h5py.File(hdf5_filenames[variant], 'r') as merged_file:
+            merged_data = merged_file['feature/data'][:]
+        with h5py.File('unsharded.hdf5', 'r') as unsharded_file:
+            unsharded_data = unsharded_file['feature/data'][:]
+        num_strands = 1 if variant == 'align' else 2
+        assert len(merged_data) == num_strands * num_lines
+        assert np.array_equal(merged_data, unsharded_data)
+
+    # Only the merged files are left once the shards are merged
+    assert not [filename for filename in os.listdir('.') if '.shard_' in filename]
+
+
+def test_completed_files_are_skipped(workdir):
+    assert schedule(['five_channel'], ['chr5'], ['train'], num_shards=2, num_workers=1)
+    stamp = os.stat('chr5_train.hundred.hdf5').st_mtime_ns
+    assert schedule(['five_channel'], ['chr5', 'chr6'], ['train', 'valid'], num_shards=2, num_workers=1)
+    assert os.stat('chr5_train.hundred.hdf5').st_mtime_ns == stamp
+
+
+def test_empty_groups_are_skipped(workdir):
+    open(os.path.join('data', 'chr5_valid'), 'w').close()
+    assert schedule(['counting'], ['chr5'], ['train', 'valid'], num_shards=2, num_workers=1)
+    assert os.path.isfile('chr5_train.counting.hdf5')
+    assert not os.path.exists('chr5_valid.counting.hdf5')
@@ -0,0 +1,119 @@
+import os
+
+import numpy as np
+import pytest
+
+from gkm_datagen import transport_files as transport_files_module
+from gkm_datagen.transport_files import transport_files
+
+prefix = 'E003-H3K4me3'
+purposes = ['train', 'test']
+labels = ['pos', 'neg']
+
+
+def write_source(source_dirname, rng, num_lines=40, num_duplicates=0):
+    """
+    Writes the coordinate files of a job and the species files species_letters_from_coord.py extends them into:
+    0_hg19 has a record for every line, all of them informative,
+    1_panTro4 only has the records of its informative lines as with --ignore-noninformative,
+    2_mm10 has a record for every line and no .informative file
+    :param num_duplicates: the number of last lines repeating the coordinates of the first ones
+    """
+    os.makedirs(source_dirname)
+    for purpose in purposes:
+        for label in labels:
+            coord_filename = os.path.join(source_dirname, f'{prefix}.{purpose}.{label}.coord')
+            starts = rng.choice(10 ** 6, num_lines, replace=False)
+            chroms = rng.choice(['chr1', 'chr2', 'chrX'], num_lines)
+            if num_duplicates:
+                starts[-num_duplicates:] = starts[:num_duplicates]
+                chroms[-num_duplicates:] = chroms[:num_duplicates]
+            with open(coord_filename, 'w') as file:
+                file.writelines(f'{chrom}\t{start}\t{start + 100}\n' for chrom, start in zip(chroms, starts))
+
+            species_dirname = coord_filename + '.mult_species'
+            os.makedirs(species_dirname)
+            informative_rows = {'0_hg19': range(num_lines), '1_panTro4': np.flatnonzero(rng.rand(num_lines) < 0.6)}
+            for species in ['0_hg19', '1_panTro4', '2_mm10']:
+                rows = informative_rows.get(species, range(num_lines))
+                with open(os.path.join(species_dirname, f'{species}.fa.ir'), 'w') as file:
+                    for row in rows:
+                        file.write(f'>{chroms[row]} {starts[row]} {starts[row] + 100}\n'
+                                   f'{"".join(rng.choice(list("ACGTN"), 100))}\n')
+                if species in informative_rows:
+                    with open(os.path.join(species_dirname, f'{species}.informative'), 'w') as file:
+                        file.writelines(f'{row}\n' for row in rows)
+
+
+def filter_by_coordinates(downsample_coord_filename, species_filename, informative_filename=None):
+    """
+    :return: the contents of the .fa and .informative files, as transport_files.py wrote them by looking up
+    the (chrom, start, stop) of every record in the downsampled coordinates
+    """
+    with open(downsample_coord_filename, 'r') as coord_file:
+        coord_set = {tuple(line.split()[:3]) for line in coord_file}
+    with open(species_filename, 'r') as species_file:
+        lines = species_file.read().splitlines()
+    informative_lines = [None] * (len(lines) // 2)
+    if informative_filename is not None:
+        with open(informative_filename, 'r') as informative_file:
+            informative_lines = informative_file.read().splitlines()
+
+    fasta, informative = '', ''
+    for header, sequence, informative_line in zip(lines[0::2], lines[1::2], informative_lines):
+        chrom, start, stop = header[1:].split()
+        if (chrom, start, stop) in coord_set:
+            fasta += f'>{chrom}:{start}-{stop}\n{sequence}\n'
+            informative += f'{informative_line}\n'
+    return fasta, informative
+
+
+@pytest.mark.parametrize('downsample_ratio, num_processes, num_duplicates',
+                         [(1., 1, 0), (0.5, 1, 0), (0.3, 2, 0), (0.5, 1, 15)])
+def test_transported_files_match_coordinate_lookup(tmp_path, monkeypatch, downsample_ratio, num_processes,
+                                                   num_duplicates):
+    monkeypatch.setattr(transport_files_module, 'determine_downsample_ratio', lambda num_samples: downsample_ratio)
+    source_dirname = str(tmp_path / 'work' / prefix)
+    target_dirname = str(tmp_path / 'tests' / prefix)
+    write_source(source_dirname, np.random.RandomState(int(downsample_ratio * 10)), num_duplicates=num_duplicates)
+    np.random.seed(0)
+
+    transport_files(source_dirname, target_dirname, num_processes)
+
+    for purpose in purposes:
+        for label in labels:
+            coord_name = f'{prefix}.{purpose}.{label}.coord'
+            source_sub_dirname = os.path.join(source_dirname, f'{coord_name}.mult_species')
+            target_sub_dirname = os.path.join(target_dirname, f'{coord_name}.mult_species.at1.00')
+            downsample_coord_filename = os.path.join(target_sub_dirname, f'{coord_name}.at1.00')
+            with open(downsample_coord_filename, 'r') as file:
+                assert len(file.readlines()) == int(40 * downsample_ratio)
+
+            for species in ['0_hg19', '1_panTro4', '2_mm10']:
+                informative_filename = os.path.join(source_sub_dirname, f'{species}.informative')
+                has_informative = os.path.isfile(informative_filename)
+                fasta, informative = filter_by_coordinates(downsample_coord_filename,
+                                                           os.path.join(source_sub_dirname, f'{species}.fa.ir'),
+                                                           informative_filename if has_informative else None)
+                with open(os.path.join(target_sub_dirname, f'{species[0]}_{purpose}_{label}.fa'), 'r') as file:
+                    assert file.read() == fasta
+                target_informative_filename = os.path.join(target_sub_dirname, f'{species}.informative')
+                assert os.path.isfile(target_informative_filename) == has_informative
+                if has_informative:
+                    with open(target_informative_filename, 'r') as file:
+                        assert file.read() == informative
+
+
+def test_records_off_their_coordinate_lines_are_rejected(tmp_path):
+    source_dirname = str(tmp_path / 'work' / prefix)
+    write_source(source_dirname, np.random.RandomState(25))
+    species_filename = os.path.join(source_dirname, f'{prefix}.test.neg.coord.mult_species', '2_mm10.fa.ir')
+    with open(species_filename, 'r') as file:
+        lines = file.read().splitlines(keepends=True)
+    # The same number of records, but the first two are swapped
+    lines[0:4] = lines[2:4] + lines[0:2]
+    with open(species_filename, 'w') as file:
+        file.writelines(lines)
+
+    with pytest.raises(ValueError, match=r'Record 0 of .*2_mm10\.fa\.ir'):
+        transport_files(source_dirname, str(tmp_path / 'tests' / prefix))
@@ -0,0 +1,118 @@
+import h5py
+import numpy as np
+import pytest
+
+import step3_extend_counting
+import step3_extend_five_channel
+from nucleotide_mapping import complement_mapping, map_counts_to_revcomp_vec, map_counts_to_vec, mapping
+from window_encoding import complement_onehot_table, count_letters_with_revcomp, encode_window, onehot_table, \
+    to_letter_codes
+
+# Every letter of nucleotide_mapping.mapping, as the per-letter loops could only encode those
+letters = ''.join(mapping)
+window_starts = [4700, 5400, 6050, 7800]
+seq_len = 1000
+
+
+class Alignment:
+    """
+    A chr1_maf_sequence.csv of 100 species with hg19 in the middle, and the data/chr1_train lines of
+    step2_coord_to_letter.py for windows that partly fall outside of it
+    """
+    def __init__(self, dirname, seed=0):
+        rng = np.random.RandomState(seed)
+        self.species = [f'sp{index}' for index in range(30)] + ['hg19'] + [f'sp{index}' for index in range(30, 99)]
+        self.rows = {}
+        for position in 5000 + np.cumsum(rng.randint(1, 4, 1000)):
+            self.rows[int(position)] = list(rng.choice(list(letters), len(self.species)))
+        with open(dirname / 'chr1_maf_sequence.csv', 'w') as file:
+            file.write(','.join(['pos'] + self.species) + '\n')
+            for position, row in self.rows.items():
+                file.write(','.join([str(position)] + row) + '\n')
+
+        self.sequences = [''.join(rng.choice(list(letters), seq_len)) for _ in window_starts]
+        (dirname / 'data').mkdir()
+        with open(dirname / 'data' / 'chr1_train', 'w') as file:
+            for start, sequence in zip(window_starts, self.sequences):
+                file.write(f'{start + 400},{sequence}\n')
+
+    def get_non_human_letters(self, coordinate):
+        if coordinate not in self.rows:
+            return None
+        return [letter for name, letter in zip(self.species, self.rows[coordinate]) if name != 'hg19']
+
+
+def encode_letter_by_letter(alignment, window_start, sequence):
+    # As step3_extend_five_channel.py encoded a window before the lookup tables
+    matrix = np.zeros((seq_len, 100, 5), dtype='uint8')
+    revcomp_matrix = np.zeros((seq_len, 100, 5), dtype='uint8')
+    for bp_index, hg_letter in enumerate(sequence):
+        matrix[bp_index, 0] = mapping[hg_letter]
+        revcomp_matrix[seq_len - 1 - bp_index, 0] = complement_mapping[hg_letter]
+        non_human_letters = alignment.get_non_human_letters(window_start + bp_index)
+        if non_human_letters is None:
+            matrix[bp_index, 1:] = mapping['X']
+            revcomp_matrix[seq_len - 1 - bp_index, 1:] = complement_mapping['X']
+            continue
+        for species_index, letter in enumerate(non_human_letters, 1):
+            matrix[bp_index, species_index] = mapping[letter]
+            revcomp_matrix[seq_len - 1 - bp_index, species_index] = complement_mapping[letter]
+    return matrix, revcomp_matrix
+
+
+def count_letter_by_letter(alignment, window_start, sequence):
+    # As step3_extend_counting.py counted a window before the lookup tables
+    matrix = np.zeros((seq_len, 2, 5), dtype='uint8')
+    revcomp_matrix = np.zeros((seq_len, 2, 5), dtype='uint8')
+    for bp_index, hg_letter in enumerate(sequence):
+        matrix[bp_index, 0] = mapping[hg_letter]
+        revcomp_matrix[seq_len - 1 - bp_index, 0] = complement_mapping[hg_letter]
+        non_human_letters = alignment.get_non_human_letters(window_start + bp_index)
+        counts = dict(a=0, g=0, c=0, t=0, x=99)
+        if non_human_letters is not None:
+            uppers = [letter.upper() for letter in non_human_letters]
+            counts = dict(a=uppers.count('A'), g=uppers.count('G'), c=uppers.count('C'), t=uppers.count('T'),
+                          x=uppers.count('X') + uppers.count('N'))
+        matrix[bp_index, 1] = map_counts_to_vec(**counts)
+        revcomp_matrix[seq_len - 1 - bp_index, 1] = map_counts_to_revcomp_vec(**counts)
+    return matrix, revcomp_matrix
+
+
+def test_tables_match_letter_mappings():
+    codes = to_letter_codes(letters)
+    matrix, revcomp_matrix = encode_window(codes, onehot_table, complement_onehot_table)
+    assert np.array_equal(matrix, [mapping[letter] for letter in letters])
+    assert np.array_equal(revcomp_matrix, [complement_mapping[letter] for letter in reversed(letters)])
+
+
+def test_letter_counts_match_count_vectors():
+    rng = np.random.RandomState(1)
+    window = rng.choice(to_letter_codes(letters), (50, 99))
+    counts, revcomp_counts = count_letters_with_revcomp(window)
+    for bp_index, row in enumerate(window):
+        uppers = row.tobytes().decode('ascii').upper()
+        count_dict = dict(a=uppers.count('A'), g=uppers.count('G'), c=uppers.count('C'), t=uppers.count('T'),
+                          x=uppers.count('X') + uppers.count('N'))
+        assert np.array_equal(counts[bp_index], map_counts_to_vec(**count_dict))
+        assert np.array_equal(revcomp_counts[len(window) - 1 - bp_index], map_counts_to_revcomp_vec(**count_dict))
+
+
+@pytest.mark.parametrize('extender, hdf5_filename, encode', [
+    (lambda: step3_extend_five_channel.extend_dataset('chr1', 'train'), 'chr1_train.hundred.hdf5',
+     encode_letter_by_letter),
+    (lambda: step3_extend_counting.extend_dataset('chr1', 'train', '.'), 'chr1_train.counting.hdf5',
+     count_letter_by_letter),
+])
+def test_extended_features_match_letter_by_letter_encoding(tmp_path, monkeypatch, extender, hdf5_filename, encode):
+    monkeypatch.chdir(tmp_path)
+    alignment = Alignment(tmp_path)
+
+    extender()
+
+    with h5py.File(hdf5_filename, 'r') as hdf5_file:
+        feature_data = hdf5_file['feature/data'][:]
+    assert len(feature_data) == 2 * len(window_starts)
+    for line_index, (window_start, sequence) in enumerate(zip(window_starts, alignment.sequences)):
+        matrix, revcomp_matrix = encode(alignment, window_start, sequence)
+        assert np.array_equal(feature_data[line_index], matrix)
+        assert np.array_equal(feature_data[line_index + len(window_starts)], revcomp_matrix)
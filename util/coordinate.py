@@ -0,0 +1,119 @@
+import os
+
+import numpy as np
+
+from coord_partition import load_coord_partition
+from genome_store import GenomeStore
+from util.file import get_line_count
+
+
+def iterate_coordinate_lines(coordinate_filename, sort_by_start=False, line_range=None):
+    """
+    Iterates over the lines of a coordinate file such as data/chr1_train, each line being of the form start,sequence
+
+    :param coordinate_filename: e.g. data/chr1_train
+    :param sort_by_start: if True, the lines are visited in increasing order of their start coordinates,
+    with lines sharing the same start coordinate visited in file order.
+    Only the start coordinates and byte offsets are kept in memory, the sequences are read back on demand.
+    :param line_range: (first_line, stop_line) to only visit the lines in [first_line, stop_line),
+    defaults to all the lines.
+    :return: a generator of (line_index, start_coordinate, sequence) where line_index is the index of the line
+    relative to first_line, so that the outputs can be written back to the rows corresponding to the original order.
+    """
+    first_line, stop_line = line_range if line_range is not None else (0, None)
+
+    if not sort_by_start:
+        with open(coordinate_filename, 'r') as file:
+            for line_index, line in enumerate(file):
+                if stop_line is not None and line_index >= stop_line:
+                    break
+                if line_index < first_line:
+                    continue
+                start_coordinate, sequence = line.strip().split(',')
+                yield line_index - first_line, int(start_coordinate), sequence
+        return
+
+    start_coordinates = []
+    byte_offsets = []
+    with open(coordinate_filename, 'rb') as file:
+        byte_offset = 0
+        for line_index, line in enumerate(file):
+            if stop_line is not None and line_index >= stop_line:
+                break
+            if line_index >= first_line:
+                start_coordinates.append(int(line[:line.index(b',')]))
+                byte_offsets.append(byte_offset)
+            byte_offset += len(line)
+
+        # sorted is stable so lines with the same start coordinate stay in file order
+        for line_index in sorted(range(len(start_coordinates)), key=start_coordinates.__getitem__):
+            file.seek(byte_offsets[line_index])
+            start_coordinate, sequence = file.readline().decode('ascii').strip().split(',')
+            yield line_index, int(start_coordinate), sequence
+
+
+def iterate_coordinate_blocks(coord_filename, block_size):
+    """
+    :param coord_filename: a file whose lines start with chromosome start end_exclusive
+    :return: a generator of (first_line_index, chroms, starts, ends) for blocks of block_size lines,
+    read from the partition index of the file, see coord_partition.load_coord_partition
+    """
+    return load_coord_partition(coord_filename).iterate_blocks(block_size)
+
+
+def read_chrom_starts(coord_filename, chrom):
+    """
+    :param coord_filename: a file whose lines are of the form chromosome start end_exclusive, e.g. train_coord
+    :return: an int64 array of the starts of the lines of the chromosome in file order
+    """
+    return load_coord_partition(coord_filename).get_chrom_starts(chrom)
+
+
+def iterate_genome_coordinate_lines(starts, chrom, genome_store, flanking_bp=400, window_length=1000,
+                                    sort_by_start=False, block_size=10000):
+    """
+    Same as iterate_coordinate_lines for the lines step2_coord_to_letter.py would write, with the human letters
+    sliced from the genome store instead of parsed from the text file.
+
+    :param starts: the start coordinates of the lines, see read_chrom_starts
+    :param genome_store: a genome_store.GenomeStore
+    :return: a generator of (line_index, start_coordinate, sequence) where sequence is the bytes of the
+    window_length letters starting flanking_bp before start_coordinate, padded with N out of the chromosome
+    """
+    order = np.argsort(starts, kind='stable') if sort_by_start else np.arange(len(starts))
+    for block_start in range(0, len(order), block_size):
+        line_indices = order[block_start:block_start + block_size]
+        windows, _ = genome_store.get_windows(chrom, starts[line_indices] - flanking_bp, window_length)
+        for line_index, window in zip(line_indices, windows):
+            yield int(line_index), int(starts[line_index]), window.tobytes()
+
+
+def open_coordinate_lines(chrom, purpose, sort_by_start=False, line_range=None, twobit_filename=None):
+    """
+    :param twobit_filename: None to read data/{chrom}_{purpose} written by step2_coord_to_letter.py,
+    otherwise the lines of the chromosome in {purpose}_coord are read and their human letters are sliced from
+    the genome_store.GenomeStore of the 2bit file, which yields the same lines without the intermediate file
+    :return: (coordinate_filename, line_count, lines) where lines is a generator as returned by
+    iterate_coordinate_lines and line_count is the number of lines it yields
+    """
+    if twobit_filename is None:
+        coordinate_filename = os.path.join('data', f'{chrom}_{purpose}')
+        if line_range is None:
+            line_count = get_line_count(coordinate_filename)
+        else:
+            line_count = line_range[1] - line_range[0]
+        return coordinate_filename, line_count, iterate_coordinate_lines(coordinate_filename, sort_by_start,
+                                                                         line_range)
+
+    coordinate_filename = f'{purpose}_coord'
+    starts = read_chrom_starts(coordinate_filename, chrom)
+    if line_range is not None:
+        starts = starts[line_range[0]:line_range[1]]
+    lines = iterate_genome_coordinate_lines(starts, chrom, GenomeStore(twobit_filename), sort_by_start=sort_by_start)
+    return coordinate_filename, len(starts), lines
+
+
+def add_genome_arguments(parser):
+    parser.add_argument('--twobit', default=None,
+                        help='e.g. hg19.2bit, read the coordinates from {purpose}_coord and the human letters from '
+                             'this genome instead of data/{chrom}_{purpose}, see genome_store.py')
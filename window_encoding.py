@@ -0,0 +1,132 @@
+import numpy as np
+
+from nucleotide_mapping import mapping, complement_mapping
+
+# A G C T X
+# map_counts_to_revcomp_vec as a permutation of the count channels
+revcomp_count_permutation = [3, 2, 1, 0, 4]
+
+
+def build_lookup_table(letter_mapping):
+    """
+    :param letter_mapping: maps each letter to its encoding, e.g. nucleotide_mapping.mapping
+    :return: a 256 x feature_dim uint8 table such that table[ord(letter)] is the encoding of the letter.
+    Letters absent from the mapping are encoded as all zeros.
+    """
+    feature_dim = len(next(iter(letter_mapping.values())))
+    table = np.zeros((256, feature_dim), dtype='uint8')
+    for letter, encoding in letter_mapping.items():
+        table[ord(letter)] = encoding
+    return table
+
+
+onehot_table = build_lookup_table(mapping)
+complement_onehot_table = build_lookup_table(complement_mapping)
+
+# The four channel encoding used by step3_extend drops the X channel, so that X is encoded as all zeros.
+four_channel_table = np.ascontiguousarray(onehot_table[:, :4])
+complement_four_channel_table = np.ascontiguousarray(complement_onehot_table[:, :4])
+
+# Both X and N are counted in the X channel.
+counting_table = build_lookup_table({
+    **{letter: mapping[letter] for letter in 'agctAGCT'},
+    **{letter: mapping['X'] for letter in 'xXnN'}
+})
+
+# Nucleotide codes for the compact storage of the five channel features, a code per (position, species)
+# A G C T X take the index of their channel and every other letter, e.g. N, is encoded as all zeros
+nucleotide_codes = 'AGCTXN'
+num_nucleotide_codes = len(nucleotide_codes)
+zero_code = nucleotide_codes.index('N')
+code_table = np.where(onehot_table.any(axis=1), onehot_table.argmax(axis=1), zero_code).astype('uint8')
+
+# code_onehot_table[code] is the one-hot encoding of the code
+code_onehot_table = np.zeros((num_nucleotide_codes, 5), dtype='uint8')
+code_onehot_table[np.arange(5), np.arange(5)] = 1
+# complement_code_table[code] is the code of the complement
+complement_code_table = np.array([nucleotide_codes.index(letter) for letter in 'TCGAXN'], dtype='uint8')
+bits_per_code = 3
+
+
+def to_letter_codes(sequence):
+    """
+    :param sequence: a str or bytes of nucleotide letters
+    :return: a uint8 array holding the ASCII code of each letter
+    """
+    if isinstance(sequence, str):
+        sequence = sequence.encode('ascii')
+    return np.frombuffer(sequence, dtype='uint8')
+
+
+def encode_window(letters, table, complement_table):
+    """
+    :param letters: a uint8 array of ASCII letters whose first axis is the base pair axis,
+    e.g. seq_len x num_species
+    :param table: a lookup table created by build_lookup_table
+    :param complement_table: the lookup table for the complement strand
+    :return: (matrix, revcomp_matrix) each of shape letters.shape + (feature_dim,),
+    where revcomp_matrix is the encoding of the reverse complement strand
+    """
+    return table[letters], complement_table[letters[::-1]]
+
+
+def count_letters(letters):
+    """
+    :param letters: a seq_len x num_species uint8 array of ASCII letters
+    :return: a seq_len x 5 uint8 array counting the A G C T X letters at each base pair,
+    where X and N are both counted as X
+    """
+    return counting_table[letters].sum(axis=1, dtype='uint8')
+
+
+def count_letters_with_revcomp(letters):
+    """
+    :return: (counts, revcomp_counts) where revcomp_counts are the counts on the reverse complement strand
+    """
+    counts = count_letters(letters)
+    return counts, counts[::-1, revcomp_count_permutation]
+
+
+def reverse_complement_codes(codes, axis=0):
+    """
+    :param codes: nucleotide codes whose given axis is the base pair axis
+    :return: the codes of the reverse complement strand
+    """
+    return complement_code_table[np.flip(codes, axis)]
+
+
+def get_num_packed_bytes(num_codes):
+    return (num_codes * bits_per_code + 7) // 8
+
+
+def pack_codes(codes):
+    """
+    :param codes: an array of nucleotide codes
+    :return: a uint8 vector of get_num_packed_bytes(codes.size) bytes holding the codes in C order,
+    bits_per_code bits each with the most significant bit first
+    """
+    bits = np.unpackbits(np.ascontiguousarray(codes, dtype='uint8').reshape(-1, 1), axis=1)[:, 8 - bits_per_code:]
+    return np.packbits(bits)
+
+
+def unpack_codes(packed, sample_shape):
+    """
+    :param packed: uint8 array whose last axis holds the bytes returned by pack_codes,
+    the leading axes being e.g. a batch axis
+    :param sample_shape: the shape of the packed codes, e.g. (seq_len, num_species)
+    :return: the codes of shape packed.shape[:-1] + sample_shape
+    """
+    num_codes = int(np.prod(sample_shape))
+    bits = np.unpackbits(packed, axis=-1)[..., :num_codes * bits_per_code]
+    bits = bits.reshape(packed.shape[:-1] + (num_codes, bits_per_code))
+    codes = np.zeros(bits.shape[:-1], dtype='uint8')
+    for bit_index in range(bits_per_code):
+        codes = (codes << 1) | bits[..., bit_index]
+    return codes.reshape(packed.shape[:-1] + tuple(sample_shape))
+
+
+def decode_codes(codes):
+    """
+    :return: the one-hot encoding of the codes, of shape codes.shape + (5,)
+    """
+    return code_onehot_table[codes]